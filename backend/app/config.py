@@ -18,7 +18,22 @@ class Settings(BaseSettings):
     recovery_count: int = 3
 
     batch_write_interval: float = 1.0
+    buffer_max_samples: int = 1_000_000
+    buffer_overflow_policy: str = "drop_oldest"  # drop_oldest, downsample or block
     cleanup_interval: int = 3600
+    cleanup_chunk_size: int = 5000
+    cleanup_chunk_pause: float = 0.05
+    cleanup_time_budget: float = 60.0
+    storage_engine: str = "rows"  # rows, or blocks to compress closed minutes of samples
+    compaction_interval: int = 60
+    graph_max_points: int = 1000
+    live_interval: float = 1.0
+    discovery_rate: int = 2000  # ARP requests per second and interface
+    nmap_workers: int = 4
+    nmap_cache_ttl: int = 3600
+    live_queue_size: int = 100
+    export_page_size: int = 10000
+    probe_socket: str = ""  # Unix socket of a separate probe process (python -m app.prober); empty probes in the API
 
     model_config = {"env_prefix": "BADPING_"}
 
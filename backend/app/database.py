@@ -26,7 +26,10 @@ async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit
 
 
 async def init_db() -> None:
-    from .models import Device, PingResult, Notification  # noqa: F401
+    from .models import Device, LatencyHistogram, Meta, PingRollup, Notification  # noqa: F401
+    from .services.histogram_service import backfill_histograms
+    from .services.rollup_service import backfill_rollups
+    from .services.sample_store import compact_partitions, load_partitions, migrate_legacy_samples
 
     async with engine.begin() as conn:
         # Try WAL mode, fall back to DELETE if filesystem doesn't support it (e.g. FUSE/NFS)
@@ -40,6 +43,8 @@ async def init_db() -> None:
         except Exception as e:
             logger.warning("Failed to set WAL mode: %s, using default journal mode", e)
 
+        # Only takes effect on a new database (or after VACUUM); lets dropped partitions shrink the file
+        await conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
         await conn.execute(text("PRAGMA synchronous=NORMAL"))
         await conn.execute(text("PRAGMA cache_size=-64000"))
         await conn.execute(text("PRAGMA busy_timeout=5000"))
@@ -56,6 +61,20 @@ async def init_db() -> None:
             except Exception:
                 pass  # Column already exists
 
+        await backfill_rollups(conn)
+        await load_partitions(conn)
+        migrated = await compact_partitions(conn)
+        migrated = await migrate_legacy_samples(conn) or migrated
+
+    # In transactions of its own, so it doesn't hold the write lock throughout
+    await backfill_histograms(engine)
+
+    if migrated:
+        # Rewrite the file once so the old table's pages are released and auto_vacuum applies
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("VACUUM"))
+
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
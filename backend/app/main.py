@@ -3,23 +3,59 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from .config import settings
 from .database import init_db
-from .routers import devices, notifications, stats
-from .services.arp_service import is_arp_available
+from .routers import devices, live, notifications, stats
+from .services.arp_service import check_arp_available, start_arp_check
 from .services.cleanup_service import CleanupService
+from .services.compaction_service import CompactionService
+from .services.device_registry import device_registry
+from .services.live_feed import live_feed
 from .services.monitor_service import MonitorService
+from .services.nmap_service import scan_scheduler
+from .services.probe_link import ProbeClient
+from .services.sample_store import follow_partitions
+from .services.stats_service import stats_engine
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    monitor = MonitorService()
-    cleanup = CleanupService()
+    if settings.probe_socket:
+        # Probing, cleanup and compaction run in the probe process (python -m app.prober),
+        # which migrates the database before it accepts the connection start() waits for.
+        # It also creates and drops the sample partitions, so reads look them up each time
+        follow_partitions()
+        monitor = ProbeClient(settings.probe_socket)
+        await monitor.start()
+        await device_registry.load()
+        cleanup = compaction = None
+    else:
+        await init_db()
+        await device_registry.load()
+        # Probing starts while the stats engine loads its history in the background
+        stats_engine.start_rebuild()
+        monitor = MonitorService()
+        cleanup = CleanupService()
+        compaction = CompactionService() if settings.storage_engine == "blocks" else None
+        await monitor.start()
+        cleanup.start()
+    # /api/status waits for the ARP check if it's still running
+    start_arp_check()
     app.state.monitor_service = monitor
-    await monitor.start()
-    cleanup.start()
+    app.state.cleanup_service = cleanup
+    app.state.compaction_service = compaction
+    live_feed.start()
+    scan_scheduler.start()
+    if compaction:
+        compaction.start()
     yield
-    cleanup.stop()
+    stats_engine.stop()
+    scan_scheduler.stop()
+    live_feed.stop()
+    if compaction:
+        compaction.stop()
+    if cleanup:
+        cleanup.stop()
     await monitor.stop()
 
 
@@ -36,6 +72,7 @@ app.add_middleware(
 app.include_router(devices.router, prefix="/api")
 app.include_router(stats.router, prefix="/api")
 app.include_router(notifications.router, prefix="/api")
+app.include_router(live.router, prefix="/api")
 
 
 @app.get("/api/health")
@@ -43,8 +80,23 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/api/metrics")
+async def metrics():
+    monitor: MonitorService | ProbeClient = app.state.monitor_service
+    cleanup: CleanupService | None = app.state.cleanup_service
+    compaction: CompactionService | None = app.state.compaction_service
+    return {
+        "cleanup": cleanup.stats() if cleanup else None,
+        "compaction": compaction.stats() if compaction else None,
+        # With a probe process: its scheduler, buffer, cleanup and compaction, and the link
+        **await monitor.metrics(),
+        "live": live_feed.stats(),
+        "nmap": scan_scheduler.stats(),
+    }
+
+
 @app.get("/api/status")
 async def status():
     return {
-        "arp_available": is_arp_available(),
+        "arp_available": await check_arp_available(),
     }
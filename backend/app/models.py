@@ -1,10 +1,13 @@
 import time
 
-from sqlalchemy import Boolean, Float, ForeignKey, Index, Integer, String, Text
+from sqlalchemy import Boolean, Float, ForeignKey, Integer, LargeBinary, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
+# Ping types in their compact code order (code = index)
+PING_TYPES = ("icmp", "arp")
+
 
 class Device(Base):
     __tablename__ = "devices"
@@ -28,30 +31,51 @@ class Device(Base):
     created_at: Mapped[float] = mapped_column(Float, nullable=False, default=time.time)
     updated_at: Mapped[float] = mapped_column(Float, nullable=False, default=time.time, onupdate=time.time)
 
-    ping_results: Mapped[list["PingResult"]] = relationship(
-        back_populates="device", cascade="all, delete-orphan"
-    )
     notifications: Mapped[list["Notification"]] = relationship(
         back_populates="device", cascade="all, delete-orphan"
     )
 
 
-class PingResult(Base):
-    __tablename__ = "ping_results"
-    __table_args__ = (
-        Index("idx_ping_results_device_time", "device_id", "timestamp"),
-    )
+class PingRollup(Base):
+    """Pre-aggregated ping samples per device, ping type and time bucket."""
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    device_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False
-    )
-    timestamp: Mapped[float] = mapped_column(Float, nullable=False, default=time.time)
-    ping_type: Mapped[str] = mapped_column(String, nullable=False)
-    latency_ms: Mapped[float | None] = mapped_column(Float, nullable=True)
-    packet_lost: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    __tablename__ = "ping_rollups"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    device_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ping_type: Mapped[str] = mapped_column(String, primary_key=True)
+    resolution: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket_ts: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    lost: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    latency_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    latency_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    latency_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    latency_sumsq: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+
+
+class LatencyHistogram(Base):
+    """Log-bucketed latency histogram of one device, ping type and minute."""
+
+    __tablename__ = "latency_histograms"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    device_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ping_type: Mapped[str] = mapped_column(String, primary_key=True)
+    bucket_ts: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Sum and number of absolute latency differences between consecutive replies
+    jitter_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    jitter_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class Meta(Base):
+    """Key/value flags of the database itself, such as one-off migrations that have run."""
+
+    __tablename__ = "meta"
 
-    device: Mapped["Device"] = relationship(back_populates="ping_results")
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[str] = mapped_column(String, nullable=False)
 
 
 class Notification(Base):
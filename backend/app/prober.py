@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import signal
+
+from .config import settings
+from .database import init_db
+from .services.cleanup_service import CleanupService
+from .services.compaction_service import CompactionService
+from .services.device_registry import device_registry
+from .services.monitor_service import MonitorService
+from .services.probe_link import ProbeServer
+from .services.stats_service import stats_engine
+
+logger = logging.getLogger(__name__)
+
+
+async def run() -> None:
+    """Probe, write samples and keep the database tidy for the API workers on settings.probe_socket."""
+    await init_db()
+    await device_registry.load()
+    stats_engine.start_rebuild()
+    monitor = MonitorService()
+    cleanup = CleanupService()
+    compaction = CompactionService() if settings.storage_engine == "blocks" else None
+    server = ProbeServer(monitor, lambda: {
+        "cleanup": cleanup.stats(),
+        "compaction": compaction.stats() if compaction else None,
+    })
+    await server.start(settings.probe_socket)
+    await monitor.start()
+    cleanup.start()
+    if compaction:
+        compaction.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    logger.info("Probe process shutting down")
+    await server.stop()
+    stats_engine.stop()
+    if compaction:
+        compaction.stop()
+    cleanup.stop()
+    await monitor.stop()
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=settings.log_level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    if not settings.probe_socket:
+        raise SystemExit("BADPING_PROBE_SOCKET must be set to the socket the API connects to")
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
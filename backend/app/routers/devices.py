@@ -2,12 +2,13 @@ import asyncio
 import json
 import time
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy import Integer, func, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..database import async_session, get_session
-from ..models import Device, PingResult
+from ..models import Device, LatencyHistogram, PingRollup
 from ..schemas import (
     CheckResult,
     DeviceCheck,
@@ -16,47 +17,35 @@ from ..schemas import (
     DeviceUpdate,
     DeviceWithStats,
     DiscoverRequest,
-    DiscoveredDevice,
+    DiscoveryJobResponse,
 )
-from ..services.arp_service import discover_network, is_same_subnet, mac_vendor_lookup
+from ..services.arp_service import is_same_subnet, mac_vendor_lookup
+from ..services.device_registry import device_registry
+from ..services.discovery_service import cancel_job, get_job, start_discovery
 from ..services.monitor_service import MonitorService
-from ..services.nmap_service import basic_scan, nmap_scan
+from ..services.nmap_service import PRIORITY_BULK, PRIORITY_USER, scan_scheduler
+from ..services.sample_store import delete_device_samples
+from ..services.stats_service import window_stats
 from ..services.ping_service import icmp_ping
 
 router = APIRouter(tags=["devices"])
 
 
-async def _calc_loss_pct(session: AsyncSession, device_id: int, seconds: int) -> float | None:
-    cutoff = time.time() - seconds
-    result = await session.execute(
-        select(
-            func.count().label("total"),
-            func.sum(PingResult.packet_lost.cast(Integer)).label("lost"),
-        ).where(
-            PingResult.device_id == device_id,
-            PingResult.timestamp >= cutoff,
-        )
-    )
-    row = result.one()
-    total = row.total or 0
-    lost = row.lost or 0
-    if total == 0:
-        return None
-    return round(lost / total * 100, 2)
-
-
 @router.get("/devices", response_model=list[DeviceWithStats])
 async def list_devices(session: AsyncSession = Depends(get_session)):
     result = await session.execute(select(Device).order_by(Device.name))
     devices = result.scalars().all()
 
+    stats = window_stats([device.id for device in devices])
+
     out = []
     for device in devices:
         d = DeviceWithStats.model_validate(device)
-        d.stats_6h = await _calc_loss_pct(session, device.id, 21600)
-        d.stats_12h = await _calc_loss_pct(session, device.id, 43200)
-        d.stats_24h = await _calc_loss_pct(session, device.id, 86400)
-        d.stats_48h = await _calc_loss_pct(session, device.id, 172800)
+        windows = stats[device.id]
+        d.stats_6h = windows["6h"].loss_pct()
+        d.stats_12h = windows["12h"].loss_pct()
+        d.stats_24h = windows["24h"].loss_pct()
+        d.stats_48h = windows["48h"].loss_pct()
         out.append(d)
     return out
 
@@ -71,9 +60,12 @@ async def create_device(
     session.add(device)
     await session.commit()
     await session.refresh(device)
+    device_registry.update(device)
 
     if device.ip_address:
-        asyncio.create_task(_run_nmap_for_device(device.id, device.ip_address, device.fingerprint_enabled))
+        asyncio.create_task(_run_nmap_for_device(
+            device.id, device.ip_address, device.mac_address, device.fingerprint_enabled, PRIORITY_BULK,
+        ))
 
     if device.monitoring_enabled:
         monitor: MonitorService = request.app.state.monitor_service
@@ -82,32 +74,90 @@ async def create_device(
     return DeviceResponse.model_validate(device)
 
 
-async def _run_nmap_for_device(device_id: int, ip_address: str, fingerprint_enabled: bool = False) -> None:
-    if fingerprint_enabled:
-        result = await nmap_scan(ip_address)
-    else:
-        result = await basic_scan(ip_address)
+@router.post("/devices/bulk", response_model=list[DeviceResponse])
+async def create_devices(
+    data: list[DeviceCreate],
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+):
+    """Add many devices at once, e.g. everything a discovery found; the new devices without
+    fingerprinting are scanned together by batched nmap runs."""
+    devices = [Device(**item.model_dump()) for item in data]
+    session.add_all(devices)
+    await session.commit()
+    # One query to reload the new rows instead of a refresh per device; populate_existing
+    # only applies to the objects the result yields, so it has to be read
+    result = await session.execute(
+        select(Device).where(Device.id.in_([device.id for device in devices]))
+        .execution_options(populate_existing=True)
+    )
+    result.scalars().all()
+
+    monitor: MonitorService = request.app.state.monitor_service
+    batch = {}
+    for device in devices:
+        device_registry.update(device)
+        if device.ip_address and device.fingerprint_enabled:
+            asyncio.create_task(_run_nmap_for_device(
+                device.id, device.ip_address, device.mac_address, True, PRIORITY_BULK,
+            ))
+        elif device.ip_address:
+            batch[device.id] = (device.ip_address, device.mac_address)
+        if device.monitoring_enabled:
+            monitor.start_device(device.id)
+
+    if batch:
+        asyncio.create_task(_run_batch_nmap_for_devices(batch))
+    return [DeviceResponse.model_validate(device) for device in devices]
+
+
+async def _run_nmap_for_device(
+    device_id: int,
+    ip_address: str,
+    mac_address: str | None,
+    fingerprint_enabled: bool = False,
+    priority: int = PRIORITY_BULK,
+    force: bool = False,
+) -> None:
+    result = await scan_scheduler.scan(ip_address, fingerprint_enabled, mac_address, priority, force)
     async with async_session() as session:
         device = await session.get(Device, device_id)
         if device:
-            if result.get("mac_address") and not device.mac_address:
-                device.mac_address = result["mac_address"]
-            if result.get("manufacturer"):
-                device.manufacturer = result["manufacturer"]
-            if result.get("os_info"):
-                device.os_info = result["os_info"]
-            if result.get("device_type"):
-                device.device_type = result["device_type"]
-            # Manufacturer fallback: if nmap returned "Unknown" or nothing, try scapy OUI lookup
-            mac = result.get("mac_address") or device.mac_address
-            if mac and (not device.manufacturer or device.manufacturer.lower() == "unknown"):
-                vendor = mac_vendor_lookup(mac)
-                if vendor:
-                    device.manufacturer = vendor
-            device.nmap_raw = json.dumps(result)
+            _apply_scan_result(device, result)
             await session.commit()
 
 
+async def _run_batch_nmap_for_devices(targets: dict[int, tuple[str, str | None]]) -> None:
+    """Scan the devices' IPs in batches and store all results in one transaction."""
+    results = await scan_scheduler.scan_batch({ip: mac for ip, mac in targets.values()})
+    async with async_session() as session:
+        devices = await session.execute(select(Device).where(Device.id.in_(list(targets))))
+        for device in devices.scalars():
+            # The device may have been edited while its scan was queued
+            result = results.get(targets[device.id][0])
+            if result is not None and device.ip_address == targets[device.id][0]:
+                _apply_scan_result(device, result)
+        await session.commit()
+
+
+def _apply_scan_result(device: Device, result: dict) -> None:
+    if result.get("mac_address") and not device.mac_address:
+        device.mac_address = result["mac_address"]
+    if result.get("manufacturer"):
+        device.manufacturer = result["manufacturer"]
+    if result.get("os_info"):
+        device.os_info = result["os_info"]
+    if result.get("device_type"):
+        device.device_type = result["device_type"]
+    # Manufacturer fallback: if nmap returned "Unknown" or nothing, try scapy OUI lookup
+    mac = result.get("mac_address") or device.mac_address
+    if mac and (not device.manufacturer or device.manufacturer.lower() == "unknown"):
+        vendor = mac_vendor_lookup(mac)
+        if vendor:
+            device.manufacturer = vendor
+    device.nmap_raw = json.dumps(result)
+
+
 @router.get("/devices/{device_id}", response_model=DeviceResponse)
 async def get_device(device_id: int, session: AsyncSession = Depends(get_session)):
     device = await session.get(Device, device_id)
@@ -134,6 +184,7 @@ async def update_device(
     device.updated_at = time.time()
     await session.commit()
     await session.refresh(device)
+    device_registry.update(device)
 
     monitor: MonitorService = request.app.state.monitor_service
     if device.monitoring_enabled and not monitor.is_monitoring(device_id):
@@ -157,8 +208,13 @@ async def delete_device(
         raise HTTPException(status_code=404, detail="Device not found")
 
     monitor: MonitorService = request.app.state.monitor_service
+    device_registry.remove(device_id)
     await monitor.stop_device(device_id)
+    await monitor.reset_device(device_id)
 
+    await delete_device_samples(await session.connection(), device_id)
+    await session.execute(delete(PingRollup).where(PingRollup.device_id == device_id))
+    await session.execute(delete(LatencyHistogram).where(LatencyHistogram.device_id == device_id))
     await session.delete(device)
     await session.commit()
     return {"ok": True}
@@ -178,6 +234,7 @@ async def toggle_monitoring(
     device.updated_at = time.time()
     await session.commit()
     await session.refresh(device)
+    device_registry.update(device)
 
     monitor: MonitorService = request.app.state.monitor_service
     if device.monitoring_enabled:
@@ -189,14 +246,21 @@ async def toggle_monitoring(
 
 
 @router.post("/devices/{device_id}/rescan")
-async def rescan_device(device_id: int, session: AsyncSession = Depends(get_session)):
+async def rescan_device(
+    device_id: int,
+    force: bool = Query(False),
+    session: AsyncSession = Depends(get_session),
+):
     device = await session.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     if not device.ip_address:
         raise HTTPException(status_code=400, detail="Device has no IP address")
 
-    asyncio.create_task(_run_nmap_for_device(device.id, device.ip_address, fingerprint_enabled=True))
+    # Ahead of any queued bulk scans; a recent result for the same IP and MAC is reused unless forced
+    asyncio.create_task(_run_nmap_for_device(
+        device.id, device.ip_address, device.mac_address, True, PRIORITY_USER, force,
+    ))
     return {"ok": True, "message": "Rescan started"}
 
 
@@ -226,7 +290,56 @@ async def check_device(data: DeviceCheck):
     )
 
 
-@router.post("/devices/discover", response_model=list[DiscoveredDevice])
+@router.post("/devices/discover", response_model=DiscoveryJobResponse)
 async def discover_devices(data: DiscoverRequest = DiscoverRequest()):
-    devices = await discover_network(data.subnet)
-    return [DiscoveredDevice(**d) for d in devices]
+    """Start an ARP sweep in the background; poll the job or follow its event stream."""
+    try:
+        job = start_discovery(data.subnet)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+
+def _discovery_job(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Discovery job not found")
+    return job
+
+
+@router.get("/devices/discover/{job_id}", response_model=DiscoveryJobResponse)
+async def get_discovery(job_id: str, after: int = Query(0, ge=0)):
+    return _discovery_job(job_id).to_dict(after)
+
+
+@router.delete("/devices/discover/{job_id}")
+async def cancel_discovery(job_id: str):
+    cancel_job(_discovery_job(job_id))
+    return {"ok": True}
+
+
+@router.get("/devices/discover/{job_id}/events")
+async def discovery_events(job_id: str):
+    """Server-sent events: `host` for every host as it answers, `progress` while requests
+    go out, and a final `done` with the job status."""
+    job = _discovery_job(job_id)
+
+    async def stream():
+        sent_hosts = 0
+        while True:
+            for host in job.hosts[sent_hosts:]:
+                yield f"event: host\ndata: {json.dumps(host)}\n\n"
+            sent_hosts = len(job.hosts)
+            if job.finished_at is not None:
+                yield f"event: done\ndata: {json.dumps({'status': job.status, 'hosts': sent_hosts})}\n\n"
+                return
+            yield f"event: progress\ndata: {json.dumps({'sent': job.sent, 'total': job.total})}\n\n"
+            await job.wait(15)
+            # Coalesce the burst of replies that usually follows
+            await asyncio.sleep(0.2)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
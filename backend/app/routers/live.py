@@ -0,0 +1,32 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from ..services.live_feed import KEEPALIVE_SECONDS, live_feed
+
+router = APIRouter(tags=["live"])
+
+
+async def _event_stream():
+    queue = live_feed.subscribe()
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+    finally:
+        live_feed.unsubscribe(queue)
+
+
+@router.get("/live")
+async def live_stream():
+    """Server-sent events: `samples` (per-device summary since the last tick), `status`
+    (device status transitions) and `notification` (newly created notifications)."""
+    return StreamingResponse(
+        _event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
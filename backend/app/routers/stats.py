@@ -1,68 +1,124 @@
-import csv
-import io
 import time
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
-from sqlalchemy import Integer, delete, func, select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..config import settings
 from ..database import get_session
-from ..models import Device, PingResult
-from ..schemas import GraphPoint, GraphResponse, StatsResponse
+from ..models import Device, LatencyHistogram, PingRollup
+from ..schemas import GraphResponse, StatsResponse
+from ..services.export_service import (
+    BULK_CSV_HEADER,
+    EXPORT_FORMATS,
+    accepts_gzip,
+    columnar_chunks,
+    csv_chunks,
+    gzip_chunks,
+    iter_device_samples,
+    iter_samples,
+)
+from ..services.graph_service import graph_points
+from ..services.sample_store import delete_device_samples
+from ..services.histogram_service import window_latency
+from ..services.stats_service import stats_engine, window_stats
 
 router = APIRouter(tags=["stats"])
 
 
+def _round(value: float | None) -> float | None:
+    return round(value, 3) if value is not None else None
+
+
+@router.get("/stats/export")
+async def export_bulk(
+    request: Request,
+    device_ids: list[int] = Query(...),
+    start: float | None = Query(None),
+    end: float | None = Query(None),
+    format: str = Query("arrow"),
+    session: AsyncSession = Depends(get_session),
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(EXPORT_FORMATS)}")
+    found = set((await session.execute(select(Device.id).where(Device.id.in_(device_ids)))).scalars())
+    missing = [d for d in device_ids if d not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Device not found: {missing}")
+
+    now = time.time()
+    if end is None:
+        end = now
+    if start is None:
+        start = end - 86400
+
+    media_type, extension = EXPORT_FORMATS[format]
+    headers = {
+        "Content-Disposition": f'attachment; filename="badping_export_{int(start)}_{int(end)}.{extension}"',
+    }
+    pages = iter_device_samples(list(dict.fromkeys(device_ids)), start, end)
+    if format == "csv":
+        body = csv_chunks(pages, BULK_CSV_HEADER)
+        headers["Vary"] = "Accept-Encoding"
+        if accepts_gzip(request.headers.get("accept-encoding")):
+            body = gzip_chunks(body)
+            headers["Content-Encoding"] = "gzip"
+    else:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="pyarrow is not installed")
+        body = columnar_chunks(pages, format)
+
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
 @router.get("/stats/{device_id}", response_model=StatsResponse)
-async def get_stats(device_id: int, session: AsyncSession = Depends(get_session)):
+async def get_stats(
+    device_id: int,
+    start: float | None = Query(None),
+    end: float | None = Query(None),
+    session: AsyncSession = Depends(get_session),
+):
     device = await session.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
 
-    now = time.time()
-
-    async def calc(seconds: int):
-        cutoff = now - seconds
-        result = await session.execute(
-            select(
-                func.count().label("total"),
-                func.sum(PingResult.packet_lost.cast(Integer)).label("lost"),
-                func.avg(PingResult.latency_ms).label("avg"),
-                func.min(PingResult.latency_ms).label("min"),
-                func.max(PingResult.latency_ms).label("max"),
-            ).where(
-                PingResult.device_id == device_id,
-                PingResult.timestamp >= cutoff,
-            )
-        )
-        return result.one()
-
-    r6 = await calc(21600)
-    r12 = await calc(43200)
-    r24 = await calc(86400)
-    r48 = await calc(172800)
-
-    def pct(row):
-        total = row.total or 0
-        lost = row.lost or 0
-        return round(lost / total * 100, 2) if total > 0 else 0.0
-
-    total_24 = r24.total or 0
-    lost_24 = r24.lost or 0
+    windows = window_stats([device_id])[device_id]
+    r24 = windows["24h"]
+    avg_24 = r24.avg()
+    # Percentiles for the last 24h come from memory; any other window from the minute histograms
+    if start is None and end is None:
+        latency = stats_engine.latency_summary(device_id)
+        end = time.time()
+        start = end - 86400
+    else:
+        if end is None:
+            end = time.time()
+        if start is None:
+            start = end - 86400
+        latency = await window_latency(session, device_id, start, end)
 
     return StatsResponse(
         device_id=device_id,
-        stats_6h=pct(r6),
-        stats_12h=pct(r12),
-        stats_24h=pct(r24),
-        stats_48h=pct(r48),
-        total_pings_24h=total_24,
-        lost_pings_24h=lost_24,
-        ok_pings_24h=total_24 - lost_24,
-        avg_latency_24h=round(r24.avg, 3) if r24.avg else None,
+        stats_6h=windows["6h"].loss_pct() or 0.0,
+        stats_12h=windows["12h"].loss_pct() or 0.0,
+        stats_24h=r24.loss_pct() or 0.0,
+        stats_48h=windows["48h"].loss_pct() or 0.0,
+        total_pings_24h=r24.total,
+        lost_pings_24h=r24.lost,
+        ok_pings_24h=r24.total - r24.lost,
+        avg_latency_24h=round(avg_24, 3) if avg_24 else None,
         min_latency_24h=round(r24.min, 3) if r24.min else None,
         max_latency_24h=round(r24.max, 3) if r24.max else None,
+        latency_start=start,
+        latency_end=end,
+        p50_latency=_round(latency["p50"]),
+        p90_latency=_round(latency["p90"]),
+        p99_latency=_round(latency["p99"]),
+        p999_latency=_round(latency["p999"]),
+        jitter_ms=_round(latency["jitter"]),
     )
 
 
@@ -71,6 +127,8 @@ async def get_graph_data(
     device_id: int,
     start: float | None = Query(None),
     end: float | None = Query(None),
+    max_points: int = Query(settings.graph_max_points, ge=10, le=20000),
+    since: float | None = Query(None),
     session: AsyncSession = Depends(get_session),
 ):
     device = await session.get(Device, device_id)
@@ -83,101 +141,39 @@ async def get_graph_data(
     if start is None:
         start = end - 3600
 
-    time_range = end - start
-
-    if time_range > 86400:
-        bucket = 60.0
-    elif time_range > 21600:
-        bucket = 10.0
-    elif time_range > 3600:
-        bucket = 1.0
-    else:
-        bucket = 0.0
-
-    if bucket > 0:
-        bucket_col = (PingResult.timestamp / bucket).cast(Integer)
-        result = await session.execute(
-            select(
-                (bucket_col * bucket).label("bucket_ts"),
-                func.avg(PingResult.latency_ms).label("avg_latency"),
-                func.max(PingResult.packet_lost.cast(Integer)).label("any_lost"),
-                PingResult.ping_type,
-            )
-            .where(
-                PingResult.device_id == device_id,
-                PingResult.timestamp >= start,
-                PingResult.timestamp <= end,
-            )
-            .group_by(bucket_col, PingResult.ping_type)
-            .order_by(bucket_col)
-        )
-        rows = result.all()
-        points = [
-            GraphPoint(
-                timestamp=row.bucket_ts,
-                latency_ms=round(row.avg_latency, 3) if row.avg_latency else None,
-                packet_lost=bool(row.any_lost),
-                ping_type=row.ping_type,
-            )
-            for row in rows
-        ]
-        resolution = bucket
-    else:
-        result = await session.execute(
-            select(PingResult)
-            .where(
-                PingResult.device_id == device_id,
-                PingResult.timestamp >= start,
-                PingResult.timestamp <= end,
-            )
-            .order_by(PingResult.timestamp)
-            .limit(10000)
-        )
-        rows = result.scalars().all()
-        points = [
-            GraphPoint(
-                timestamp=r.timestamp,
-                latency_ms=r.latency_ms,
-                packet_lost=r.packet_lost,
-                ping_type=r.ping_type,
-            )
-            for r in rows
-        ]
-        resolution = device.interval_seconds
-
+    points, resolution, cursor = await graph_points(session, device, start, end, max_points, since)
     return GraphResponse(
         device_id=device_id,
         points=points,
         resolution_seconds=resolution,
+        cursor=cursor,
     )
 
 
 @router.delete("/stats/{device_id}/data")
-async def clear_data(device_id: int, session: AsyncSession = Depends(get_session)):
+async def clear_data(device_id: int, request: Request, session: AsyncSession = Depends(get_session)):
     device = await session.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
 
-    result = await session.execute(
-        delete(PingResult).where(PingResult.device_id == device_id)
-    )
+    deleted = await delete_device_samples(await session.connection(), device_id)
+    await session.execute(delete(PingRollup).where(PingRollup.device_id == device_id))
+    await session.execute(delete(LatencyHistogram).where(LatencyHistogram.device_id == device_id))
     # Reset device status
     device.status = "unknown"
     device.last_seen_at = None
     await session.commit()
 
     # Reset monitor service counters for this device
-    from ..services.monitor_service import MonitorService
-    monitor = MonitorService()
-    monitor._consecutive_success.pop(device_id, None)
-    monitor._consecutive_fail.pop(device_id, None)
+    await request.app.state.monitor_service.reset_device(device_id)
 
-    return {"ok": True, "deleted": result.rowcount}
+    return {"ok": True, "deleted": deleted}
 
 
 @router.get("/stats/{device_id}/export")
 async def export_csv(
     device_id: int,
+    request: Request,
     start: float | None = Query(None),
     end: float | None = Query(None),
     session: AsyncSession = Depends(get_session),
@@ -192,28 +188,13 @@ async def export_csv(
     if start is None:
         start = end - 86400
 
-    result = await session.execute(
-        select(PingResult)
-        .where(
-            PingResult.device_id == device_id,
-            PingResult.timestamp >= start,
-            PingResult.timestamp <= end,
-        )
-        .order_by(PingResult.timestamp)
-    )
-    rows = result.scalars().all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["timestamp", "ping_type", "latency_ms", "packet_lost"])
-    for r in rows:
-        writer.writerow([r.timestamp, r.ping_type, r.latency_ms, int(r.packet_lost)])
-
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f'attachment; filename="badping_{device.name}_{device_id}.csv"'
-        },
-    )
+    headers = {
+        "Content-Disposition": f'attachment; filename="badping_{device.name}_{device_id}.csv"',
+        "Vary": "Accept-Encoding",
+    }
+    body = csv_chunks(iter_samples(device_id, start, end))
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type="text/csv", headers=headers)
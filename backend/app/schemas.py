@@ -136,6 +136,15 @@ class StatsResponse(BaseModel):
     avg_latency_24h: float | None
     min_latency_24h: float | None
     max_latency_24h: float | None
+    # Latency distribution over [latency_start, latency_end), the last 24h by default
+    latency_start: float | None = None
+    latency_end: float | None = None
+    p50_latency: float | None = None
+    p90_latency: float | None = None
+    p99_latency: float | None = None
+    p999_latency: float | None = None
+    # Mean absolute latency difference between consecutive replies over the same window
+    jitter_ms: float | None = None
 
 
 class GraphPoint(BaseModel):
@@ -143,12 +152,21 @@ class GraphPoint(BaseModel):
     latency_ms: float | None
     packet_lost: bool
     ping_type: str | None = None
+    # Set when the point summarises a bucket of samples
+    latency_min: float | None = None
+    latency_max: float | None = None
+    count: int | None = None
+    lost_count: int | None = None
+    # Still filling up; replaced by the next incremental poll
+    provisional: bool = False
 
 
 class GraphResponse(BaseModel):
     device_id: int
     points: list[GraphPoint]
     resolution_seconds: float
+    # Pass back as `since` to get only points from here on
+    cursor: float | None = None
 
 
 class NotificationResponse(BaseModel):
@@ -177,3 +195,15 @@ class DiscoveredDevice(BaseModel):
     mac_address: str | None = None
     manufacturer: str | None = None
     hostname: str | None = None
+
+
+class DiscoveryJobResponse(BaseModel):
+    id: str
+    status: str  # running, done, cancelled or failed
+    subnets: list[str]
+    sent: int
+    total: int
+    started_at: float
+    finished_at: float | None = None
+    # Hosts found so far, from the `after` index the client asked for
+    hosts: list[DiscoveredDevice]
@@ -1,12 +1,32 @@
 import asyncio
 import ipaddress
 import logging
+import socket
+import struct
 import time
 
+from .oui_index import oui_index
+
 logger = logging.getLogger(__name__)
 
+ARP_TIMEOUT = 2.0
+ARP_RCVBUF = 1024 * 1024
+# Seconds an interface lookup is reused; addresses change with DHCP and container restarts
+ARP_ROUTE_TTL = 60.0
+# Seconds an off-link result is reused, short so an interface that gains an address is seen soon
+ARP_OFFLINK_TTL = 5.0
+
+_ETH_P_ARP = 0x0806
+_ARP_REQUEST = 1
+_ARP_REPLY = 2
+# Not exported by the socket module; the Linux value
+_SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+_TIMESPEC = struct.Struct("@qq")
+_BROADCAST = b"\xff" * 6
+
 # Checked once on first use
 _arp_available: bool | None = None
+_arp_check: asyncio.Future | None = None
 
 
 def _check_arp_once() -> bool:
@@ -15,10 +35,13 @@ def _check_arp_once() -> bool:
     if _arp_available is not None:
         return _arp_available
     try:
-        from scapy.layers.l2 import ARP, Ether, srp
-        # Try sending to an impossible target with tiny timeout — we only care about permission
-        packet = Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst="0.0.0.0")
-        srp(packet, timeout=0.1, verbose=False)
+        if hasattr(socket, "AF_PACKET"):
+            socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(_ETH_P_ARP)).close()
+        else:
+            from scapy.layers.l2 import ARP, Ether, srp
+            # Try sending to an impossible target with tiny timeout — we only care about permission
+            packet = Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst="0.0.0.0")
+            srp(packet, timeout=0.1, verbose=False)
         _arp_available = True
         logger.info("ARP: raw socket access available")
     except PermissionError:
@@ -40,44 +63,269 @@ def is_arp_available() -> bool:
     return _check_arp_once()
 
 
-def _arp_ping_sync(ip_address: str) -> dict | None:
-    if not _check_arp_once():
-        return None
+def start_arp_check() -> None:
+    """Run the capability check once in a worker thread; without packet sockets it loads
+    scapy and sends a probe, which shouldn't hold up startup or the first request."""
+    global _arp_check
+    if _arp_check is None and _arp_available is None:
+        _arp_check = asyncio.get_running_loop().run_in_executor(None, _check_arp_once)
+
+
+async def check_arp_available() -> bool:
+    """is_arp_available() without blocking the event loop."""
+    if _arp_available is None:
+        start_arp_check()
+        await asyncio.shield(_arp_check)
+    return _arp_available
+
+
+def _arp_latency_sync(ip_address: str) -> float | None:
     try:
         from scapy.layers.l2 import ARP, Ether, srp
 
         packet = Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=ip_address)
         answered, _ = srp(packet, timeout=2, verbose=False)
-
-        if answered:
-            sent_pkt, recv_pkt = answered[0]
-            elapsed = (recv_pkt.time - sent_pkt.sent_time) * 1000
-            return {
-                "timestamp": time.time(),
-                "ping_type": "arp",
-                "latency_ms": round(elapsed, 3),
-                "packet_lost": False,
-            }
-        return {
-            "timestamp": time.time(),
-            "ping_type": "arp",
-            "latency_ms": None,
-            "packet_lost": True,
-        }
     except Exception as e:
         logger.warning("ARP ping failed for %s: %s", ip_address, e)
-        return {
-            "timestamp": time.time(),
-            "ping_type": "arp",
-            "latency_ms": None,
-            "packet_lost": True,
-        }
-
-
-async def arp_ping(ip_address: str) -> dict | None:
-    """Returns None if ARP is unavailable (no root), otherwise a ping result dict."""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _arp_ping_sync, ip_address)
+        return None
+    if not answered:
+        return None
+    sent_pkt, recv_pkt = answered[0]
+    return round((recv_pkt.time - sent_pkt.sent_time) * 1000, 3)
+
+
+def _request_frame(mac: bytes, source_ip: bytes, target: bytes) -> bytes:
+    """Broadcast who-has frame for target, from the interface with this MAC and IPv4."""
+    return (
+        _BROADCAST + mac + struct.pack("!H", _ETH_P_ARP)
+        + struct.pack("!HHBBH", 1, 0x0800, 6, 4, _ARP_REQUEST)
+        + mac + source_ip + bytes(6) + target
+    )
+
+
+class ArpEngine:
+    """Long-lived ARP pinger with one AF_PACKET socket per interface.
+
+    Requests made in the same event loop iteration are sent together in one burst. A
+    reader callback per socket matches replies to waiting probes by sender IP and takes
+    the arrival time from the kernel's receive timestamp (SO_TIMESTAMPNS), so event loop
+    delays don't inflate the latency.
+    """
+
+    def __init__(self):
+        self._socks: dict[str, socket.socket] = {}
+        self._pending: dict[bytes, list[list]] = {}
+        self._routes: dict[str, tuple[tuple[str, bytes, bytes] | None, float]] = {}
+        self._outbox: list[tuple[str, bytes, bytes]] = []
+        self._writable: dict[str, asyncio.Future] = {}
+        self._listeners: set = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _open(self, iface: str) -> socket.socket:
+        sock = self._socks.get(iface)
+        if sock is not None:
+            return sock
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(_ETH_P_ARP))
+        sock.bind((iface, _ETH_P_ARP))
+        sock.setsockopt(socket.SOL_SOCKET, _SO_TIMESTAMPNS, 1)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ARP_RCVBUF)
+        except OSError:
+            pass
+        sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable, sock)
+        self._socks[iface] = sock
+        return sock
+
+    def close(self) -> None:
+        for sock in self._socks.values():
+            if self._loop and not self._loop.is_closed():
+                self._loop.remove_reader(sock.fileno())
+                self._loop.remove_writer(sock.fileno())
+            sock.close()
+        for waiter in self._writable.values():
+            waiter.cancel()
+        self._writable.clear()
+        self._socks.clear()
+        for waiters in self._pending.values():
+            for future, _, timer in waiters:
+                timer.cancel()
+                future.cancel()
+        self._pending.clear()
+
+    def _route(self, ip_address: str) -> tuple[str, bytes, bytes] | None:
+        """(interface, its MAC, its IPv4) on the subnet of ip_address, or None if off-link.
+
+        Found routes are cached for ARP_ROUTE_TTL, off-link results only for ARP_OFFLINK_TTL: an
+        interface without an address yet (early at boot, during a DHCP renewal) is soon seen.
+        """
+        cached = self._routes.get(ip_address)
+        now = time.monotonic()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        route = _local_interface(ip_address)
+        ttl = ARP_OFFLINK_TTL if route is None else ARP_ROUTE_TTL
+        self._routes[ip_address] = (route, now + ttl)
+        return route
+
+    def add_listener(self, callback) -> None:
+        """Call callback(sender_ip, sender_mac) for every ARP reply seen on any open socket."""
+        self._listeners.add(callback)
+
+    def remove_listener(self, callback) -> None:
+        self._listeners.discard(callback)
+
+    def send_requests(self, iface: str, mac: bytes, source_ip: bytes, targets) -> int:
+        """Fire-and-forget who-has requests for IPv4 addresses (as bytes); replies go to the
+        listeners. Stops when the send buffer is full; returns how many were sent."""
+        sock = self._open(iface)
+        sent = 0
+        for target in targets:
+            try:
+                sock.send(_request_frame(mac, source_ip, target))
+            except BlockingIOError:
+                break
+            sent += 1
+        return sent
+
+    async def wait_writable(self, iface: str) -> None:
+        """Wait until the interface's socket has room in its send buffer again."""
+        sock = self._open(iface)
+        waiter = self._writable.get(iface)
+        if waiter is None:
+            waiter = self._writable[iface] = self._loop.create_future()
+            fd = sock.fileno()
+
+            def ready() -> None:
+                self._loop.remove_writer(fd)
+                self._writable.pop(iface, None)
+                if not waiter.done():
+                    waiter.set_result(None)
+
+            self._loop.add_writer(fd, ready)
+        # Shared by every sweep on the interface; one being cancelled mustn't cancel the others
+        await asyncio.shield(waiter)
+
+    def probe(self, ip_address: str, timeout: float = ARP_TIMEOUT) -> asyncio.Future:
+        """Send one who-has request without waiting for it. The returned future gets the
+        round-trip time in ms, or None if lost or off-link; a timer waits out the timeout."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        route = self._route(ip_address)
+        if route is None:
+            future.set_result(None)
+            return future
+        iface, mac, source_ip = route
+        target = socket.inet_aton(ip_address)
+        self._open(iface)
+
+        waiters = self._pending.setdefault(target, [])
+        # Overlapping probes of one address share a request; [future, send time, timeout timer]
+        entry = [future, 0.0, None]
+        entry[2] = loop.call_later(timeout, self._expire, target, entry)
+        waiters.append(entry)
+        if len(waiters) == 1:
+            if not self._outbox:
+                self._loop.call_soon(self._send_burst)
+            self._outbox.append((iface, target, _request_frame(mac, source_ip, target)))
+        else:
+            entry[1] = waiters[0][1]
+        return future
+
+    async def ping(self, ip_address: str, timeout: float = ARP_TIMEOUT) -> float | None:
+        """Send one who-has request and return the round-trip time in ms, or None if lost."""
+        return await self.probe(ip_address, timeout)
+
+    def _expire(self, target: bytes, entry: list) -> None:
+        waiters = self._pending.get(target)
+        if waiters is not None and entry in waiters:
+            waiters.remove(entry)
+            if not waiters:
+                del self._pending[target]
+        if not entry[0].done():
+            entry[0].set_result(None)
+
+    def _send_burst(self) -> None:
+        outbox, self._outbox = self._outbox, []
+        for iface, target, frame in outbox:
+            sock = self._socks.get(iface)
+            waiters = self._pending.get(target)
+            if sock is None or not waiters:
+                continue
+            sent_at = time.time()
+            for entry in waiters:
+                entry[1] = sent_at
+            try:
+                sock.send(frame)
+            except OSError as e:
+                logger.debug("ARP send failed on %s: %s", iface, e)
+                # The interface may have gone or changed address; look it up again next time
+                self._routes.pop(socket.inet_ntoa(target), None)
+
+    def _on_readable(self, sock: socket.socket) -> None:
+        while True:
+            try:
+                frame, ancdata, _, _ = sock.recvmsg(128, socket.CMSG_SPACE(_TIMESPEC.size))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.debug("ARP receive error: %s", e)
+                return
+            # Ethernet header, then the ARP opcode at 20, the sender MAC at 22 and IP at 28
+            if len(frame) < 42 or struct.unpack_from("!H", frame, 20)[0] != _ARP_REPLY:
+                continue
+            for listener in list(self._listeners):
+                listener(frame[28:32], frame[22:28])
+            waiters = self._pending.get(frame[28:32])
+            if not waiters:
+                continue
+            received_at = time.time()
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == _SO_TIMESTAMPNS and len(data) >= _TIMESPEC.size:
+                    seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+                    received_at = seconds + nanoseconds / 1e9
+            # Probes joined after the request went out are answered by the next one
+            for entry in [entry for entry in waiters if entry[1]]:
+                future, sent_at, timer = entry
+                timer.cancel()
+                waiters.remove(entry)
+                if not future.done():
+                    future.set_result(round(max(0.0, received_at - sent_at) * 1000, 3))
+            if not waiters:
+                del self._pending[frame[28:32]]
+
+
+_engine: ArpEngine | None = None
+
+
+def get_engine() -> ArpEngine:
+    global _engine
+    if _engine is None:
+        _engine = ArpEngine()
+    return _engine
+
+
+def close_engine() -> None:
+    global _engine
+    if _engine is not None:
+        _engine.close()
+        _engine = None
+
+
+def arp_probe(ip_address: str) -> asyncio.Future | None:
+    """Start one ARP probe without waiting for it: a future for the round-trip time in ms
+    (None if lost), or None if ARP is unavailable (no root)."""
+    if not hasattr(socket, "AF_PACKET"):
+        # No packet sockets outside Linux: the check loads scapy, so it runs in the executor,
+        # and each probe is one scapy exchange there too
+        if not _arp_available:
+            start_arp_check()
+            return None
+        return asyncio.get_running_loop().run_in_executor(None, _arp_latency_sync, ip_address)
+    if not _check_arp_once():
+        return None
+    return get_engine().probe(ip_address)
 
 
 def _get_netmask(addr_info: dict) -> str | None:
@@ -112,6 +360,45 @@ def is_same_subnet(ip_address: str) -> bool:
         return True
 
 
+def local_networks() -> list[tuple[str, bytes, bytes, ipaddress.IPv4Network]]:
+    """(interface, its MAC, its IPv4, its subnet) for every IPv4 address on a non-loopback interface."""
+    networks = []
+    try:
+        try:
+            import netifaces2 as netifaces
+        except ImportError:
+            import netifaces
+
+        for iface in netifaces.interfaces():
+            for addr_info in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+                ip = addr_info.get("addr")
+                netmask = _get_netmask(addr_info)
+                if not ip or not netmask:
+                    continue
+                try:
+                    network = ipaddress.IPv4Network(f"{ip}/{netmask}", strict=False)
+                    with open(f"/sys/class/net/{iface}/address") as f:
+                        mac = bytes.fromhex(f.read().strip().replace(":", ""))
+                except (ValueError, OSError):
+                    continue
+                if not network.is_loopback:
+                    networks.append((iface, mac, socket.inet_aton(ip), network))
+    except Exception as e:
+        logger.debug("Listing local networks failed: %s", e)
+    return networks
+
+
+def _local_interface(ip_address: str) -> tuple[str, bytes, bytes] | None:
+    try:
+        target = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    for iface, mac, source_ip, network in local_networks():
+        if target in network:
+            return iface, mac, source_ip
+    return None
+
+
 def _discover_sync(subnet: str) -> list[dict]:
     """Synchronous ARP scan of a subnet."""
     if not _check_arp_once():
@@ -139,31 +426,21 @@ def _discover_sync(subnet: str) -> list[dict]:
 
 
 def mac_vendor_lookup(mac: str) -> str | None:
-    """Look up MAC vendor from OUI prefix using scapy's OUI database."""
-    try:
-        from scapy.layers.l2 import conf
-        result = conf.manufdb._resolve_MAC(mac)
-        # scapy returns the MAC unchanged when it can't resolve
-        if not result or result.upper() == mac.upper():
-            return None
-        # Extract just the vendor name (format: "VendorName:XX:XX:XX")
-        vendor = result.split(":")[0] if ":" in result else result
-        return vendor if vendor else None
-    except Exception:
-        return None
+    """Look up MAC vendor from its OUI prefix (see oui_index)."""
+    return oui_index.lookup(mac)
 
 
 async def discover_network(subnet: str | None = None) -> list[dict]:
     """Discover devices on the network via ARP scan."""
     if subnet is None:
-        subnet = _detect_subnet()
+        subnet = detect_subnet()
     if not subnet:
         return []
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(None, _discover_sync, subnet)
 
 
-def _detect_subnet() -> str | None:
+def detect_subnet() -> str | None:
     """Auto-detect the local subnet."""
     try:
         try:
@@ -0,0 +1,85 @@
+import struct
+import zlib
+from array import array
+from itertools import accumulate, repeat
+from operator import add
+
+# Width of one compressed block in seconds
+BLOCK_SECONDS = 60
+
+_HEADER = struct.Struct("<Iqq")
+_WIDTH = array("q").itemsize
+
+
+def _shuffle(values: array, bias: int) -> bytes:
+    """Offset the values by their minimum so they are small and non-negative, then group
+    the n-th byte of every value together: the zero high bytes form long runs that
+    deflate squeezes to almost nothing."""
+    raw = array("q", map(add, values, repeat(-bias))).tobytes()
+    return b"".join(raw[i::_WIDTH] for i in range(_WIDTH))
+
+
+def _unshuffle(data: bytes, count: int, bias: int):
+    raw = bytearray(count * _WIDTH)
+    for i in range(_WIDTH):
+        raw[i::_WIDTH] = data[i * count:(i + 1) * count]
+    values = array("q")
+    values.frombytes(raw)
+    return map(add, values, repeat(bias))
+
+
+def encode_block(block_ts: int, samples: list[tuple[int, int]]) -> bytes:
+    """Pack one block of (ts_us, latency_us) samples, sorted by time, into a BLOB.
+
+    Layout before deflate: a header (sample count and the two offsets), delta-of-delta
+    timestamps from the block start, latency deltas (a lost sample repeats the previous
+    latency), both as offset, byte-shuffled 64-bit integers, then a loss bitmap with one
+    bit per sample. Decoding runs almost entirely in C (array, accumulate, map).
+    """
+    count = len(samples)
+    dods = array("q")
+    deltas = array("q")
+    lost = bytearray((count + 7) // 8)
+    prev_ts = block_ts * 1_000_000
+    prev_delta = 0
+    prev_latency = 0
+    for i, (ts, latency) in enumerate(samples):
+        delta = ts - prev_ts
+        dods.append(delta - prev_delta)
+        prev_ts, prev_delta = ts, delta
+        if latency < 0:
+            lost[i >> 3] |= 1 << (i & 7)
+            deltas.append(0)
+        else:
+            deltas.append(latency - prev_latency)
+            prev_latency = latency
+    dod_bias = min(dods, default=0)
+    delta_bias = min(deltas, default=0)
+    body = (
+        _HEADER.pack(count, dod_bias, delta_bias)
+        + _shuffle(dods, dod_bias)
+        + _shuffle(deltas, delta_bias)
+        + lost
+    )
+    return zlib.compress(body, 6)
+
+
+def decode_block(block_ts: int, data: bytes) -> list[tuple[int, int]]:
+    """Inverse of encode_block: (ts_us, latency_us) samples with -1 latency for losses."""
+    buf = zlib.decompress(data)
+    count, dod_bias, delta_bias = _HEADER.unpack_from(buf)
+    size = count * _WIDTH
+    pos = _HEADER.size
+    dods = _unshuffle(buf[pos:pos + size], count, dod_bias)
+    latencies = accumulate(_unshuffle(buf[pos + size:pos + 2 * size], count, delta_bias))
+    timestamps = accumulate(accumulate(dods), initial=block_ts * 1_000_000)
+    next(timestamps)
+    bitmap = int.from_bytes(buf[pos + 2 * size:], "little")
+    if not bitmap:
+        return list(zip(timestamps, latencies))
+    # One '0'/'1' character per sample, first sample first
+    lost = f"{bitmap:0{count}b}"[::-1]
+    return [
+        (ts, -1 if flag == "1" else latency)
+        for ts, latency, flag in zip(timestamps, latencies, lost)
+    ]
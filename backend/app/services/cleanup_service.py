@@ -2,18 +2,76 @@ import asyncio
 import logging
 import time
 
-from sqlalchemy import delete, select
+from sqlalchemy import delete, func, select, text
 
 from ..config import settings
-from ..database import async_session
-from ..models import Device, PingResult
+from ..database import async_session, engine
+from ..models import PING_TYPES, Device, LatencyHistogram, PingRollup
+from .histogram_service import HISTOGRAM_SECONDS
+from .rollup_service import ROLLUP_RESOLUTIONS
+from .sample_store import (
+    days_between,
+    drop_partitions_before,
+    expired_blocks_delete,
+    expired_chunk_delete,
+    has_blocks,
+    partition_count,
+    partitions_between,
+)
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait before resuming a pass that ran out of time budget
+RESUME_DELAY = 60
+
+
+def _expired_bucket_delete(model, key: tuple, span: int, cutoff: float, limit: int):
+    """DELETE for at most `limit` buckets under one primary-key prefix that end at or before
+    cutoff, bounded by a bucket_ts range so SQLite walks the key instead of every row."""
+    last = int(cutoff) - span
+    boundary = (
+        select(model.bucket_ts)
+        .where(*key, model.bucket_ts <= last)
+        .order_by(model.bucket_ts)
+        .offset(limit)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return delete(model).where(*key, model.bucket_ts < func.coalesce(boundary, last + 1))
+
+
+def _expired_aggregates_deletes(device_id: int, cutoff: float, limit: int) -> list:
+    """Chunked DELETEs for a device's expired rollups and latency histograms."""
+    statements = []
+    for ping_type in PING_TYPES:
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = (
+                PingRollup.device_id == device_id,
+                PingRollup.ping_type == ping_type,
+                PingRollup.resolution == resolution,
+            )
+            statements.append(_expired_bucket_delete(PingRollup, key, resolution, cutoff, limit))
+        key = (LatencyHistogram.device_id == device_id, LatencyHistogram.ping_type == ping_type)
+        statements.append(_expired_bucket_delete(LatencyHistogram, key, HISTOGRAM_SECONDS, cutoff, limit))
+    return statements
+
 
 class CleanupService:
     def __init__(self):
         self._task: asyncio.Task | None = None
+        self._stats = {
+            "runs": 0,
+            "incomplete_runs": 0,
+            "last_run_at": None,
+            "last_run_seconds": 0.0,
+            "last_run_deleted": 0,
+            "last_run_rows_per_second": 0.0,
+            "deleted_total": 0,
+            "partitions_dropped_total": 0,
+            "chunks_total": 0,
+            "lock_held_seconds_total": 0.0,
+            "lock_held_max_ms": 0.0,
+        }
 
     def start(self) -> None:
         self._task = asyncio.create_task(self._cleanup_loop())
@@ -23,30 +81,112 @@ class CleanupService:
         if self._task:
             self._task.cancel()
 
+    def stats(self) -> dict:
+        return {**self._stats, "partitions": partition_count()}
+
     async def _cleanup_loop(self) -> None:
         while True:
+            complete = True
             try:
-                await self._run_cleanup()
+                complete = await self._run_cleanup()
             except asyncio.CancelledError:
                 break
             except Exception:
                 logger.exception("Cleanup error")
-            await asyncio.sleep(settings.cleanup_interval)
+            await asyncio.sleep(settings.cleanup_interval if complete else min(RESUME_DELAY, settings.cleanup_interval))
+
+    async def _run_cleanup(self) -> bool:
+        """Delete expired samples, rollups and histograms in bounded chunks. Returns False if the
+        time budget ran out."""
+        started = time.monotonic()
+        deadline = started + settings.cleanup_time_budget
+        deleted_total = 0
+        complete = True
 
-    async def _run_cleanup(self) -> None:
         async with async_session() as session:
-            devices = (await session.execute(select(Device))).scalars().all()
-            for device in devices:
-                cutoff = time.time() - (device.retention_days * 86400)
-                stmt = delete(PingResult).where(
-                    PingResult.device_id == device.id,
-                    PingResult.timestamp < cutoff,
+            devices = (await session.execute(select(Device.id, Device.name, Device.retention_days))).all()
+
+        # Whole days past the longest retention go in one DROP each
+        longest = max((d.retention_days for d in devices), default=settings.default_retention_days)
+        dropped = await self._drop_partitions(time.time() - longest * 86400)
+
+        for device in devices:
+            cutoff = time.time() - (device.retention_days * 86400)
+            deleted = 0
+            # Devices with a shorter retention still delete rows, chunk by chunk
+            for table in partitions_between(0, cutoff):
+                count, complete = await self._delete_chunks(
+                    expired_chunk_delete(table, device.id, cutoff, settings.cleanup_chunk_size), deadline
                 )
-                result = await session.execute(stmt)
-                if result.rowcount > 0:
-                    logger.info(
-                        "Cleaned %d old ping results for device %s",
-                        result.rowcount,
-                        device.name,
-                    )
+                deleted += count
+                if not complete:
+                    break
+
+            if complete:
+                async with async_session() as session:
+                    for day in days_between(0, cutoff):
+                        if has_blocks(day):
+                            await session.execute(expired_blocks_delete(day, device.id, cutoff))
+                    await session.commit()
+                for statement in _expired_aggregates_deletes(device.id, cutoff, settings.cleanup_chunk_size):
+                    _, complete = await self._delete_chunks(statement, deadline)
+                    if not complete:
+                        break
+
+            if deleted > 0:
+                logger.info("Cleaned %d old ping results for device %s", deleted, device.name)
+            deleted_total += deleted
+            if not complete:
+                logger.info("Cleanup time budget of %ss used up, resuming later", settings.cleanup_time_budget)
+                break
+
+        elapsed = time.monotonic() - started
+        self._stats.update({
+            "runs": self._stats["runs"] + 1,
+            "incomplete_runs": self._stats["incomplete_runs"] + (0 if complete else 1),
+            "last_run_at": time.time(),
+            "last_run_seconds": round(elapsed, 3),
+            "last_run_deleted": deleted_total,
+            "last_run_rows_per_second": round(deleted_total / elapsed, 1) if elapsed > 0 else 0.0,
+            "deleted_total": self._stats["deleted_total"] + deleted_total,
+            "partitions_dropped_total": self._stats["partitions_dropped_total"] + dropped,
+        })
+        return complete
+
+    async def _drop_partitions(self, cutoff: float) -> int:
+        started = time.monotonic()
+        async with engine.begin() as conn:
+            dropped = await drop_partitions_before(conn, cutoff)
+        if dropped:
+            self._record_lock(time.monotonic() - started)
+            # Hand the freed pages back to the filesystem
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(text("PRAGMA incremental_vacuum"))
+        return dropped
+
+    async def _delete_chunks(self, statement, deadline: float) -> tuple[int, bool]:
+        """Repeat a chunked DELETE until it comes up short; False if the time budget ran out."""
+        deleted = 0
+        while True:
+            if time.monotonic() >= deadline:
+                return deleted, False
+            count = await self._delete_chunk(statement)
+            deleted += count
+            if count < settings.cleanup_chunk_size:
+                return deleted, True
+            # Let the flush loop and API requests get at the write lock between chunks
+            await asyncio.sleep(settings.cleanup_chunk_pause)
+
+    async def _delete_chunk(self, statement) -> int:
+        started = time.monotonic()
+        async with async_session() as session:
+            result = await session.execute(statement)
             await session.commit()
+        self._record_lock(time.monotonic() - started)
+        return result.rowcount
+
+    def _record_lock(self, held: float) -> None:
+        self._stats["chunks_total"] += 1
+        self._stats["lock_held_seconds_total"] = round(self._stats["lock_held_seconds_total"] + held, 3)
+        self._stats["lock_held_max_ms"] = max(self._stats["lock_held_max_ms"], round(held * 1000, 3))
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import delete, func, select
+
+from ..config import settings
+from ..database import engine
+from .block_codec import BLOCK_SECONDS
+from .device_registry import device_registry
+from .sample_store import PARTITION_SECONDS, days_between, partition_table, store_blocks
+
+logger = logging.getLogger(__name__)
+
+# Seconds a minute must be over before it's compacted, so late flushes still land as rows
+COMPACT_GRACE = 10
+# Seconds of one device's samples moved into blocks per transaction
+COMPACT_SPAN = 3600
+
+
+class CompactionService:
+    """Moves closed minutes of samples from the row partitions into compressed blocks."""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._stats = {
+            "runs": 0,
+            "last_run_at": None,
+            "last_run_seconds": 0.0,
+            "samples_compacted_total": 0,
+            "blocks_written_total": 0,
+        }
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._compaction_loop())
+        logger.info("Compaction service started")
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+    async def _compaction_loop(self) -> None:
+        while True:
+            try:
+                await self._run_compaction()
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception("Compaction error")
+            await asyncio.sleep(settings.compaction_interval)
+
+    async def _run_compaction(self) -> None:
+        started = time.monotonic()
+        closed = int((time.time() - COMPACT_GRACE) // BLOCK_SECONDS * BLOCK_SECONDS)
+        samples = blocks = 0
+        for day in days_between(0, closed):
+            for device in device_registry.all():
+                moved, written = await self._compact_device_day(day, device.id, closed)
+                samples += moved
+                blocks += written
+
+        self._stats.update({
+            "runs": self._stats["runs"] + 1,
+            "last_run_at": time.time(),
+            "last_run_seconds": round(time.monotonic() - started, 3),
+            "samples_compacted_total": self._stats["samples_compacted_total"] + samples,
+            "blocks_written_total": self._stats["blocks_written_total"] + blocks,
+        })
+
+    async def _compact_device_day(self, day: int, device_id: int, closed: int) -> tuple[int, int]:
+        table = partition_table(day)
+        end = min(closed, (day + 1) * PARTITION_SECONDS)
+        async with engine.connect() as conn:
+            first_us = (await conn.execute(
+                select(func.min(table.c.ts_us)).where(table.c.device_id == device_id, table.c.ts_us < end * 1_000_000)
+            )).scalar()
+        if first_us is None:
+            return 0, 0
+
+        moved = written = 0
+        span_start = first_us // 1_000_000 // BLOCK_SECONDS * BLOCK_SECONDS
+        while span_start < end:
+            span_end = min(span_start + COMPACT_SPAN, end)
+            # Taking the rows with DELETE ... RETURNING keeps a concurrent late flush from
+            # slipping in between reading and deleting them
+            async with engine.begin() as conn:
+                rows = (await conn.execute(
+                    delete(table)
+                    .where(
+                        table.c.device_id == device_id,
+                        table.c.ts_us >= span_start * 1_000_000,
+                        table.c.ts_us < span_end * 1_000_000,
+                    )
+                    .returning(table.c.ping_type, table.c.ts_us, table.c.latency_us)
+                )).all()
+                if rows:
+                    written += await store_blocks(conn, day, device_id, rows)
+            moved += len(rows)
+            span_start = span_end
+            await asyncio.sleep(0)
+        return moved, written
@@ -0,0 +1,124 @@
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+from ..database import async_session
+from ..models import Device
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class DeviceConfig:
+    id: int
+    name: str
+    ip_address: str | None
+    ping_type: str
+    interval_seconds: float
+    packet_size: int
+    retention_days: int
+    monitoring_enabled: bool
+    status: str
+    last_seen_at: float | None
+
+
+class DeviceRegistry:
+    """Authoritative in-process copy of device settings and live status.
+
+    The monitor reads probe settings from here instead of the database. The devices
+    router keeps it in sync on create/update/delete/toggle (in a separate probe process,
+    through the probe link); status and last_seen_at are owned by the monitor and only
+    written back to the database when they change.
+    """
+
+    def __init__(self):
+        self._devices: dict[int, DeviceConfig] = {}
+        self._seen_dirty: set[int] = set()
+
+    async def load(self) -> None:
+        async with async_session() as session:
+            devices = (await session.execute(select(Device))).scalars().all()
+        self._devices = {d.id: self._from_device(d) for d in devices}
+        self._seen_dirty.clear()
+        logger.info("Device registry loaded, %d devices", len(self._devices))
+
+    @staticmethod
+    def _from_device(device: Device) -> DeviceConfig:
+        return DeviceConfig(
+            id=device.id,
+            name=device.name,
+            ip_address=device.ip_address,
+            ping_type=device.ping_type,
+            interval_seconds=device.interval_seconds,
+            packet_size=device.packet_size,
+            retention_days=device.retention_days,
+            monitoring_enabled=device.monitoring_enabled,
+            status=device.status,
+            last_seen_at=device.last_seen_at,
+        )
+
+    def get(self, device_id: int) -> DeviceConfig | None:
+        return self._devices.get(device_id)
+
+    def all(self) -> list[DeviceConfig]:
+        return list(self._devices.values())
+
+    def monitored(self) -> list[DeviceConfig]:
+        return [d for d in self._devices.values() if d.monitoring_enabled]
+
+    async def reload(self) -> None:
+        """Re-read all devices from the database, keeping the live status of known ones."""
+        async with async_session() as session:
+            devices = (await session.execute(select(Device))).scalars().all()
+        configs = {}
+        for device in devices:
+            configs[device.id] = self._keep_status(self._from_device(device))
+        self._devices = configs
+        self._seen_dirty &= configs.keys()
+
+    def update(self, device: Device) -> DeviceConfig:
+        """Refresh a device's settings from its ORM row, keeping the monitor's live status."""
+        return self.put(self._from_device(device))
+
+    def put(self, config: DeviceConfig) -> DeviceConfig:
+        """Store settings sent over from another process, keeping the live status."""
+        self._devices[config.id] = self._keep_status(config)
+        return config
+
+    def _keep_status(self, config: DeviceConfig) -> DeviceConfig:
+        existing = self._devices.get(config.id)
+        if existing is not None:
+            config.status = existing.status
+            config.last_seen_at = existing.last_seen_at
+        return config
+
+    def remove(self, device_id: int) -> None:
+        self._devices.pop(device_id, None)
+        self._seen_dirty.discard(device_id)
+
+    def reset_status(self, device_id: int) -> None:
+        config = self._devices.get(device_id)
+        if config is not None:
+            config.status = "unknown"
+            config.last_seen_at = None
+        self._seen_dirty.discard(device_id)
+
+    def mark_seen(self, device_id: int, ts: float) -> None:
+        config = self._devices.get(device_id)
+        if config is not None:
+            config.last_seen_at = ts
+            self._seen_dirty.add(device_id)
+
+    def pop_seen(self) -> list[dict]:
+        """Return pending last_seen_at updates as bulk-update parameter rows."""
+        rows = [
+            {"id": device_id, "last_seen_at": self._devices[device_id].last_seen_at}
+            for device_id in self._seen_dirty
+            if device_id in self._devices
+        ]
+        self._seen_dirty.clear()
+        return rows
+
+
+device_registry = DeviceRegistry()
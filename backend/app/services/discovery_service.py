@@ -0,0 +1,205 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+import uuid
+
+from ..config import settings
+from .arp_service import (
+    detect_subnet,
+    discover_network,
+    get_engine,
+    check_arp_available,
+    local_networks,
+    mac_vendor_lookup,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds to keep listening for replies after the last request went out
+DISCOVERY_LINGER = 2.0
+# Seconds between send batches; each batch holds discovery_rate * DISCOVERY_PACE requests
+DISCOVERY_PACE = 0.01
+# Largest subnet one job will sweep
+MAX_DISCOVERY_ADDRESSES = 65536
+# Finished jobs kept around for clients still polling them
+MAX_JOBS = 20
+
+
+class DiscoveryJob:
+    """One background ARP sweep; hosts are appended as their replies arrive."""
+
+    def __init__(self, subnets: list[str]):
+        self.id = uuid.uuid4().hex[:12]
+        self.subnets = subnets
+        self.status = "running"
+        self.sent = 0
+        self.total = 0
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.hosts: list[dict] = []
+        self._seen: set[str] = set()
+        self._changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def add_host(self, ip_address: str, mac_address: str | None, manufacturer: str | None = None) -> None:
+        if ip_address in self._seen:
+            return
+        self._seen.add(ip_address)
+        self.hosts.append({
+            "ip_address": ip_address,
+            "mac_address": mac_address,
+            "manufacturer": manufacturer,
+        })
+        self.notify()
+
+    def notify(self) -> None:
+        # Wake everyone waiting on the current event and start a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def finish(self, status: str) -> None:
+        self.status = status
+        self.finished_at = time.time()
+        self.notify()
+
+    def to_dict(self, after: int = 0) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "subnets": self.subnets,
+            "sent": self.sent,
+            "total": self.total,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "hosts": self.hosts[after:],
+        }
+
+
+_jobs: dict[str, DiscoveryJob] = {}
+
+
+def get_job(job_id: str) -> DiscoveryJob | None:
+    return _jobs.get(job_id)
+
+
+def _plan(subnet: str | None) -> list[tuple[str, bytes, bytes, ipaddress.IPv4Network]]:
+    """(interface, MAC, IPv4, network to sweep) for every part of the request."""
+    interfaces = local_networks()
+    if subnet is None:
+        return [
+            entry for entry in interfaces
+            if entry[3].prefixlen < 32 and entry[3].num_addresses <= MAX_DISCOVERY_ADDRESSES
+        ]
+    network = ipaddress.IPv4Network(subnet, strict=False)
+    if network.num_addresses > MAX_DISCOVERY_ADDRESSES:
+        raise ValueError(f"subnet is larger than {MAX_DISCOVERY_ADDRESSES} addresses")
+    plan = []
+    for iface, mac, source_ip, local in interfaces:
+        if network.overlaps(local):
+            # Only the part reachable on this link
+            part = network if network.subnet_of(local) else local
+            plan.append((iface, mac, source_ip, part))
+    if not plan and interfaces:
+        # Nothing on-link: ask from the default route's interface, routers may proxy-ARP
+        default = detect_subnet()
+        for iface, mac, source_ip, local in interfaces:
+            if default and str(local) == default:
+                plan.append((iface, mac, source_ip, network))
+                break
+    return plan
+
+
+def start_discovery(subnet: str | None = None) -> DiscoveryJob:
+    """Start an ARP sweep in the background and return its job right away.
+
+    Raises ValueError for a malformed or oversized subnet.
+    """
+    if hasattr(socket, "AF_PACKET"):
+        plan = _plan(subnet)
+        job = DiscoveryJob([str(part) for *_, part in plan])
+        job.task = asyncio.create_task(_run(job, plan))
+    else:
+        job = DiscoveryJob([subnet] if subnet else [])
+        job.task = asyncio.create_task(_run_fallback(job, subnet))
+
+    _jobs[job.id] = job
+    finished = [j for j in _jobs.values() if j.finished_at is not None]
+    for old in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(_jobs) - MAX_JOBS)]:
+        del _jobs[old.id]
+    return job
+
+
+def cancel_job(job: DiscoveryJob) -> None:
+    if job.task and not job.task.done():
+        job.task.cancel()
+
+
+async def _run(job: DiscoveryJob, plan: list) -> None:
+    if not plan or not await check_arp_available():
+        job.finish("done")
+        return
+    job.total = sum(part.num_addresses for *_, part in plan)
+    networks = [part for *_, part in plan]
+
+    def on_reply(sender_ip: bytes, sender_mac: bytes) -> None:
+        address = ipaddress.IPv4Address(sender_ip)
+        if any(address in network for network in networks):
+            mac = sender_mac.hex(":")
+            job.add_host(str(address), mac, mac_vendor_lookup(mac))
+
+    engine = get_engine()
+    try:
+        # Loads the vendor database before the replies start coming in
+        await asyncio.get_running_loop().run_in_executor(None, mac_vendor_lookup, "00:00:00:00:00:00")
+        engine.add_listener(on_reply)
+        await asyncio.gather(*(_sweep(job, engine, *entry) for entry in plan))
+        await asyncio.sleep(DISCOVERY_LINGER)
+        job.finish("done")
+    except asyncio.CancelledError:
+        job.finish("cancelled")
+    except Exception:
+        logger.exception("Discovery job %s failed", job.id)
+        job.finish("failed")
+    finally:
+        engine.remove_listener(on_reply)
+
+
+async def _sweep(job: DiscoveryJob, engine, iface: str, mac: bytes, source_ip: bytes,
+                 network: ipaddress.IPv4Network) -> None:
+    """Send a request to every address of network at settings.discovery_rate per second."""
+    batch = max(1, int(settings.discovery_rate * DISCOVERY_PACE))
+    addresses = (address.packed for address in network)
+    while True:
+        chunk = [a for _, a in zip(range(batch), addresses)]
+        if not chunk:
+            return
+        size = len(chunk)
+        while True:
+            sent = engine.send_requests(iface, mac, source_ip, chunk)
+            job.sent += sent
+            chunk = chunk[sent:]
+            if not chunk:
+                break
+            # Send buffer full: the rest goes out once the kernel has drained some of it
+            await engine.wait_writable(iface)
+        job.notify()
+        await asyncio.sleep(size / settings.discovery_rate)
+
+
+async def _run_fallback(job: DiscoveryJob, subnet: str | None) -> None:
+    """One blocking scapy sweep, for platforms without packet sockets."""
+    try:
+        for host in await discover_network(subnet):
+            job.add_host(host["ip_address"], host["mac_address"], host["manufacturer"])
+        job.sent = job.total = len(job.hosts)
+        job.finish("done")
+    except asyncio.CancelledError:
+        job.finish("cancelled")
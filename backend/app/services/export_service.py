@@ -0,0 +1,201 @@
+import csv
+import io
+import zlib
+from typing import AsyncIterator, Iterable
+
+from sqlalchemy import and_, or_, select
+
+from ..config import settings
+from ..database import async_session
+from ..models import PING_TYPES
+from .sample_store import (
+    PARTITION_SECONDS,
+    days_between,
+    decode_sample,
+    fetch_day,
+    has_blocks,
+    partition_table,
+    refresh_partitions,
+)
+
+CSV_HEADER = ["timestamp", "ping_type", "latency_ms", "packet_lost"]
+BULK_CSV_HEADER = ["device_id", *CSV_HEADER]
+
+EXPORT_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "csv": ("text/csv", "csv"),
+}
+
+# Seconds of samples decoded per page when exporting a day stored as compressed blocks
+BLOCK_EXPORT_SPAN = 600
+
+
+async def iter_samples(device_id: int, start: float, end: float) -> AsyncIterator[list]:
+    """Yield pages of (timestamp, ping_type, latency_ms, packet_lost) rows in time order.
+
+    Each day partition is read with keyset pagination on its (device_id, ts_us, ping_type)
+    primary key, each page in its own short read transaction, so memory stays flat and WAL
+    checkpoints aren't held up. Days holding compressed blocks are decoded window by window.
+    """
+    start_us, end_us = round(start * 1_000_000), round(end * 1_000_000)
+    async with async_session() as session:
+        await refresh_partitions(session)
+    for day in days_between(start, end):
+        if has_blocks(day):
+            async for page in _iter_block_day(device_id, day, start_us, end_us):
+                yield page
+            continue
+        table = partition_table(day)
+        last_ts, last_type = start_us, None
+        while True:
+            query = select(table.c.ts_us, table.c.ping_type, table.c.latency_us).where(
+                table.c.device_id == device_id,
+                table.c.ts_us >= last_ts,
+                table.c.ts_us <= end_us,
+            )
+            if last_type is not None:
+                query = query.where(or_(
+                    table.c.ts_us > last_ts,
+                    and_(table.c.ts_us == last_ts, table.c.ping_type > last_type),
+                ))
+            query = query.order_by(table.c.ts_us, table.c.ping_type).limit(settings.export_page_size)
+
+            async with async_session() as session:
+                rows = (await session.execute(query)).all()
+            if rows:
+                yield [decode_sample(*row) for row in rows]
+            if len(rows) < settings.export_page_size:
+                break
+            last_ts, last_type = rows[-1][0], rows[-1][1]
+
+
+async def _iter_block_day(device_id: int, day: int, start_us: int, end_us: int) -> AsyncIterator[list]:
+    """Pages of a day that has compressed blocks, one BLOCK_EXPORT_SPAN window at a time."""
+    day_start = day * PARTITION_SECONDS
+    for span_start in range(day_start, day_start + PARTITION_SECONDS, BLOCK_EXPORT_SPAN):
+        lo = max(start_us, span_start * 1_000_000)
+        hi = min(end_us, (span_start + BLOCK_EXPORT_SPAN) * 1_000_000 - 1)
+        if lo > hi:
+            continue
+        async with async_session() as session:
+            rows = await fetch_day(session, device_id, day, lo, hi)
+        if rows:
+            yield [decode_sample(*row) for row in rows]
+
+
+async def iter_device_samples(device_ids: Iterable[int], start: float, end: float) -> AsyncIterator[list]:
+    """Like iter_samples, for several devices one after another, with device_id prepended."""
+    for device_id in device_ids:
+        async for page in iter_samples(device_id, start, end):
+            yield [(device_id, *row) for row in page]
+
+
+async def csv_chunks(pages: AsyncIterator[list], header: list[str] = CSV_HEADER) -> AsyncIterator[bytes]:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    async for page in pages:
+        for row in page:
+            writer.writerow([*row[:-1], int(row[-1])])
+        yield output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to a streaming response."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("device_id", pa.uint32()),
+        ("timestamp", pa.float64()),
+        ("ping_type", pa.dictionary(pa.int8(), pa.string())),
+        ("latency_ms", pa.float32()),
+        ("packet_lost", pa.bool_()),
+    ])
+
+
+def _record_batch(schema, page: list):
+    import pyarrow as pa
+
+    device_ids, timestamps, ping_types, latencies, lost = zip(*page)
+    return pa.record_batch([
+        pa.array(device_ids, pa.uint32()),
+        pa.array(timestamps, pa.float64()),
+        # Fixed dictionary (the ping type codes) so every batch shares it
+        pa.DictionaryArray.from_arrays(
+            pa.array([PING_TYPES.index(t) for t in ping_types], pa.int8()),
+            pa.array(PING_TYPES, pa.string()),
+        ),
+        pa.array(latencies, pa.float32()),
+        pa.array(lost, pa.bool_()),
+    ], schema=schema)
+
+
+async def columnar_chunks(pages: AsyncIterator[list], fmt: str) -> AsyncIterator[bytes]:
+    """Stream pages of (device_id, timestamp, ping_type, latency_ms, packet_lost) rows as an
+    Arrow IPC stream or a Parquet file, one record batch / row group per page."""
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = writer.write_batch
+    else:
+        writer = ipc.new_stream(sink, schema, options=ipc.IpcWriteOptions(compression="zstd"))
+        write = writer.write_batch
+
+    async for page in pages:
+        write(_record_batch(schema, page))
+        data = sink.take()
+        if data:
+            yield data
+    writer.close()
+    yield sink.take()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        if name.strip().lower() != "gzip":
+            continue
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
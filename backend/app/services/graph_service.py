@@ -0,0 +1,129 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import Device, PingRollup
+from ..schemas import GraphPoint
+from .ping_service import ICMP_TIMEOUT
+from .rollup_service import ROLLUP_RESOLUTIONS, bucket_avg
+from .sample_store import fetch_envelopes, fetch_samples
+
+# Bucket widths in seconds the graph picks from; every one from 1s up is a multiple of a
+# rollup resolution, and none straddles a minute or hour boundary
+NICE_WIDTHS = (
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+    1, 2, 5, 10, 15, 20, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400,
+)
+
+
+def _round(value: float | None) -> float | None:
+    return round(value, 3) if value is not None else None
+
+
+def _envelope_point(
+    ping_type, bucket_ts, count, lost, latency_sum, latency_min, latency_max, provisional: bool = False
+) -> GraphPoint:
+    return GraphPoint(
+        timestamp=bucket_ts,
+        latency_ms=_round(bucket_avg(latency_sum, count, lost)),
+        # Any loss in the bucket marks it, however many good samples surround it
+        packet_lost=lost > 0,
+        ping_type=ping_type,
+        latency_min=_round(latency_min),
+        latency_max=_round(latency_max),
+        count=count,
+        lost_count=lost,
+        provisional=provisional,
+    )
+
+
+async def _rollup_envelopes(
+    session: AsyncSession, device_id: int, start: float, end: float, resolution: int, width: int
+) -> list[tuple]:
+    bucket = (PingRollup.bucket_ts // width) * width
+    result = await session.execute(
+        select(
+            PingRollup.ping_type,
+            bucket,
+            func.sum(PingRollup.count),
+            func.sum(PingRollup.lost),
+            func.sum(PingRollup.latency_sum),
+            func.min(PingRollup.latency_min),
+            func.max(PingRollup.latency_max),
+        )
+        .where(
+            PingRollup.device_id == device_id,
+            PingRollup.resolution == resolution,
+            PingRollup.bucket_ts >= int(start // width * width),
+            PingRollup.bucket_ts <= end,
+        )
+        .group_by(PingRollup.ping_type, bucket)
+        .order_by(bucket, PingRollup.ping_type)
+    )
+    return result.all()
+
+
+def provisional_seconds() -> float:
+    """How far back from now samples may still be arriving: a probe is timestamped when it
+    starts, can wait out its timeout, then sits in the buffer until the next flush."""
+    return ICMP_TIMEOUT + settings.batch_write_interval + 1
+
+
+def nice_width(width: float) -> float:
+    """Smallest of NICE_WIDTHS at least `width`, so the bucket grid stays put between polls."""
+    for nice in NICE_WIDTHS:
+        if nice >= width * (1 - 1e-9):
+            return nice
+    return NICE_WIDTHS[-1]
+
+
+async def graph_points(
+    session: AsyncSession,
+    device: Device,
+    start: float,
+    end: float,
+    max_points: int,
+    since: float | None = None,
+) -> tuple[list[GraphPoint], float, float]:
+    """At most about max_points points per ping type for [start, end], their resolution and
+    the cursor to poll from next.
+
+    Ranges with few enough samples are returned raw. Otherwise every point is a min/max/avg
+    envelope of an epoch-aligned bucket, folded from the coarsest rollup that fits the bucket
+    width, or from raw samples when buckets are shorter than the finest rollup.
+
+    With `since` (a previous cursor) only points from there on are computed and returned.
+    Points at or after the returned cursor may still change and are marked provisional; the
+    client replaces everything from the cursor on with the next response.
+    """
+    time_range = max(end - start, 0.001)
+    settled = end - provisional_seconds()
+    series = 2 if device.ping_type == "both" else 1
+    if time_range / device.interval_seconds <= max_points:
+        # Interval changes can leave more samples than expected; fall through to envelopes then
+        limit = max_points * series * 2
+        query_start = start if since is None else max(start, since)
+        samples = await fetch_samples(session, device.id, query_start, end, limit=limit)
+        if len(samples) < limit:
+            points = [
+                GraphPoint(
+                    timestamp=ts,
+                    latency_ms=latency_ms,
+                    packet_lost=packet_lost,
+                    ping_type=ping_type,
+                    provisional=ts >= settled,
+                )
+                for ts, ping_type, latency_ms, packet_lost in samples
+            ]
+            return points, device.interval_seconds, settled
+
+    width = nice_width(time_range / max_points)
+    cursor = settled // width * width
+    query_start = start if since is None else max(start, since // width * width)
+    if width < ROLLUP_RESOLUTIONS[0]:
+        rows = await fetch_envelopes(session, device.id, query_start, end, round(width * 1_000_000))
+    else:
+        resolution = max(r for r in ROLLUP_RESOLUTIONS if width % r == 0)
+        rows = await _rollup_envelopes(session, device.id, query_start, end, resolution, int(width))
+    points = [_envelope_point(*row, provisional=row[1] >= cursor) for row in rows]
+    return points, width, cursor
@@ -0,0 +1,280 @@
+import logging
+import math
+import time
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from ..models import PING_TYPES, Device, LatencyHistogram, Meta
+from .sample_store import PARTITION_SECONDS, days_between, fetch_day
+
+logger = logging.getLogger(__name__)
+
+# Bucket k holds latencies in (GAMMA^(k-1), GAMMA^k] ms; reading back the bucket midpoint
+# keeps every percentile within 1% of the true value
+HISTOGRAM_GAMMA = 1.02
+_LOG_GAMMA = math.log(HISTOGRAM_GAMMA)
+# Width of one persisted histogram in seconds
+HISTOGRAM_SECONDS = 60
+# Minutes kept open in memory after their last sample, so late probes don't reload them
+OPEN_MINUTES = 2
+# Seconds of samples read per query when building histograms from stored samples
+BACKFILL_SPAN = 600
+# Meta key set once every stored sample has been folded into histograms
+BACKFILL_KEY = "histograms_backfilled"
+
+
+def bucket_key(latency_ms: float) -> int:
+    return math.ceil(math.log(max(latency_ms, 0.001)) / _LOG_GAMMA)
+
+
+def bucket_value(key: int) -> float:
+    return 2 * HISTOGRAM_GAMMA ** key / (HISTOGRAM_GAMMA + 1)
+
+
+def _varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_histogram(buckets: dict[int, int]) -> bytes:
+    """Sorted (key, count) pairs as varints: the first key zigzag-encoded, then gaps."""
+    out = bytearray()
+    prev = None
+    for key in sorted(buckets):
+        if prev is None:
+            _varint(key << 1 if key >= 0 else (-key << 1) - 1, out)
+        else:
+            _varint(key - prev, out)
+        _varint(buckets[key], out)
+        prev = key
+    return bytes(out)
+
+
+def decode_histogram(data: bytes, into: dict[int, int] | None = None) -> dict[int, int]:
+    """Inverse of encode_histogram, optionally adding the counts into an existing histogram."""
+    buckets = {} if into is None else into
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value = shift = 0
+    key = None
+    for i in range(0, len(values), 2):
+        if key is None:
+            zigzag = values[i]
+            key = zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+        else:
+            key += values[i]
+        buckets[key] = buckets.get(key, 0) + values[i + 1]
+    return buckets
+
+
+def percentiles(buckets: dict[int, int], quantiles: tuple[float, ...]) -> list[float | None]:
+    """Latency at each quantile, as the midpoint of the bucket holding it."""
+    total = sum(buckets.values())
+    if total == 0:
+        return [None] * len(quantiles)
+    out = []
+    keys = sorted(buckets)
+    for q in quantiles:
+        rank = q * (total - 1)
+        seen = 0
+        for key in keys:
+            seen += buckets[key]
+            if seen > rank:
+                out.append(bucket_value(key))
+                break
+    return out
+
+
+class HistogramWriter:
+    """Folds flushed samples into per-minute latency histograms and persists them.
+
+    The minutes still receiving samples stay in memory and are rewritten whole on every
+    flush; a minute that isn't in memory (after a restart, or a very late sample) is read
+    back first, so counts are never lost or doubled.
+    """
+
+    def __init__(self):
+        self._open: dict[tuple[int, str, int], list] = {}
+        self._last_latency: dict[tuple[int, str], float] = {}
+
+    def discard(self, device_id: int) -> None:
+        for key in [k for k in self._open if k[0] == device_id]:
+            del self._open[key]
+        for key in [k for k in self._last_latency if k[0] == device_id]:
+            del self._last_latency[key]
+
+    async def apply(self, conn: AsyncConnection, rows: list[tuple]) -> None:
+        """Merge a flushed batch of (device_id, timestamp, ping_type, latency_ms, packet_lost)."""
+        touched: dict[tuple[int, str, int], None] = {}
+        for device_id, ts, ping_type, latency, lost in rows:
+            if not lost:
+                touched[(device_id, ping_type, int(ts // HISTOGRAM_SECONDS * HISTOGRAM_SECONDS))] = None
+        if not touched:
+            return
+        await self._load([key for key in touched if key not in self._open], conn)
+
+        for device_id, ts, ping_type, latency, lost in rows:
+            if lost:
+                continue
+            entry = self._open[(device_id, ping_type, int(ts // HISTOGRAM_SECONDS * HISTOGRAM_SECONDS))]
+            key = bucket_key(latency)
+            entry[0][key] = entry[0].get(key, 0) + 1
+            previous = self._last_latency.get((device_id, ping_type))
+            if previous is not None:
+                entry[1] += abs(latency - previous)
+                entry[2] += 1
+            self._last_latency[(device_id, ping_type)] = latency
+
+        stmt = insert(LatencyHistogram)
+        await conn.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["device_id", "ping_type", "bucket_ts"],
+                set_={"jitter_sum": stmt.excluded.jitter_sum, "jitter_count": stmt.excluded.jitter_count,
+                      "data": stmt.excluded.data},
+            ),
+            [
+                {
+                    "device_id": device_id,
+                    "ping_type": ping_type,
+                    "bucket_ts": bucket_ts,
+                    "jitter_sum": self._open[(device_id, ping_type, bucket_ts)][1],
+                    "jitter_count": self._open[(device_id, ping_type, bucket_ts)][2],
+                    "data": encode_histogram(self._open[(device_id, ping_type, bucket_ts)][0]),
+                }
+                for device_id, ping_type, bucket_ts in touched
+            ],
+        )
+
+        newest = max(bucket_ts for _, _, bucket_ts in touched)
+        horizon = newest - OPEN_MINUTES * HISTOGRAM_SECONDS
+        for key in [k for k in self._open if k[2] < horizon]:
+            del self._open[key]
+
+    async def _load(self, keys: list[tuple[int, str, int]], conn: AsyncConnection) -> None:
+        for key in keys:
+            self._open[key] = [{}, 0.0, 0]
+        if not keys:
+            return
+        rows = await conn.execute(
+            select(
+                LatencyHistogram.device_id, LatencyHistogram.ping_type, LatencyHistogram.bucket_ts,
+                LatencyHistogram.jitter_sum, LatencyHistogram.jitter_count, LatencyHistogram.data,
+            ).where(
+                tuple_(LatencyHistogram.device_id, LatencyHistogram.ping_type, LatencyHistogram.bucket_ts).in_(keys)
+            )
+        )
+        for device_id, ping_type, bucket_ts, jitter_sum, jitter_count, data in rows:
+            self._open[(device_id, ping_type, bucket_ts)] = [decode_histogram(data), jitter_sum, jitter_count]
+
+
+histogram_writer = HistogramWriter()
+
+
+async def window_latency(session: AsyncSession, device_id: int, start: float, end: float) -> dict:
+    """p50/p90/p99/p99.9 latency and mean jitter over [start, end), merged from the minute
+    histograms of the device's ICMP replies (ARP when it has no ICMP)."""
+    result = await session.execute(
+        select(LatencyHistogram.ping_type, LatencyHistogram.jitter_sum, LatencyHistogram.jitter_count,
+               LatencyHistogram.data)
+        .where(
+            LatencyHistogram.device_id == device_id,
+            LatencyHistogram.bucket_ts >= int(start // HISTOGRAM_SECONDS * HISTOGRAM_SECONDS),
+            LatencyHistogram.bucket_ts < end,
+        )
+    )
+    merged: dict[str, list] = {}
+    for ping_type, jitter_sum, jitter_count, data in result:
+        entry = merged.get(ping_type)
+        if entry is None:
+            entry = merged[ping_type] = [{}, 0.0, 0]
+        decode_histogram(data, entry[0])
+        entry[1] += jitter_sum
+        entry[2] += jitter_count
+    buckets, jitter_sum, jitter_count = merged.get("icmp") or merged.get("arp") or ({}, 0.0, 0)
+    p50, p90, p99, p999 = percentiles(buckets, (0.5, 0.9, 0.99, 0.999))
+    return {
+        "p50": p50,
+        "p90": p90,
+        "p99": p99,
+        "p999": p999,
+        "jitter": jitter_sum / jitter_count if jitter_count else None,
+    }
+
+
+async def backfill_histograms(engine: AsyncEngine) -> None:
+    """Build minute histograms from the stored samples for databases created before they existed.
+
+    Each device and day is read BACKFILL_SPAN at a time and committed on its own; minutes that
+    already have a histogram are kept, so an interrupted backfill picks up where it stopped.
+    """
+    async with engine.connect() as conn:
+        if (await conn.execute(select(Meta.value).where(Meta.key == BACKFILL_KEY))).first():
+            return
+        device_ids = (await conn.execute(select(Device.id))).scalars().all()
+    now = time.time()
+    days = days_between(0, now)
+    if days:
+        logger.info("Building latency histograms from existing samples, this may take a while")
+    end_us = round(now * 1_000_000)
+    built = 0
+    for device_id in device_ids:
+        # Jitter runs across minute and day boundaries, as the writer's does
+        last_latency: dict[int, float] = {}
+        for day in days:
+            async with engine.begin() as conn:
+                built += await _backfill_day(conn, device_id, day, end_us, last_latency)
+    async with engine.begin() as conn:
+        await conn.execute(insert(Meta).values(key=BACKFILL_KEY, value=str(int(now))).on_conflict_do_nothing())
+    if days:
+        logger.info("Built %d minute latency histograms", built)
+
+
+async def _backfill_day(
+    conn: AsyncConnection, device_id: int, day: int, end_us: int, last_latency: dict[int, float]
+) -> int:
+    minutes: dict[tuple[int, int], list] = {}
+    day_start = day * PARTITION_SECONDS
+    for span_start in range(day_start, day_start + PARTITION_SECONDS, BACKFILL_SPAN):
+        lo = span_start * 1_000_000
+        hi = min(end_us, (span_start + BACKFILL_SPAN) * 1_000_000 - 1)
+        if lo > hi:
+            break
+        for ts_us, ping_type, latency_us in await fetch_day(conn, device_id, day, lo, hi):
+            if latency_us < 0:
+                continue
+            latency = latency_us / 1000
+            bucket_ts = ts_us // 1_000_000 // HISTOGRAM_SECONDS * HISTOGRAM_SECONDS
+            entry = minutes.get((ping_type, bucket_ts))
+            if entry is None:
+                entry = minutes[(ping_type, bucket_ts)] = [{}, 0.0, 0]
+            key = bucket_key(latency)
+            entry[0][key] = entry[0].get(key, 0) + 1
+            previous = last_latency.get(ping_type)
+            if previous is not None:
+                entry[1] += abs(latency - previous)
+                entry[2] += 1
+            last_latency[ping_type] = latency
+    if not minutes:
+        return 0
+    await conn.execute(insert(LatencyHistogram).on_conflict_do_nothing(), [
+        {
+            "device_id": device_id,
+            "ping_type": PING_TYPES[ping_type],
+            "bucket_ts": bucket_ts,
+            "jitter_sum": jitter_sum,
+            "jitter_count": jitter_count,
+            "data": encode_histogram(buckets),
+        }
+        for (ping_type, bucket_ts), (buckets, jitter_sum, jitter_count) in minutes.items()
+    ])
+    return len(minutes)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import time
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds without traffic before a subscriber gets an SSE comment, so proxies keep the stream open
+KEEPALIVE_SECONDS = 15
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class LiveFeed:
+    """In-memory pub/sub behind the /api/live event stream.
+
+    The monitor publishes samples, status changes and notifications as it produces them.
+    They only update pending per-device state; a single ticker folds that state into one
+    encoded message every ``live_interval`` seconds and hands the same bytes to every
+    subscriber, so the cost per tick doesn't depend on how many browsers are watching.
+    Each subscriber has a bounded queue: a client too slow to keep up loses its oldest
+    messages rather than growing the server's memory.
+
+    Relays get every publish call as it happens; the probe process uses one to pass them on
+    to the API workers, whose own feeds then serve the browsers.
+    """
+
+    def __init__(self):
+        self._subscribers: set[asyncio.Queue] = set()
+        self._relays: list = []
+        self._samples: dict[int, dict] = {}
+        self._events: list[bytes] = []
+        self._task: asyncio.Task | None = None
+        self._stats = {
+            "ticks": 0,
+            "messages_sent": 0,
+            "messages_dropped": 0,
+        }
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._tick_loop())
+        logger.info("Live feed started")
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return {**self._stats, "subscribers": len(self._subscribers)}
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(settings.live_queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def add_relay(self, relay) -> None:
+        """relay: any object with the publish_samples/publish_status/publish_notification methods."""
+        self._relays.append(relay)
+
+    def publish_samples(self, device_id: int, results: list[dict]) -> None:
+        """Fold one probe's results into the device's pending summary for the next tick."""
+        for relay in self._relays:
+            relay.publish_samples(device_id, results)
+        if not self._subscribers or not results:
+            return
+        pending = self._samples.get(device_id)
+        if pending is None:
+            pending = self._samples[device_id] = {"count": 0, "lost": 0, "latency_ms": None}
+        for result in results:
+            pending["count"] += 1
+            if result["packet_lost"]:
+                pending["lost"] += 1
+            else:
+                pending["latency_ms"] = result["latency_ms"]
+                pending["last_seen_at"] = result["timestamp"]
+            pending["timestamp"] = result["timestamp"]
+
+    def publish_status(self, device_id: int, old_status: str, new_status: str) -> None:
+        for relay in self._relays:
+            relay.publish_status(device_id, old_status, new_status)
+        self._publish_event("status", {
+            "device_id": device_id,
+            "old_status": old_status,
+            "status": new_status,
+            "timestamp": time.time(),
+        })
+
+    def publish_notification(self, notification: dict) -> None:
+        for relay in self._relays:
+            relay.publish_notification(notification)
+        self._publish_event("notification", notification)
+
+    def _publish_event(self, event: str, data: dict) -> None:
+        if self._subscribers:
+            self._events.append(_sse(event, data))
+
+    def _broadcast(self, message: bytes) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self._stats["messages_dropped"] += 1
+            queue.put_nowait(message)
+        self._stats["messages_sent"] += len(self._subscribers)
+
+    async def _tick_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(settings.live_interval)
+                self._tick()
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception("Live feed error")
+
+    def _tick(self) -> None:
+        samples, self._samples = self._samples, {}
+        events, self._events = self._events, []
+        if not self._subscribers:
+            return
+        self._stats["ticks"] += 1
+        # Transitions first, so a client never sees samples for a status it hasn't applied
+        for message in events:
+            self._broadcast(message)
+        if samples:
+            self._broadcast(_sse("samples", {"devices": samples}))
+
+
+live_feed = LiveFeed()
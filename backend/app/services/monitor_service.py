@@ -3,20 +3,39 @@ import logging
 import time
 from collections import defaultdict
 
-from sqlalchemy import select
+from sqlalchemy import update
 
 from ..config import settings
 from ..database import async_session
-from ..models import Device, PingResult
-from .arp_service import arp_ping
+from ..models import Device
+from .arp_service import arp_probe, close_engine as close_arp_engine
+from .device_registry import DeviceConfig, device_registry
+from .histogram_service import histogram_writer
+from .live_feed import live_feed
 from .notification_service import notify_device_down, notify_device_recovered, notify_high_packet_loss
-from .ping_service import icmp_ping
+from .ping_service import close_engine, icmp_probe
+from .rollup_service import apply_rollups
+from .sample_buffer import SampleBuffer
+from .sample_store import insert_samples
+from .scheduler import ProbeScheduler
+from .stats_service import stats_engine
 
 logger = logging.getLogger(__name__)
 
 WATCHDOG_INTERVAL = 30  # seconds between watchdog checks
 
 
+class _ProbeRound:
+    """The probes one scheduler tick sent to a device, collecting results until all are in."""
+
+    __slots__ = ("device", "waiting", "results")
+
+    def __init__(self, device: DeviceConfig, waiting: int):
+        self.device = device
+        self.waiting = waiting
+        self.results: list[dict] = []
+
+
 class MonitorService:
     _instance = None
 
@@ -30,9 +49,13 @@ class MonitorService:
         if self._initialized:
             return
         self._initialized = True
-        self._tasks: dict[int, asyncio.Task] = {}
-        self._write_buffer: list[dict] = []
-        self._buffer_lock = asyncio.Lock()
+        self._scheduler = ProbeScheduler(self._on_probe_due)
+        # Latest status change being saved and notified per device; probes run without tasks
+        self._status_saves: dict[int, asyncio.Task] = {}
+        self._arp_inflight: set[int] = set()
+        self._error_count: dict[int, int] = defaultdict(int)
+        self._buffer = SampleBuffer(settings.buffer_max_samples, settings.buffer_overflow_policy)
+        self._probes_skipped = 0
         self._flush_task: asyncio.Task | None = None
         self._watchdog_task: asyncio.Task | None = None
         self._consecutive_success: dict[int, int] = defaultdict(int)
@@ -42,245 +65,265 @@ class MonitorService:
     async def start(self) -> None:
         self._flush_task = asyncio.create_task(self._flush_loop())
         self._watchdog_task = asyncio.create_task(self._watchdog_loop())
-        async with async_session() as session:
-            result = await session.execute(
-                select(Device).where(Device.monitoring_enabled == True)  # noqa: E712
-            )
-            devices = result.scalars().all()
-            for device in devices:
-                self.start_device(device.id)
-        logger.info("Monitor service started, %d devices active", len(self._tasks))
+        for device in device_registry.monitored():
+            self.start_device(device.id)
+        logger.info("Monitor service started, %d devices active", len(self._scheduler))
 
     async def stop(self) -> None:
         if self._flush_task:
             self._flush_task.cancel()
         if self._watchdog_task:
             self._watchdog_task.cancel()
-        for task in self._tasks.values():
+        self._scheduler.close()
+        for task in list(self._status_saves.values()):
             task.cancel()
-        self._tasks.clear()
+        self._status_saves.clear()
+        self._arp_inflight.clear()
+        close_engine()
+        close_arp_engine()
         await self._flush_buffer()
 
     def start_device(self, device_id: int) -> None:
-        if device_id in self._tasks and not self._tasks[device_id].done():
+        device = device_registry.get(device_id)
+        if device is None or device_id in self._scheduler:
             return
-        self._tasks[device_id] = asyncio.create_task(self._monitor_device(device_id))
+        self._scheduler.add(device_id, device.interval_seconds)
         self._last_ping_time[device_id] = time.time()
         logger.info("Started monitoring device %d", device_id)
 
     async def stop_device(self, device_id: int) -> None:
-        task = self._tasks.pop(device_id, None)
-        if task:
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
+        self._unschedule(device_id)
+
+    def _unschedule(self, device_id: int) -> None:
+        self._scheduler.remove(device_id)
         self._consecutive_success.pop(device_id, None)
         self._consecutive_fail.pop(device_id, None)
         self._last_ping_time.pop(device_id, None)
+        self._error_count.pop(device_id, None)
         logger.info("Stopped monitoring device %d", device_id)
 
     def is_monitoring(self, device_id: int) -> bool:
-        return device_id in self._tasks and not self._tasks[device_id].done()
+        return device_id in self._scheduler
 
     async def restart_device(self, device_id: int) -> None:
         await self.stop_device(device_id)
         self.start_device(device_id)
 
-    async def _monitor_device(self, device_id: int) -> None:
-        error_count = 0
-        while True:
-            try:
-                async with async_session() as session:
-                    device = await session.get(Device, device_id)
-                    if not device or not device.monitoring_enabled:
-                        logger.info("Device %d disabled or deleted, stopping monitor", device_id)
-                        return
-
-                    interval = device.interval_seconds
-                    ping_type = device.ping_type
-                    ip = device.ip_address
-                    packet_size = device.packet_size
-
-                results = []
+    async def reset_device(self, device_id: int) -> None:
+        """Forget a device's live status and statistics after its data was cleared."""
+        device_registry.reset_status(device_id)
+        stats_engine.discard(device_id)
+        histogram_writer.discard(device_id)
+        self._consecutive_success.pop(device_id, None)
+        self._consecutive_fail.pop(device_id, None)
 
-                if ping_type in ("icmp", "both") and ip:
-                    result = await icmp_ping(ip, packet_size)
-                    result["device_id"] = device_id
-                    results.append(result)
+    async def metrics(self) -> dict:
+        return {
+            "scheduler": self._scheduler.stats(),
+            "buffer": {**self._buffer.stats(), "probes_skipped": self._probes_skipped},
+        }
+
+    def _on_probe_due(self, device_id: int) -> None:
+        """Send a device's probes straight from the scheduler tick. The engines answer through
+        futures resolved by their socket readers and timeout timers, so however many probes
+        are in flight, no task waits on any of them."""
+        # Backpressure: with the block policy, a full buffer pauses probing until the next flush
+        if self._buffer.full and self._buffer.policy == "block":
+            self._probes_skipped += 1
+            return
+        device = device_registry.get(device_id)
+        if not device or not device.monitoring_enabled:
+            logger.info("Device %d disabled or deleted, stopping monitor", device_id)
+            self._unschedule(device_id)
+            return
 
-                if ping_type in ("arp", "both") and ip:
-                    result = await arp_ping(ip)
-                    if result is not None:
-                        result["device_id"] = device_id
-                        results.append(result)
+        ip = device.ip_address
+        probes = []
+        try:
+            if device.ping_type in ("icmp", "both") and ip:
+                probes.append(("icmp", icmp_probe(ip, device.packet_size)))
+            # One ARP request per device at a time; a new one would only join the one still waiting
+            if device.ping_type in ("arp", "both") and ip and device_id not in self._arp_inflight:
+                future = arp_probe(ip)
+                if future is not None:
+                    self._arp_inflight.add(device_id)
+                    probes.append(("arp", future))
+        except Exception:
+            self._backoff(device_id)
+            return
 
-                async with self._buffer_lock:
-                    self._write_buffer.extend(results)
+        if not probes:
+            self._on_round_done(_ProbeRound(device, 0))
+            return
+        probe_round = _ProbeRound(device, len(probes))
+        for ping_type, future in probes:
+            future.add_done_callback(
+                lambda future, ping_type=ping_type: self._on_probe_done(probe_round, ping_type, future)
+            )
 
-                self._last_ping_time[device_id] = time.time()
-                await self._update_status(device_id, results)
+    def _on_probe_done(self, probe_round: _ProbeRound, ping_type: str, future: asyncio.Future) -> None:
+        if ping_type == "arp":
+            self._arp_inflight.discard(probe_round.device.id)
+        if future.cancelled():
+            return  # Engine closed on shutdown
+        latency = None if future.exception() else future.result()
+        probe_round.results.append({
+            "timestamp": time.time(),
+            "ping_type": ping_type,
+            "latency_ms": latency,
+            "packet_lost": latency is None,
+        })
+        probe_round.waiting -= 1
+        if probe_round.waiting == 0:
+            self._on_round_done(probe_round)
+
+    def _on_round_done(self, probe_round: _ProbeRound) -> None:
+        device, results = probe_round.device, probe_round.results
+        device_id = device.id
+        if device_id not in self._scheduler:
+            return
+        try:
+            for result in results:
+                result["device_id"] = device_id
+                self._buffer.put(result)
+            stats_engine.record(device_id, results)
+            live_feed.publish_samples(device_id, results)
 
-                # Reset error count on success
-                error_count = 0
-                await asyncio.sleep(interval)
+            self._last_ping_time[device_id] = time.time()
+            self._update_status(device, results)
 
-            except asyncio.CancelledError:
-                return
-            except Exception:
-                error_count += 1
-                backoff = min(error_count * 5, 60)
-                logger.exception(
-                    "Monitor error for device %d (attempt %d), retrying in %ds",
-                    device_id, error_count, backoff,
-                )
-                await asyncio.sleep(backoff)
+            # Reset error count on success
+            self._error_count.pop(device_id, None)
+        except Exception:
+            self._backoff(device_id)
+
+    def _backoff(self, device_id: int) -> None:
+        self._error_count[device_id] += 1
+        error_count = self._error_count[device_id]
+        backoff = min(error_count * 5, 60)
+        logger.exception(
+            "Monitor error for device %d (attempt %d), retrying in %ds",
+            device_id, error_count, backoff,
+        )
+        self._scheduler.postpone(device_id, backoff)
 
     async def _watchdog_loop(self) -> None:
-        """Periodically check that all monitoring tasks are alive and restart dead ones."""
+        """Periodically reconcile the schedule with the device registry and reschedule stuck devices."""
         while True:
             try:
                 await asyncio.sleep(WATCHDOG_INTERVAL)
-                await self._check_tasks()
+                await self.check_schedule()
             except asyncio.CancelledError:
                 return
             except Exception:
                 logger.exception("Watchdog error")
 
-    async def _check_tasks(self) -> None:
+    async def check_schedule(self) -> None:
         now = time.time()
-
-        # Find devices that should be monitored
-        try:
-            async with async_session() as session:
-                result = await session.execute(
-                    select(Device.id, Device.interval_seconds).where(
-                        Device.monitoring_enabled == True  # noqa: E712
-                    )
-                )
-                active_devices = {row.id: row.interval_seconds for row in result.all()}
-        except Exception:
-            logger.exception("Watchdog: failed to query devices")
-            return
-
+        active_devices = {d.id: d.interval_seconds for d in device_registry.monitored()}
         restarted = 0
 
         for device_id, interval in active_devices.items():
-            task = self._tasks.get(device_id)
-
-            # Task doesn't exist or has finished (crashed)
-            if task is None or task.done():
-                if task and task.done() and not task.cancelled():
-                    exc = task.exception()
-                    if exc:
-                        logger.warning(
-                            "Watchdog: device %d task died with: %s", device_id, exc
-                        )
-                logger.info("Watchdog: restarting dead task for device %d", device_id)
-                self._tasks[device_id] = asyncio.create_task(self._monitor_device(device_id))
-                self._last_ping_time[device_id] = now
+            if device_id not in self._scheduler:
+                logger.info("Watchdog: scheduling missing device %d", device_id)
+                self.start_device(device_id)
                 restarted += 1
                 continue
 
-            # Task exists but hasn't pinged in too long (stuck)
+            # Scheduled but hasn't completed a probe in too long (stuck)
             last_ping = self._last_ping_time.get(device_id, now)
             stale_threshold = max(interval * 10, 30)  # 10x interval or 30s, whichever is larger
-            if now - last_ping > stale_threshold:
+            if now - last_ping > stale_threshold and device_id not in self._error_count:
                 logger.warning(
-                    "Watchdog: device %d task appears stuck (no ping for %.0fs), restarting",
+                    "Watchdog: device %d appears stuck (no ping for %.0fs), rescheduling",
                     device_id, now - last_ping,
                 )
-                task.cancel()
-                try:
-                    await task
-                except (asyncio.CancelledError, Exception):
-                    pass
-                self._tasks[device_id] = asyncio.create_task(self._monitor_device(device_id))
-                self._last_ping_time[device_id] = now
+                await self.restart_device(device_id)
                 restarted += 1
 
-        # Clean up tasks for devices that are no longer monitored
-        stale_ids = [did for did in self._tasks if did not in active_devices]
+        # Unschedule devices that are no longer monitored
+        stale_ids = [did for did in self._scheduler.keys() if did not in active_devices]
         for device_id in stale_ids:
-            task = self._tasks.pop(device_id)
-            task.cancel()
-            self._last_ping_time.pop(device_id, None)
-            logger.info("Watchdog: cleaned up task for disabled device %d", device_id)
+            await self.stop_device(device_id)
+            logger.info("Watchdog: unscheduled disabled device %d", device_id)
 
         if restarted:
-            logger.info("Watchdog: restarted %d monitoring tasks", restarted)
+            logger.info("Watchdog: rescheduled %d devices", restarted)
 
-    async def _update_status(self, device_id: int, results: list[dict]) -> None:
+    def _update_status(self, device: DeviceConfig, results: list[dict]) -> None:
         if not results:
             return
 
+        device_id = device.id
         any_success = any(not r["packet_lost"] for r in results)
 
         if any_success:
             self._consecutive_success[device_id] += 1
             self._consecutive_fail[device_id] = 0
+            device_registry.mark_seen(device_id, time.time())
         else:
             self._consecutive_fail[device_id] += 1
             self._consecutive_success[device_id] = 0
 
-        async with async_session() as session:
-            device = await session.get(Device, device_id)
-            if not device:
-                return
-
-            old_status = device.status
-            new_status = old_status
-
-            if any_success:
-                device.last_seen_at = time.time()
-
-            if old_status == "unknown" and any_success:
-                new_status = "online"
-            elif old_status == "offline" and self._consecutive_success[device_id] >= settings.recovery_count:
+        old_status = device.status
+        new_status = old_status
+
+        if old_status == "unknown" and any_success:
+            new_status = "online"
+        elif old_status == "offline" and self._consecutive_success[device_id] >= settings.recovery_count:
+            new_status = "online"
+        elif old_status in ("online", "degraded") and not any_success:
+            fail_duration = self._consecutive_fail[device_id] * device.interval_seconds
+            if fail_duration >= settings.offline_loss_seconds:
+                new_status = "offline"
+            elif old_status == "online":
+                new_status = "degraded"
+        elif old_status == "degraded" and any_success:
+            # Recover from degraded once the recent loss rate is back under the threshold
+            if stats_engine.recent_loss_pct(device_id) < settings.degraded_loss_pct:
                 new_status = "online"
-            elif old_status in ("online", "degraded") and not any_success:
-                fail_duration = self._consecutive_fail[device_id] * device.interval_seconds
-                if fail_duration >= settings.offline_loss_seconds:
-                    new_status = "offline"
-                elif old_status == "online":
-                    new_status = "degraded"
-            elif old_status == "degraded" and any_success:
-                # Recover from degraded: check recent loss rate from DB
-                window_start = time.time() - settings.degraded_window_seconds
-                from sqlalchemy import Integer, func, select as sa_select
-                row = (await session.execute(
-                    sa_select(
-                        func.count().label("total"),
-                        func.sum(PingResult.packet_lost.cast(Integer)).label("lost"),
-                    ).where(
-                        PingResult.device_id == device_id,
-                        PingResult.timestamp >= window_start,
-                    )
-                )).one()
-                total = row.total or 0
-                lost = row.lost or 0
-                loss_pct = (lost / max(1, total)) * 100
-                if loss_pct < settings.degraded_loss_pct:
-                    new_status = "online"
-            elif old_status == "unknown" and not any_success:
-                fail_duration = self._consecutive_fail[device_id] * device.interval_seconds
-                if fail_duration >= settings.offline_loss_seconds:
-                    new_status = "offline"
-
-            if new_status != old_status:
-                device.status = new_status
-
-                if new_status == "offline":
-                    await notify_device_down(device)
-                elif new_status == "online" and old_status == "offline":
-                    await notify_device_recovered(device)
-                elif new_status == "degraded":
-                    total = self._consecutive_fail[device_id] + self._consecutive_success[device_id]
-                    loss_pct = self._consecutive_fail[device_id] / max(1, total) * 100
-                    await notify_high_packet_loss(device, loss_pct)
+        elif old_status == "unknown" and not any_success:
+            fail_duration = self._consecutive_fail[device_id] * device.interval_seconds
+            if fail_duration >= settings.offline_loss_seconds:
+                new_status = "offline"
 
-            await session.commit()
+        if new_status == old_status:
+            return
+        # Later probes see the new status right away; saving and notifying can take a moment
+        device.status = new_status
+        total = self._consecutive_fail[device_id] + self._consecutive_success[device_id]
+        loss_pct = self._consecutive_fail[device_id] / max(1, total) * 100
+        previous = self._status_saves.get(device_id)
+        task = asyncio.create_task(self._save_status(previous, device, old_status, new_status, loss_pct))
+        self._status_saves[device_id] = task
+        task.add_done_callback(
+            lambda task: self._status_saves.pop(device_id) if self._status_saves.get(device_id) is task else None
+        )
+
+    async def _save_status(
+        self, previous: asyncio.Task | None, device: DeviceConfig, old_status: str, new_status: str, loss_pct: float,
+    ) -> None:
+        try:
+            if previous is not None:
+                # One change after the other, so the last one written is the current status
+                await asyncio.wait([previous])
+            async with async_session() as session:
+                await session.execute(
+                    update(Device).where(Device.id == device.id).values(status=new_status)
+                )
+                await session.commit()
+            live_feed.publish_status(device.id, old_status, new_status)
+
+            if new_status == "offline":
+                await notify_device_down(device)
+            elif new_status == "online" and old_status == "offline":
+                await notify_device_recovered(device)
+            elif new_status == "degraded":
+                await notify_high_packet_loss(device, loss_pct)
+        except asyncio.CancelledError:
+            return
+        except Exception:
+            logger.exception("Failed to save status %s of device %d", new_status, device.id)
 
     async def _flush_loop(self) -> None:
         while True:
@@ -293,19 +336,18 @@ class MonitorService:
                 logger.exception("Flush error")
 
     async def _flush_buffer(self) -> None:
-        async with self._buffer_lock:
-            if not self._write_buffer:
-                return
-            batch = self._write_buffer.copy()
-            self._write_buffer.clear()
+        rows = self._buffer.drain()
+        seen = device_registry.pop_seen()
+        if not rows and not seen:
+            return
 
         async with async_session() as session:
-            for item in batch:
-                session.add(PingResult(
-                    device_id=item["device_id"],
-                    timestamp=item["timestamp"],
-                    ping_type=item["ping_type"],
-                    latency_ms=item.get("latency_ms"),
-                    packet_lost=item["packet_lost"],
-                ))
+            if rows:
+                # Prepared executemany straight from the buffer columns: no ORM objects or dicts
+                conn = await session.connection()
+                await insert_samples(conn, rows)
+                await apply_rollups(conn, rows)
+                await histogram_writer.apply(conn, rows)
+            if seen:
+                await session.execute(update(Device), seen)
             await session.commit()
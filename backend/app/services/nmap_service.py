@@ -1,9 +1,25 @@
 import asyncio
+import heapq
+import itertools
 import logging
 import re
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from collections.abc import AsyncIterator
+
+from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Scan priorities, lowest first: someone waiting in the UI beats a bulk add
+PRIORITY_USER = 0
+PRIORITY_BULK = 1
+# Scan durations kept for the metrics percentiles
+DURATION_HISTORY = 200
+# Most hosts handed to one nmap process by a batch scan
+NMAP_BATCH_SIZE = 256
+
 
 async def basic_scan(ip_address: str) -> dict:
     """Run a basic nmap -sn scan (no port scan, no OS detection)."""
@@ -30,6 +46,7 @@ async def nmap_scan(ip_address: str) -> dict:
 
 
 async def _run_nmap(ip_address: str, flags: list[str], timeout: int = 30) -> dict:
+    proc = None
     try:
         proc = await asyncio.create_subprocess_exec(
             "nmap", *flags, ip_address,
@@ -72,8 +89,388 @@ async def _run_nmap(ip_address: str, flags: list[str], timeout: int = 30) -> dic
         return result
 
     except asyncio.TimeoutError:
-        return {"raw": "nmap scan timed out", "os_info": None, "manufacturer": None, "mac_address": None, "device_type": None}
+        return _empty_result("nmap scan timed out")
     except FileNotFoundError:
-        return {"raw": "nmap not installed", "os_info": None, "manufacturer": None, "mac_address": None, "device_type": None}
+        return _empty_result("nmap not installed")
     except Exception as e:
-        return {"raw": str(e), "os_info": None, "manufacturer": None, "mac_address": None, "device_type": None}
+        return _empty_result(str(e))
+    finally:
+        # Don't leave a timed-out or cancelled nmap holding a worker's share of the machine
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+
+
+def _empty_result(raw: str) -> dict:
+    return {"raw": raw, "os_info": None, "manufacturer": None, "mac_address": None, "device_type": None}
+
+
+async def batch_scan(ip_addresses: list[str], timeout: int = 300) -> AsyncIterator[tuple[str, dict]]:
+    """Basic scan of many hosts with one ``nmap -sn``, yielding (ip, result) as nmap
+    reports each host that is up. Hosts that are down are not yielded.
+
+    The XML output is parsed while nmap is still running. Raises asyncio.TimeoutError,
+    FileNotFoundError or RuntimeError when the scan can't finish.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "nmap", "-sn", "-oX", "-", "-iL", "-",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        proc.stdin.write("\n".join(ip_addresses).encode() + b"\n")
+        proc.stdin.close()
+
+        deadline = time.monotonic() + timeout
+        parser = ET.XMLPullParser(events=("end",))
+        while True:
+            chunk = await asyncio.wait_for(proc.stdout.read(65536), deadline - time.monotonic())
+            if not chunk:
+                break
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if element.tag == "host":
+                    ip_address, result = _parse_host(element)
+                    element.clear()
+                    if ip_address:
+                        yield ip_address, result
+
+        stderr = await asyncio.wait_for(proc.stderr.read(), max(0.0, deadline - time.monotonic()) + 1)
+        await proc.wait()
+        if proc.returncode != 0:
+            raise RuntimeError(stderr.decode("utf-8", errors="replace").strip() or f"nmap exited with {proc.returncode}")
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+
+
+def _parse_host(host: ET.Element) -> tuple[str | None, dict]:
+    """(IPv4 address, scan result) of one <host> element of nmap's XML output, with the raw
+    output in the lines nmap's normal output has for the host, as single scans store it."""
+    ip_address = None
+    result = _empty_result("")
+    for address in host.iter("address"):
+        if address.get("addrtype") == "ipv4":
+            ip_address = address.get("addr")
+        elif address.get("addrtype") == "mac":
+            result["mac_address"] = address.get("addr")
+            result["manufacturer"] = address.get("vendor")
+    osmatch = host.find("os/osmatch")
+    if osmatch is not None:
+        result["os_info"] = osmatch.get("name")
+        osclass = osmatch.find("osclass")
+        if osclass is not None:
+            result["device_type"] = osclass.get("type")
+
+    hostname = host.find("hostnames/hostname")
+    name = hostname.get("name") if hostname is not None else None
+    lines = [f"Nmap scan report for {name} ({ip_address})" if name else f"Nmap scan report for {ip_address}"]
+    times = host.find("times")
+    if times is not None and times.get("srtt"):
+        lines.append(f"Host is up ({int(times.get('srtt')) / 1e6:g}s latency).")
+    else:
+        lines.append("Host is up.")
+    if result["mac_address"]:
+        lines.append(f"MAC Address: {result['mac_address']} ({result['manufacturer'] or 'Unknown'})")
+    result["raw"] = "\n".join(lines)
+    return ip_address, result
+
+
+def _mac_key(mac_address: str | None) -> str | None:
+    return mac_address.lower() if mac_address else None
+
+
+class _ScanRequest:
+    __slots__ = ("ip_address", "mac_address", "fingerprint", "priority", "futures")
+
+    def __init__(self, ip_address: str, mac_address: str | None, fingerprint: bool, priority: int):
+        self.ip_address = ip_address
+        self.mac_address = mac_address
+        self.fingerprint = fingerprint
+        self.priority = priority
+        self.futures: list[asyncio.Future] = []
+
+
+class _BatchRequest:
+    __slots__ = ("key", "mac_addresses", "priority", "future", "joined")
+
+    def __init__(self, key: str, mac_addresses: dict[str, str | None], priority: int):
+        self.key = key
+        self.mac_addresses = mac_addresses
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Basic scan requests for one of its hosts that arrived while it was queued or running
+        self.joined: dict[str, list[asyncio.Future]] = {}
+
+
+class ScanScheduler:
+    """Runs nmap scans on a bounded pool of workers.
+
+    Requests wait in a priority queue. A request for an IP that is already queued or being
+    scanned joins it (a queued one is upgraded to an OS fingerprint or a higher priority if
+    needed) instead of starting another nmap. Results are cached per IP and MAC for ``nmap_cache_ttl`` seconds; a cached
+    fingerprint scan also answers basic scan requests.
+
+    Batch requests take one worker for up to NMAP_BATCH_SIZE hosts scanned by a single nmap.
+    Hosts already queued or being scanned join that scan instead of the batch, and basic
+    scan requests for a host in a queued or running batch join the batch.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[int, int, str]] = []
+        self._order = itertools.count()
+        self._queued: dict[str, _ScanRequest | _BatchRequest] = {}
+        self._running: dict[str, list[_ScanRequest]] = {}
+        self._batches: dict[str, _BatchRequest] = {}
+        # IP to the queued or running batch that scans it
+        self._batched: dict[str, _BatchRequest] = {}
+        self._cache: dict[tuple[str, str | None], tuple[float, bool, dict]] = {}
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+        self._durations: deque[float] = deque(maxlen=DURATION_HISTORY)
+        self._stats = {
+            "requests": 0,
+            "coalesced": 0,
+            "cache_hits": 0,
+            "scans_completed": 0,
+            "batches_completed": 0,
+            "batch_hosts": 0,
+        }
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.nmap_workers)]
+        logger.info("nmap scan pool started with %d workers", settings.nmap_workers)
+
+    def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    def stats(self) -> dict:
+        durations = sorted(self._durations)
+        return {
+            **self._stats,
+            "workers": len(self._workers),
+            "queue_depth": len(self._queued),
+            "running": sorted(self._running) + sorted(self._batches),
+            "cache_entries": len(self._cache),
+            "scan_seconds_avg": round(sum(durations) / len(durations), 2) if durations else None,
+            "scan_seconds_p95": durations[int(0.95 * (len(durations) - 1))] if durations else None,
+        }
+
+    def _cached(self, ip_address: str, mac_address: str | None, fingerprint: bool) -> dict | None:
+        key = (ip_address, _mac_key(mac_address))
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, fingerprinted, result = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        return result if fingerprinted or not fingerprint else None
+
+    async def scan(
+        self,
+        ip_address: str,
+        fingerprint: bool = False,
+        mac_address: str | None = None,
+        priority: int = PRIORITY_BULK,
+        force: bool = False,
+    ) -> dict:
+        """Result of an nmap scan of ip_address, from the cache unless force is set."""
+        self._stats["requests"] += 1
+        if not force:
+            cached = self._cached(ip_address, mac_address, fingerprint)
+            if cached is not None:
+                self._stats["cache_hits"] += 1
+                return cached
+
+        if not force:
+            future = self._join(ip_address, fingerprint)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return await future
+
+        future = asyncio.get_running_loop().create_future()
+        request = self._queued.get(ip_address)
+        if request is None:
+            request = self._queued[ip_address] = _ScanRequest(ip_address, mac_address, fingerprint, priority)
+            heapq.heappush(self._heap, (priority, next(self._order), ip_address))
+        else:
+            self._stats["coalesced"] += 1
+            request.fingerprint = request.fingerprint or fingerprint
+            request.mac_address = request.mac_address or mac_address
+            if priority < request.priority:
+                # The old heap entry is skipped when it comes up
+                request.priority = priority
+                heapq.heappush(self._heap, (priority, next(self._order), ip_address))
+        request.futures.append(future)
+        self._wakeup.set()
+        return await future
+
+    async def scan_batch(
+        self,
+        targets: dict[str, str | None],
+        priority: int = PRIORITY_BULK,
+        force: bool = False,
+    ) -> dict[str, dict]:
+        """Basic scan results for many IPs (mapped to their known MAC, if any).
+
+        Cached results are used unless force is set; the rest is split into batches of
+        NMAP_BATCH_SIZE hosts, each scanned by one nmap process on the pool.
+        """
+        self._stats["requests"] += len(targets)
+        results: dict[str, dict] = {}
+        pending: dict[str, str | None] = {}
+        joined: dict[str, asyncio.Future] = {}
+        for ip_address, mac_address in targets.items():
+            cached = None if force else self._cached(ip_address, mac_address, False)
+            if cached is not None:
+                self._stats["cache_hits"] += 1
+                results[ip_address] = cached
+                continue
+            future = None if force else self._join(ip_address, False)
+            queued = self._queued.get(ip_address)
+            if future is None and queued is not None:
+                # Not started yet, so its result is as fresh as a forced scan's
+                future = asyncio.get_running_loop().create_future()
+                queued.futures.append(future)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                joined[ip_address] = future
+            else:
+                pending[ip_address] = mac_address
+
+        batches = []
+        ips = list(pending)
+        for i in range(0, len(ips), NMAP_BATCH_SIZE):
+            request = _BatchRequest(
+                f"batch-{next(self._order)}", {ip: pending[ip] for ip in ips[i:i + NMAP_BATCH_SIZE]}, priority,
+            )
+            self._queued[request.key] = request
+            for ip_address in request.mac_addresses:
+                self._batched[ip_address] = request
+            heapq.heappush(self._heap, (priority, next(self._order), request.key))
+            batches.append(request.future)
+        self._wakeup.set()
+        for batch in await asyncio.gather(*batches):
+            results.update(batch)
+        for ip_address, future in joined.items():
+            results[ip_address] = await future
+        return results
+
+    def _join(self, ip_address: str, fingerprint: bool) -> asyncio.Future | None:
+        """A future for the result of a scan of ip_address that is already running, or in a
+        queued or running batch, if that scan answers this kind of request; None otherwise."""
+        future = asyncio.get_running_loop().create_future()
+        for request in self._running.get(ip_address, ()):
+            if request.fingerprint or not fingerprint:
+                request.futures.append(future)
+                return future
+        batch = self._batched.get(ip_address)
+        if batch is not None and not fingerprint:
+            batch.joined.setdefault(ip_address, []).append(future)
+            return future
+        return None
+
+    async def _next_request(self) -> _ScanRequest | _BatchRequest:
+        while True:
+            while self._heap:
+                priority, _, ip_address = heapq.heappop(self._heap)
+                request = self._queued.get(ip_address)
+                if request is not None and request.priority == priority:
+                    del self._queued[ip_address]
+                    return request
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _worker(self) -> None:
+        while True:
+            request = await self._next_request()
+            if isinstance(request, _BatchRequest):
+                await self._run_batch(request)
+                continue
+            # A forced rescan can run next to an earlier scan of the same IP
+            self._running.setdefault(request.ip_address, []).append(request)
+            started = time.monotonic()
+            try:
+                if request.fingerprint:
+                    result = await nmap_scan(request.ip_address)
+                else:
+                    result = await basic_scan(request.ip_address)
+            except asyncio.CancelledError:
+                for future in request.futures:
+                    future.cancel()
+                raise
+            except Exception as e:
+                logger.exception("nmap scan of %s failed", request.ip_address)
+                result = _empty_result(str(e))
+            finally:
+                running = self._running[request.ip_address]
+                running.remove(request)
+                if not running:
+                    del self._running[request.ip_address]
+
+            self._durations.append(round(time.monotonic() - started, 2))
+            self._stats["scans_completed"] += 1
+            # Only finished scans are cached, so a timeout or missing nmap is retried next time
+            self._prune()
+            if "Nmap done" in result.get("raw", ""):
+                self._store(request.ip_address, request.mac_address, request.fingerprint, result)
+            for future in request.futures:
+                if not future.done():
+                    future.set_result(result)
+
+    async def _run_batch(self, request: _BatchRequest) -> None:
+        self._batches[request.key] = request
+        self._prune()
+        results: dict[str, dict] = {}
+        try:
+            async for ip_address, result in batch_scan(list(request.mac_addresses)):
+                if ip_address in request.mac_addresses:
+                    results[ip_address] = result
+                    self._store(ip_address, request.mac_addresses[ip_address], False, result)
+            missing = "Note: Host seems down."
+        except asyncio.CancelledError:
+            request.future.cancel()
+            for futures in request.joined.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except asyncio.TimeoutError:
+            missing = "nmap scan timed out"
+        except FileNotFoundError:
+            missing = "nmap not installed"
+        except Exception as e:
+            logger.exception("nmap batch scan of %d hosts failed", len(request.mac_addresses))
+            missing = str(e)
+        finally:
+            del self._batches[request.key]
+            for ip_address in request.mac_addresses:
+                if self._batched.get(ip_address) is request:
+                    del self._batched[ip_address]
+
+        for ip_address in request.mac_addresses:
+            if ip_address not in results:
+                results[ip_address] = _empty_result(missing)
+        self._stats["batches_completed"] += 1
+        self._stats["batch_hosts"] += len(request.mac_addresses)
+        if not request.future.done():
+            request.future.set_result(results)
+        for ip_address, futures in request.joined.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results[ip_address])
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, entry in self._cache.items() if entry[0] < now]:
+            del self._cache[key]
+
+    def _store(self, ip_address: str, mac_address: str | None, fingerprint: bool, result: dict) -> None:
+        expires_at = time.monotonic() + settings.nmap_cache_ttl
+        for mac in {mac_address, result.get("mac_address")}:
+            self._cache[(ip_address, _mac_key(mac))] = (expires_at, fingerprint, result)
+
+
+scan_scheduler = ScanScheduler()
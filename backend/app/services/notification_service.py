@@ -1,5 +1,7 @@
 from ..database import async_session
-from ..models import Device, Notification
+from ..models import Notification
+from .device_registry import DeviceConfig, device_registry
+from .live_feed import live_feed
 
 
 async def create_notification(device_id: int, notification_type: str, message: str) -> None:
@@ -11,9 +13,19 @@ async def create_notification(device_id: int, notification_type: str, message: s
         )
         session.add(notification)
         await session.commit()
-
-
-async def notify_device_down(device: Device) -> None:
+    device = device_registry.get(device_id)
+    live_feed.publish_notification({
+        "id": notification.id,
+        "device_id": device_id,
+        "device_name": device.name if device else None,
+        "type": notification_type,
+        "message": message,
+        "is_read": False,
+        "created_at": notification.created_at,
+    })
+
+
+async def notify_device_down(device: DeviceConfig) -> None:
     await create_notification(
         device.id,
         "device_down",
@@ -21,7 +33,7 @@ async def notify_device_down(device: Device) -> None:
     )
 
 
-async def notify_high_packet_loss(device: Device, loss_pct: float) -> None:
+async def notify_high_packet_loss(device: DeviceConfig, loss_pct: float) -> None:
     await create_notification(
         device.id,
         "high_packet_loss",
@@ -29,7 +41,7 @@ async def notify_high_packet_loss(device: Device, loss_pct: float) -> None:
     )
 
 
-async def notify_device_recovered(device: Device) -> None:
+async def notify_device_recovered(device: DeviceConfig) -> None:
     await create_notification(
         device.id,
         "device_recovered",
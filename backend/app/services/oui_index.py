@@ -0,0 +1,154 @@
+import logging
+import os
+import struct
+import threading
+from array import array
+from importlib import metadata
+from pathlib import Path
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"BPOUI\x01"
+# Prefix lengths in the IEEE registries (MA-S, MA-M, MA-L), most specific first
+PREFIX_BITS = (36, 28, 24)
+
+
+def index_path() -> Path:
+    return Path(settings.db_path).parent / "oui-index.bin"
+
+
+def _source_tag() -> str | None:
+    """Identifies the vendor list the index was built from, so a scapy upgrade rebuilds it."""
+    try:
+        return f"scapy-{metadata.version('scapy')}"
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def parse_manuf(lines) -> tuple[dict[int, dict[int, int]], list[str]]:
+    """Wireshark manuf lines to {prefix bits: {prefix: name index}} and the vendor names."""
+    tables: dict[int, dict[int, int]] = {bits: {} for bits in PREFIX_BITS}
+    names: list[str] = []
+    name_ids: dict[str, int] = {}
+    for line in lines:
+        parts = line.strip().split(None, 2)
+        if len(parts) < 2 or parts[0].startswith("#"):
+            continue
+        prefix, _, length = parts[0].partition("/")
+        digits = prefix.replace(":", "").replace("-", "")
+        try:
+            bits = int(length) if length else len(digits) * 4
+            value = int(digits, 16) << (48 - len(digits) * 4)
+        except ValueError:
+            continue
+        if bits not in tables:
+            continue
+        name = parts[1]
+        if name not in name_ids:
+            name_ids[name] = len(names)
+            names.append(name)
+        tables[bits][value >> (48 - bits)] = name_ids[name]
+    return tables, names
+
+
+def encode_index(tables: dict[int, dict[int, int]], names: list[str], source: str) -> bytes:
+    """Magic, source tag, per prefix length a count with sorted prefixes and name indexes,
+    then the newline-joined names."""
+    tag = source.encode()
+    out = [INDEX_MAGIC, struct.pack("<H", len(tag)), tag]
+    for bits in PREFIX_BITS:
+        table = tables[bits]
+        prefixes = sorted(table)
+        out.append(struct.pack("<I", len(prefixes)))
+        out.append(array("Q", prefixes).tobytes())
+        out.append(array("I", [table[p] for p in prefixes]).tobytes())
+    blob = "\n".join(names).encode()
+    out.append(struct.pack("<I", len(blob)))
+    out.append(blob)
+    return b"".join(out)
+
+
+def decode_index(data: bytes, source: str | None = None) -> tuple[dict[int, dict[int, int]], list[str]]:
+    """Inverse of encode_index; raises ValueError for a foreign file or another source tag."""
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError("not an OUI index")
+    pos = len(INDEX_MAGIC)
+    (tag_len,) = struct.unpack_from("<H", data, pos)
+    pos += 2
+    if source is not None and data[pos:pos + tag_len].decode() != source:
+        raise ValueError("OUI index was built from another vendor list")
+    pos += tag_len
+    tables = {}
+    for bits in PREFIX_BITS:
+        (count,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        prefixes = array("Q", data[pos:pos + 8 * count])
+        pos += 8 * count
+        name_ids = array("I", data[pos:pos + 4 * count])
+        pos += 4 * count
+        tables[bits] = dict(zip(prefixes, name_ids))
+    (blob_len,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    return tables, data[pos:pos + blob_len].decode().split("\n")
+
+
+class OuiIndex:
+    """MAC prefix to vendor name, with one dict probe per registry size.
+
+    Built from scapy's bundled copy of the Wireshark manuf list the first time it's needed,
+    then kept as a small binary file next to the database so later starts neither import
+    scapy's vendor database nor parse it.
+    """
+
+    def __init__(self):
+        self._tables: dict[int, dict[int, int]] | None = None
+        self._names: list[str] = []
+        self._lock = threading.Lock()
+
+    def lookup(self, mac: str) -> str | None:
+        if self._tables is None:
+            self.load()
+        try:
+            value = int(mac.replace(":", "").replace("-", ""), 16)
+        except ValueError:
+            return None
+        for bits in PREFIX_BITS:
+            name_id = self._tables[bits].get(value >> (48 - bits))
+            if name_id is not None:
+                return self._names[name_id]
+        return None
+
+    def load(self) -> None:
+        with self._lock:
+            if self._tables is not None:
+                return
+            source = _source_tag()
+            path = index_path()
+            try:
+                tables, names = decode_index(path.read_bytes(), source)
+                self._names, self._tables = names, tables
+                return
+            except FileNotFoundError:
+                pass
+            except (ValueError, struct.error) as e:
+                logger.info("Rebuilding OUI index %s: %s", path, e)
+
+            if source is None:
+                logger.warning("No OUI vendor list available, MAC vendor lookups are disabled")
+                self._tables = {bits: {} for bits in PREFIX_BITS}
+                return
+            from scapy.libs.manuf import DATA
+            tables, names = parse_manuf(DATA.split("\n"))
+            try:
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(encode_index(tables, names, source))
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning("Could not save OUI index to %s: %s", path, e)
+            # Names first: lookups from other threads only check _tables
+            self._names, self._tables = names, tables
+
+
+oui_index = OuiIndex()
@@ -1,67 +1,295 @@
+import asyncio
+import ipaddress
 import logging
+import os
+import socket
+import struct
 import time
 
-from icmplib import async_ping
-
 logger = logging.getLogger(__name__)
 
 # Auto-detect whether we can use privileged (raw) sockets
 _use_privileged: bool | None = None
 
+ICMP_TIMEOUT = 2.0
+ICMP_RCVBUF = 4 * 1024 * 1024
+# Seconds a hostname's address is used before it is looked up again; probes keep going to
+# the old address while the lookup runs
+ICMP_RESOLVE_TTL = 300.0
 
-async def icmp_ping(ip_address: str, packet_size: int = 64) -> dict:
-    global _use_privileged
+_ICMPV4_ECHO_REQUEST = 8
+_ICMPV4_ECHO_REPLY = 0
+_ICMPV6_ECHO_REQUEST = 128
+_ICMPV6_ECHO_REPLY = 129
 
-    if _use_privileged is None:
-        # First call: try privileged, fall back to unprivileged
-        try:
-            result = await async_ping(
-                ip_address, count=1, timeout=2,
-                payload_size=max(0, packet_size - 28), privileged=True,
-            )
-            _use_privileged = True
-            logger.info("ICMP: using privileged (raw) sockets")
-        except PermissionError:
-            _use_privileged = False
-            logger.info("ICMP: no root, using unprivileged sockets")
-            result = await async_ping(
-                ip_address, count=1, timeout=2,
-                payload_size=max(0, packet_size - 28), privileged=False,
-            )
-        except Exception:
-            _use_privileged = False
-            result = await async_ping(
-                ip_address, count=1, timeout=2,
-                payload_size=max(0, packet_size - 28), privileged=False,
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class IcmpEngine:
+    """Long-lived ICMP pinger that multiplexes all echo requests over one socket per address family.
+
+    Replies are matched back to their request by (source address, sequence) and, on raw
+    sockets, by our identifier. On unprivileged datagram sockets the kernel rewrites the
+    identifier and only delivers replies addressed to this socket.
+    """
+
+    def __init__(self):
+        self._socks: dict[int, socket.socket] = {}
+        self._pending: dict[tuple[int, str, int], tuple[asyncio.Future, float, asyncio.TimerHandle]] = {}
+        self._sequence: dict[int, int] = {socket.AF_INET: 0, socket.AF_INET6: 0}
+        self._ident = os.getpid() & 0xFFFF
+        self._addresses: dict[str, tuple[int, tuple]] = {}
+        # Hostname -> ((family, sockaddr), when to look it up again)
+        self._hosts: dict[str, tuple[tuple[int, tuple], float]] = {}
+        # Hostnames being looked up, with the probes waiting for them
+        self._resolving: dict[str, tuple[asyncio.Task, list]] = {}
+        self._payloads: dict[int, bytes] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _open(self, family: int) -> socket.socket:
+        global _use_privileged
+
+        sock = self._socks.get(family)
+        if sock is not None:
+            return sock
+
+        proto = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+        if _use_privileged is None:
+            # First socket: try privileged, fall back to unprivileged
+            try:
+                sock = socket.socket(family, socket.SOCK_RAW, proto)
+                _use_privileged = True
+                logger.info("ICMP: using privileged (raw) sockets")
+            except PermissionError:
+                _use_privileged = False
+                logger.info("ICMP: no root, using unprivileged sockets")
+            except Exception:
+                _use_privileged = False
+        if sock is None:
+            sock = socket.socket(
+                family, socket.SOCK_RAW if _use_privileged else socket.SOCK_DGRAM, proto,
             )
 
-        return _make_result(result)
+        # Bursts of replies from many devices arrive together; don't let the kernel drop them
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ICMP_RCVBUF)
+        except OSError:
+            pass
+        sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable, family, sock)
+        self._socks[family] = sock
+        return sock
+
+    def close(self) -> None:
+        for sock in self._socks.values():
+            if self._loop and not self._loop.is_closed():
+                self._loop.remove_reader(sock.fileno())
+            sock.close()
+        self._socks.clear()
+        for future, _, timer in self._pending.values():
+            timer.cancel()
+            future.cancel()
+        self._pending.clear()
+        for task, waiting in self._resolving.values():
+            task.cancel()
+            for future, _, _ in waiting:
+                future.cancel()
+        self._resolving.clear()
+
+    def _resolve_literal(self, ip_address: str) -> tuple[int, tuple] | None:
+        """(family, sockaddr) of an IP address, None for a hostname."""
+        resolved = self._addresses.get(ip_address)
+        if resolved is None:
+            try:
+                family = socket.AF_INET6 if ipaddress.ip_address(ip_address).version == 6 else socket.AF_INET
+            except ValueError:
+                return None
+            # A numeric address never needs the resolver, so this doesn't block
+            infos = socket.getaddrinfo(ip_address, None, family, flags=socket.AI_NUMERICHOST)
+            family, _, _, _, sockaddr = infos[0]
+            resolved = self._addresses[ip_address] = (family, sockaddr)
+        return resolved
+
+    async def _resolve_host(self, hostname: str) -> tuple[int, tuple]:
+        infos = await asyncio.get_running_loop().getaddrinfo(hostname, None)
+        family, _, _, _, sockaddr = infos[0]
+        resolved = (family, sockaddr)
+        self._hosts[hostname] = (resolved, time.monotonic() + ICMP_RESOLVE_TTL)
+        return resolved
+
+    def _lookup(self, hostname: str) -> tuple[asyncio.Task, list]:
+        """Start looking up a hostname unless that's already under way."""
+        entry = self._resolving.get(hostname)
+        if entry is None:
+            task = asyncio.create_task(self._resolve_host(hostname))
+            entry = self._resolving[hostname] = (task, [])
+            task.add_done_callback(lambda task: self._on_resolved(hostname, task))
+        return entry
 
+    def _build_packet(self, family: int, sequence: int, payload_size: int) -> bytes:
+        payload = self._payloads.get(payload_size)
+        if payload is None:
+            payload = self._payloads[payload_size] = bytes(payload_size)
+        echo_type = _ICMPV4_ECHO_REQUEST if family == socket.AF_INET else _ICMPV6_ECHO_REQUEST
+        header = struct.pack("!BBHHH", echo_type, 0, 0, self._ident, sequence)
+        # The kernel fills in the ICMPv6 checksum (it covers the IPv6 pseudo-header)
+        if family == socket.AF_INET:
+            header = struct.pack("!BBHHH", echo_type, 0, _checksum(header + payload), self._ident, sequence)
+        return header + payload
+
+    def probe(self, ip_address: str, packet_size: int = 64, timeout: float = ICMP_TIMEOUT) -> asyncio.Future:
+        """Send one echo request without waiting for it. The returned future gets the
+        round-trip time in ms, or None if lost; a timer, not a task, waits out the timeout."""
+        future = asyncio.get_running_loop().create_future()
+        resolved = self._resolve_literal(ip_address)
+        if resolved is None:
+            cached = self._hosts.get(ip_address)
+            if cached is not None:
+                resolved, expires = cached
+                if expires <= time.monotonic():
+                    self._lookup(ip_address)
+        if resolved is not None:
+            self._send(resolved, future, packet_size, timeout)
+            return future
+        # Hostname never looked up: one lookup however many probes are waiting for it
+        self._lookup(ip_address)[1].append((future, packet_size, timeout))
+        return future
+
+    async def ping(self, ip_address: str, packet_size: int = 64, timeout: float = ICMP_TIMEOUT) -> float | None:
+        """Send one echo request and return the round-trip time in ms, or None if lost."""
+        return await self.probe(ip_address, packet_size, timeout)
+
+    def _on_resolved(self, hostname: str, task: asyncio.Task) -> None:
+        entry = self._resolving.get(hostname)
+        if entry is None or entry[0] is not task:
+            return
+        del self._resolving[hostname]
+        error = None if task.cancelled() else task.exception()
+        cached = self._hosts.get(hostname)
+        if error is not None and cached is not None:
+            # Keep the last address rather than losing every probe while DNS is unreachable
+            logger.debug("ICMP: cannot resolve %s again: %s", hostname, error)
+            self._hosts[hostname] = (cached[0], time.monotonic() + ICMP_RESOLVE_TTL)
+        for future, packet_size, timeout in entry[1]:
+            if future.done():
+                continue
+            if task.cancelled() or error is not None:
+                logger.debug("ICMP: cannot resolve %s: %s", hostname, error)
+                future.set_result(None)
+            else:
+                self._send(task.result(), future, packet_size, timeout)
+
+    def _send(self, resolved: tuple[int, tuple], future: asyncio.Future, packet_size: int, timeout: float) -> None:
+        family, sockaddr = resolved
+        try:
+            sock = self._open(family)
+        except OSError as e:
+            logger.debug("ICMP socket unavailable: %s", e)
+            future.set_result(None)
+            return
+
+        sequence = self._sequence[family] = (self._sequence[family] + 1) & 0xFFFF
+        key = (family, sockaddr[0], sequence)
+        packet = self._build_packet(family, sequence, max(0, packet_size - 28))
+        # The sequence wrapped onto a request still waiting: that one is as good as lost
+        self._expire(key)
+
+        sent_at = time.perf_counter()
+        try:
+            sock.sendto(packet, sockaddr)
+        except OSError as e:
+            logger.debug("ICMP send to %s failed: %s", sockaddr[0], e)
+            future.set_result(None)
+            return
+        timer = self._loop.call_later(timeout, self._expire, key)
+        self._pending[key] = (future, sent_at, timer)
+
+    def _expire(self, key: tuple[int, str, int]) -> None:
+        entry = self._pending.pop(key, None)
+        if entry is not None:
+            entry[2].cancel()
+            if not entry[0].done():
+                entry[0].set_result(None)
+
+    def _on_readable(self, family: int, sock: socket.socket) -> None:
+        while True:
+            try:
+                packet, source = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.debug("ICMP receive error: %s", e)
+                return
+            received_at = time.perf_counter()
+
+            if family == socket.AF_INET and _use_privileged:
+                # Raw IPv4 sockets deliver the IP header too
+                packet = packet[(packet[0] & 0x0F) * 4:]
+            if len(packet) < 8:
+                continue
+
+            icmp_type, _, _, ident, sequence = struct.unpack("!BBHHH", packet[:8])
+            if icmp_type != (_ICMPV4_ECHO_REPLY if family == socket.AF_INET else _ICMPV6_ECHO_REPLY):
+                continue
+            # Raw sockets see every echo reply on the host; datagram sockets get a kernel-chosen id
+            if _use_privileged and ident != self._ident:
+                continue
+
+            entry = self._pending.pop((family, source[0], sequence), None)
+            if entry is None:
+                continue
+            future, sent_at, timer = entry
+            timer.cancel()
+            if not future.done():
+                future.set_result(round((received_at - sent_at) * 1000, 3))
+
+
+_engine: IcmpEngine | None = None
+
+
+def get_engine() -> IcmpEngine:
+    global _engine
+    if _engine is None:
+        _engine = IcmpEngine()
+    return _engine
+
+
+def close_engine() -> None:
+    global _engine
+    if _engine is not None:
+        _engine.close()
+        _engine = None
+
+
+def icmp_probe(ip_address: str, packet_size: int = 64) -> asyncio.Future:
+    """Start one echo request without waiting for it: a future for the round-trip time in ms, None if lost."""
+    return get_engine().probe(ip_address, packet_size)
+
+
+async def icmp_ping(ip_address: str, packet_size: int = 64) -> dict:
     try:
-        result = await async_ping(
-            ip_address,
-            count=1,
-            timeout=2,
-            payload_size=max(0, packet_size - 28),
-            privileged=_use_privileged,
-        )
-        return _make_result(result)
-    except Exception:
-        return {
-            "timestamp": time.time(),
-            "ping_type": "icmp",
-            "latency_ms": None,
-            "packet_lost": True,
-        }
+        latency = await get_engine().ping(ip_address, packet_size)
+    except Exception as e:
+        logger.debug("ICMP ping failed for %s: %s", ip_address, e)
+        latency = None
+    return _make_result(latency)
 
 
-def _make_result(result) -> dict:
+def _make_result(latency: float | None) -> dict:
     ts = time.time()
-    if result.packets_received > 0:
+    if latency is not None:
         return {
             "timestamp": ts,
             "ping_type": "icmp",
-            "latency_ms": result.avg_rtt,
+            "latency_ms": latency,
             "packet_lost": False,
         }
     return {
@@ -0,0 +1,311 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+from dataclasses import asdict
+
+from .device_registry import DeviceConfig, device_registry
+from .graph_service import provisional_seconds
+from .live_feed import live_feed
+from .stats_service import stats_engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds the probe process collects samples before passing them on in one message
+LINK_INTERVAL = 0.1
+# Bytes queued for one API worker before the probe process disconnects it
+LINK_BUFFER_LIMIT = 16 * 1024 * 1024
+# Longest message line either end reads
+LINK_LINE_LIMIT = 64 * 1024 * 1024
+RECONNECT_DELAY = 1.0
+COMMAND_TIMEOUT = 10.0
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class ProbeServer:
+    """Probe-process end of the link to the API workers, one JSON message per line.
+
+    Registered as a live feed relay: samples are collected for LINK_INTERVAL and sent as one
+    message, status changes and notifications right away (after the samples before them).
+    Each message is encoded once for all workers and written without waiting; a worker whose
+    socket backs up past LINK_BUFFER_LIMIT is disconnected rather than stalling the probes,
+    and rebuilds its statistics from the database when it reconnects.
+    """
+
+    def __init__(self, monitor, extra_metrics=None):
+        self._monitor = monitor
+        self._extra_metrics = extra_metrics or dict
+        self._clients: set[asyncio.StreamWriter] = set()
+        self._samples: dict[int, list] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._path: str | None = None
+        self._stats = {"connections": 0, "slow_disconnects": 0, "messages_sent": 0}
+
+    async def start(self, path: str) -> None:
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by a previous run
+        self._server = await asyncio.start_unix_server(self._handle, path, limit=LINK_LINE_LIMIT)
+        self._path = path
+        live_feed.add_relay(self)
+        logger.info("Probe link listening on %s", path)
+
+    async def stop(self) -> None:
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._server:
+            self._server.close()
+            os.unlink(self._path)
+        for writer in self._clients:
+            writer.close()
+        self._clients.clear()
+
+    def stats(self) -> dict:
+        return {**self._stats, "clients": len(self._clients)}
+
+    def publish_samples(self, device_id: int, results: list[dict]) -> None:
+        if not self._clients or not results:
+            return
+        pending = self._samples.setdefault(device_id, [])
+        for result in results:
+            latency = None if result["packet_lost"] else result["latency_ms"]
+            pending.append((result["timestamp"], result["ping_type"], latency))
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(LINK_INTERVAL, self._flush_samples)
+
+    def publish_status(self, device_id: int, old_status: str, new_status: str) -> None:
+        self._send({"type": "status", "device_id": device_id, "old_status": old_status, "status": new_status})
+
+    def publish_notification(self, notification: dict) -> None:
+        self._send({"type": "notification", "notification": notification})
+
+    def _send(self, message: dict) -> None:
+        # Samples first, so a worker never applies a status before the samples that caused it
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_samples()
+        self._broadcast(_encode(message))
+
+    def _flush_samples(self) -> None:
+        self._flush_handle = None
+        samples, self._samples = self._samples, {}
+        if samples:
+            self._broadcast(_encode({"type": "samples", "devices": samples}))
+
+    def _broadcast(self, data: bytes) -> None:
+        for writer in list(self._clients):
+            if writer.transport.get_write_buffer_size() > LINK_BUFFER_LIMIT:
+                logger.warning("API worker is not reading the probe link, disconnecting it")
+                self._stats["slow_disconnects"] += 1
+                self._clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(data)
+        self._stats["messages_sent"] += len(self._clients)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        self._stats["connections"] += 1
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                try:
+                    reply = {"type": "reply", "id": request["id"], "result": await self._command(request)}
+                except Exception as e:
+                    logger.exception("Probe link command %r failed", request.get("op"))
+                    reply = {"type": "reply", "id": request["id"], "error": str(e)}
+                if writer in self._clients:
+                    writer.write(_encode(reply))
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Probe link client error: %s", e)
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _command(self, request: dict):
+        monitor = self._monitor
+        op = request["op"]
+        if op == "start":
+            config = device_registry.put(DeviceConfig(**request["device"]))
+            monitor.start_device(config.id)
+            return monitor.is_monitoring(config.id)
+        if op == "restart":
+            config = device_registry.put(DeviceConfig(**request["device"]))
+            await monitor.restart_device(config.id)
+            return monitor.is_monitoring(config.id)
+        if op == "stop":
+            await monitor.stop_device(request["device_id"])
+            if request["device"] is None:
+                device_registry.remove(request["device_id"])
+            else:
+                device_registry.put(DeviceConfig(**request["device"]))
+            return False
+        if op == "reset":
+            await monitor.reset_device(request["device_id"])
+            return None
+        if op == "reload":
+            # Commands sent while the worker wasn't connected never arrived
+            await device_registry.reload()
+            await monitor.check_schedule()
+            return [d.id for d in device_registry.monitored() if monitor.is_monitoring(d.id)]
+        if op == "metrics":
+            return {**await monitor.metrics(), **self._extra_metrics(), "probe_link": self.stats()}
+        raise ValueError(f"Unknown probe link command {op!r}")
+
+
+class ProbeClient:
+    """API-worker end of the probe link, standing in for the MonitorService.
+
+    Device commands are forwarded to the probe process, and its samples, status changes and
+    notifications feed this worker's stats engine and live feed. Samples sent while the
+    worker wasn't connected only reach the database, so every (re)connect rebuilds the
+    stats engine from there.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._writer: asyncio.StreamWriter | None = None
+        self._connected = asyncio.Event()
+        self._monitored: set[int] = set()
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._task: asyncio.Task | None = None
+        self._stats = {"connects": 0, "samples_received": 0}
+
+    async def start(self) -> None:
+        """Returns once connected: the probe process only listens after migrating the database."""
+        self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._writer:
+            self._writer.close()
+
+    def start_device(self, device_id: int) -> None:
+        config = device_registry.get(device_id)
+        if config is None:
+            return
+        self._monitored.add(device_id)
+        self._write({"id": next(self._ids), "op": "start", "device": asdict(config)})
+
+    async def stop_device(self, device_id: int) -> None:
+        self._monitored.discard(device_id)
+        config = device_registry.get(device_id)
+        await self._call("stop", device_id=device_id, device=asdict(config) if config else None)
+
+    async def restart_device(self, device_id: int) -> None:
+        config = device_registry.get(device_id)
+        if config is None:
+            return
+        self._monitored.add(device_id)
+        await self._call("restart", device=asdict(config))
+
+    async def reset_device(self, device_id: int) -> None:
+        device_registry.reset_status(device_id)
+        stats_engine.discard(device_id)
+        await self._call("reset", device_id=device_id)
+
+    def is_monitoring(self, device_id: int) -> bool:
+        return device_id in self._monitored
+
+    async def metrics(self) -> dict:
+        link = {**self._stats, "connected": self._writer is not None}
+        result = await self._call("metrics")
+        if result is None:
+            return {"probe_link": link}
+        return {**result, "probe_link": {**result["probe_link"], **link}}
+
+    def _write(self, message: dict) -> bool:
+        if self._writer is None:
+            logger.warning("Probe process not connected, %r not sent", message["op"])
+            return False
+        self._writer.write(_encode(message))
+        return True
+
+    async def _call(self, op: str, **args):
+        """Send a command and wait for its result; None if the probe process can't be reached."""
+        request_id = next(self._ids)
+        if not self._write({"id": request_id, "op": op, **args}):
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            return await asyncio.wait_for(future, COMMAND_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.warning("Probe link command %r failed: %r", op, e)
+            return None
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _run(self) -> None:
+        warned = False
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self._path, limit=LINK_LINE_LIMIT)
+            except OSError as e:
+                if not warned:
+                    logger.warning("Waiting for the probe process at %s: %s", self._path, e)
+                    warned = True
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            warned = False
+            self._writer = writer
+            self._stats["connects"] += 1
+            logger.info("Connected to the probe process at %s", self._path)
+            stats_engine.start_rebuild(settle=provisional_seconds())
+            resync = asyncio.create_task(self._resync())
+            self._connected.set()
+            try:
+                while line := await reader.readline():
+                    self._dispatch(json.loads(line))
+            except (ConnectionError, ValueError) as e:
+                logger.warning("Probe link error: %s", e)
+            finally:
+                resync.cancel()
+                self._writer = None
+                writer.close()
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("probe link closed"))
+            logger.warning("Lost the probe process, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _resync(self) -> None:
+        monitored = await self._call("reload")
+        if monitored is not None:
+            self._monitored = set(monitored)
+
+    def _dispatch(self, message: dict) -> None:
+        kind = message["type"]
+        if kind == "samples":
+            for device_id, samples in message["devices"].items():
+                device_id = int(device_id)
+                results = [
+                    {"timestamp": ts, "ping_type": ping_type, "latency_ms": latency, "packet_lost": latency is None}
+                    for ts, ping_type, latency in samples
+                ]
+                stats_engine.record(device_id, results)
+                live_feed.publish_samples(device_id, results)
+                self._stats["samples_received"] += len(results)
+        elif kind == "status":
+            config = device_registry.get(message["device_id"])
+            if config is not None:
+                config.status = message["status"]
+            live_feed.publish_status(message["device_id"], message["old_status"], message["status"])
+        elif kind == "notification":
+            live_feed.publish_notification(message["notification"])
+        elif kind == "reply":
+            future = self._pending.get(message["id"])
+            if future is not None and not future.done():
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["result"])
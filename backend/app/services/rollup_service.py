@@ -0,0 +1,106 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .sample_store import legacy_table_exists
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths in seconds, finest first
+ROLLUP_RESOLUTIONS = (1, 10, 60, 3600)
+
+UPSERT_ROLLUP_SQL = """
+INSERT INTO ping_rollups (
+    device_id, ping_type, resolution, bucket_ts,
+    count, lost, latency_sum, latency_min, latency_max, latency_sumsq
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (device_id, ping_type, resolution, bucket_ts) DO UPDATE SET
+    count = count + excluded.count,
+    lost = lost + excluded.lost,
+    latency_sum = latency_sum + excluded.latency_sum,
+    latency_min = min(coalesce(latency_min, excluded.latency_min), coalesce(excluded.latency_min, latency_min)),
+    latency_max = max(coalesce(latency_max, excluded.latency_max), coalesce(excluded.latency_max, latency_max)),
+    latency_sumsq = latency_sumsq + excluded.latency_sumsq
+"""
+
+BACKFILL_ROLLUP_SQL = """
+INSERT INTO ping_rollups (
+    device_id, ping_type, resolution, bucket_ts,
+    count, lost, latency_sum, latency_min, latency_max, latency_sumsq
+)
+SELECT device_id, ping_type, :resolution, CAST(timestamp / :resolution AS INTEGER) * :resolution,
+       COUNT(*), SUM(packet_lost), TOTAL(latency_ms), MIN(latency_ms), MAX(latency_ms),
+       TOTAL(latency_ms * latency_ms)
+FROM ping_results
+GROUP BY device_id, ping_type, CAST(timestamp / :resolution AS INTEGER)
+"""
+
+
+def aggregate(rows: list[tuple]) -> list[tuple]:
+    """Fold (device_id, timestamp, ping_type, latency_ms, packet_lost) samples into rollup
+    parameter rows for every resolution."""
+    # One pass at 1s, then coarser buckets are folded from the 1s aggregates
+    buckets: dict[tuple, list] = {}
+    for device_id, ts, ping_type, latency, lost in rows:
+        key = (device_id, ping_type, int(ts))
+        agg = buckets.get(key)
+        if agg is None:
+            agg = buckets[key] = [0, 0, 0.0, None, None, 0.0]
+        agg[0] += 1
+        if lost:
+            agg[1] += 1
+        else:
+            agg[2] += latency
+            agg[5] += latency * latency
+            if agg[3] is None or latency < agg[3]:
+                agg[3] = latency
+            if agg[4] is None or latency > agg[4]:
+                agg[4] = latency
+
+    params = [(d, t, 1, ts, *agg) for (d, t, ts), agg in buckets.items()]
+    for resolution in ROLLUP_RESOLUTIONS[1:]:
+        coarse: dict[tuple, list] = {}
+        for (device_id, ping_type, ts), agg in buckets.items():
+            key = (device_id, ping_type, ts // resolution * resolution)
+            c = coarse.get(key)
+            if c is None:
+                coarse[key] = list(agg)
+                continue
+            c[0] += agg[0]
+            c[1] += agg[1]
+            c[2] += agg[2]
+            c[5] += agg[5]
+            if agg[3] is not None and (c[3] is None or agg[3] < c[3]):
+                c[3] = agg[3]
+            if agg[4] is not None and (c[4] is None or agg[4] > c[4]):
+                c[4] = agg[4]
+        params.extend((d, t, resolution, ts, *agg) for (d, t, ts), agg in coarse.items())
+    return params
+
+
+async def apply_rollups(conn: AsyncConnection, rows: list[tuple]) -> None:
+    """Incrementally merge a flushed batch of samples into the rollup tables."""
+    if rows:
+        await conn.exec_driver_sql(UPSERT_ROLLUP_SQL, aggregate(rows))
+
+
+async def backfill_rollups(conn: AsyncConnection) -> None:
+    """Build rollups from the legacy samples table for databases created before rollups existed."""
+    if not await legacy_table_exists(conn):
+        return
+    has_rollups = (await conn.execute(text("SELECT 1 FROM ping_rollups LIMIT 1"))).first()
+    has_samples = (await conn.execute(text("SELECT 1 FROM ping_results LIMIT 1"))).first()
+    if has_rollups or not has_samples:
+        return
+    logger.info("Building ping rollups from existing samples, this may take a while")
+    for resolution in ROLLUP_RESOLUTIONS:
+        await conn.execute(text(BACKFILL_ROLLUP_SQL), {"resolution": resolution})
+    logger.info("Ping rollups built")
+
+
+def bucket_avg(latency_sum: float | None, total: int | None, lost: int | None) -> float | None:
+    ok = (total or 0) - (lost or 0)
+    if ok <= 0 or latency_sum is None:
+        return None
+    return latency_sum / ok
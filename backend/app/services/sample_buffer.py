@@ -0,0 +1,158 @@
+import logging
+import time
+from array import array
+
+from ..models import PING_TYPES
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_oldest", "downsample", "block")
+
+
+class SampleBuffer:
+    """Fixed-capacity columnar ring buffer for ping samples awaiting a database flush.
+
+    Samples are stored in parallel typed columns instead of one dict per sample. When
+    the buffer is full the overflow policy decides what gives:
+
+    - ``drop_oldest``: overwrite the oldest buffered sample.
+    - ``downsample``: discard every other successful sample (losses are always kept).
+    - ``block``: hold the sample back until a flush frees space; the monitor stops launching
+      probes meanwhile, so only the ones already in flight are held.
+    """
+
+    def __init__(self, capacity: int, policy: str = "drop_oldest"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow policy must be one of {OVERFLOW_POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self._timestamp = array("d", bytes(8 * capacity))
+        self._device_id = array("I", bytes(4 * capacity))
+        self._latency = array("d", bytes(8 * capacity))
+        self._lost = bytearray(capacity)
+        self._ping_type = bytearray(capacity)
+        self._start = 0
+        self._size = 0
+        # Samples refused under the block policy, moved in by the next drain
+        self._held: list[dict] = []
+        self._blocked_since: float | None = None
+
+        self.appended = 0
+        self.dropped = 0
+        self.downsampled = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.high_watermark = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def full(self) -> bool:
+        return self._size >= self.capacity
+
+    def append(self, result: dict) -> bool:
+        """Buffer one ping result dict. Returns False if it was refused (block policy, full)."""
+        if self._size >= self.capacity:
+            if self.policy == "block":
+                return False
+            if self.policy == "downsample":
+                self._downsample()
+            if self._size >= self.capacity:
+                self._start = (self._start + 1) % self.capacity
+                self._size -= 1
+                self.dropped += 1
+
+        i = (self._start + self._size) % self.capacity
+        lost = result["packet_lost"]
+        self._timestamp[i] = result["timestamp"]
+        self._device_id[i] = result["device_id"]
+        self._latency[i] = 0.0 if lost else result["latency_ms"]
+        self._lost[i] = lost
+        self._ping_type[i] = PING_TYPES.index(result["ping_type"])
+        self._size += 1
+        self.appended += 1
+        if self._size > self.high_watermark:
+            self.high_watermark = self._size
+        return True
+
+    def put(self, result: dict) -> None:
+        """Buffer a result; under the block policy one refused while full is held for the next drain."""
+        if not self._held and self.append(result):
+            return
+        if self._blocked_since is None:
+            self._blocked_since = time.monotonic()
+        self.blocked += 1
+        self._held.append(result)
+
+    def _indices(self) -> list[range]:
+        end = self._start + self._size
+        if end <= self.capacity:
+            return [range(self._start, end)]
+        return [range(self._start, self.capacity), range(0, end - self.capacity)]
+
+    def _downsample(self) -> None:
+        keep = []
+        toggle = False
+        for part in self._indices():
+            for i in part:
+                if self._lost[i]:
+                    keep.append(i)
+                else:
+                    toggle = not toggle
+                    if toggle:
+                        keep.append(i)
+        if len(keep) == self._size:
+            return
+        rows = [
+            (self._timestamp[i], self._device_id[i], self._latency[i], self._lost[i], self._ping_type[i])
+            for i in keep
+        ]
+        for j, (ts, device_id, latency, lost, ping_type) in enumerate(rows):
+            self._timestamp[j] = ts
+            self._device_id[j] = device_id
+            self._latency[j] = latency
+            self._lost[j] = lost
+            self._ping_type[j] = ping_type
+        self.downsampled += self._size - len(rows)
+        self._start = 0
+        self._size = len(rows)
+
+    def drain(self) -> list[tuple]:
+        """Remove and return all buffered samples, oldest first, as
+        (device_id, timestamp, ping_type, latency_ms, packet_lost) rows."""
+        rows = []
+        for part in self._indices():
+            s = slice(part.start, part.stop)
+            rows.extend(zip(
+                self._device_id[s],
+                self._timestamp[s],
+                (PING_TYPES[code] for code in self._ping_type[s]),
+                (None if lost else latency for latency, lost in zip(self._latency[s], self._lost[s])),
+                (bool(lost) for lost in self._lost[s]),
+            ))
+        self._start = 0
+        self._size = 0
+        if self._held:
+            held, self._held = self._held, []
+            for i, result in enumerate(held):
+                if not self.append(result):
+                    self._held = held[i:]
+                    break
+            if not self._held:
+                self.blocked_seconds += time.monotonic() - self._blocked_since
+                self._blocked_since = None
+        return rows
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "capacity": self.capacity,
+            "policy": self.policy,
+            "high_watermark": self.high_watermark,
+            "appended": self.appended,
+            "dropped": self.dropped,
+            "downsampled": self.downsampled,
+            "blocked": self.blocked,
+            "blocked_seconds": round(self.blocked_seconds, 3),
+        }
@@ -0,0 +1,460 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import repeat
+from operator import itemgetter
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    LargeBinary,
+    MetaData,
+    Table,
+    case,
+    delete,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from ..models import PING_TYPES
+from .block_codec import BLOCK_SECONDS, decode_block, encode_block
+
+logger = logging.getLogger(__name__)
+
+# Raw samples live in one table per UTC day, created on demand outside the ORM models, so
+# readers only touch the days they need and retention can drop whole days at once
+PARTITION_SECONDS = 86400
+PARTITION_PREFIX = "samples_"
+BLOCK_PREFIX = "blocks_"
+LEGACY_TABLE = "ping_results"
+
+# Each partition is a WITHOUT ROWID table clustered on (device_id, ts_us, ping_type): timestamps
+# are integer microseconds, ping_type is its PING_TYPES code and latency is integer microseconds
+# with LOST_LATENCY marking a lost probe, so a sample is four small integers and needs no index
+SAMPLE_COLUMNS = ("device_id", "ts_us", "ping_type", "latency_us")
+LOST_LATENCY = -1
+
+# SQL converting a legacy (timestamp, ping_type, latency_ms, packet_lost) row to the compact columns
+_ENCODE_SQL = (
+    "device_id, CAST(round(timestamp * 1000000) AS INTEGER), "
+    "CASE ping_type " + " ".join(f"WHEN '{name}' THEN {code}" for code, name in enumerate(PING_TYPES)) + " END, "
+    f"CASE WHEN packet_lost OR latency_ms IS NULL THEN {LOST_LATENCY} "
+    "ELSE CAST(round(latency_ms * 1000) AS INTEGER) END"
+)
+
+# With the "blocks" storage engine, closed minutes of samples are moved out of the day's
+# samples_ table into its blocks_ table, one compressed BLOB per device, ping type and minute
+_metadata = MetaData()
+_tables: dict[int, Table] = {}
+_block_tables: dict[int, Table] = {}
+# Days that have a partition table in the database
+_existing: set[int] = set()
+_block_days: set[int] = set()
+# Set in an API worker whose probe process creates and drops the partitions
+_follow = False
+
+
+def partition_day(ts: float) -> int:
+    return int(ts // PARTITION_SECONDS)
+
+
+def partition_name(day: int, prefix: str = PARTITION_PREFIX) -> str:
+    date = datetime.fromtimestamp(day * PARTITION_SECONDS, timezone.utc)
+    return prefix + date.strftime("%Y%m%d")
+
+
+def _parse_name(name: str, prefix: str) -> int | None:
+    try:
+        date = datetime.strptime(name[len(prefix):], "%Y%m%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return partition_day(date.timestamp())
+
+
+def partition_table(day: int) -> Table:
+    table = _tables.get(day)
+    if table is None:
+        name = partition_name(day)
+        table = _tables[day] = Table(
+            name,
+            _metadata,
+            Column("device_id", Integer, primary_key=True, autoincrement=False),
+            Column("ts_us", Integer, primary_key=True, autoincrement=False),
+            Column("ping_type", Integer, primary_key=True, autoincrement=False),
+            Column("latency_us", Integer, nullable=False),
+            sqlite_with_rowid=False,
+        )
+    return table
+
+
+def block_table(day: int) -> Table:
+    table = _block_tables.get(day)
+    if table is None:
+        table = _block_tables[day] = Table(
+            partition_name(day, BLOCK_PREFIX),
+            _metadata,
+            Column("device_id", Integer, primary_key=True, autoincrement=False),
+            Column("ping_type", Integer, primary_key=True, autoincrement=False),
+            Column("block_ts", Integer, primary_key=True, autoincrement=False),
+            Column("count", Integer, nullable=False),
+            Column("data", LargeBinary, nullable=False),
+            sqlite_with_rowid=False,
+        )
+    return table
+
+
+def encode_sample(device_id: int, ts: float, ping_type: str, latency_ms: float | None, lost: bool) -> tuple:
+    latency = LOST_LATENCY if lost or latency_ms is None else round(latency_ms * 1000)
+    return (device_id, round(ts * 1_000_000), PING_TYPES.index(ping_type), latency)
+
+
+def decode_sample(ts_us: int, ping_type: int, latency_us: int) -> tuple:
+    """(timestamp, ping_type, latency_ms, packet_lost) from the stored columns."""
+    lost = latency_us < 0
+    return (ts_us / 1_000_000, PING_TYPES[ping_type], None if lost else latency_us / 1000, lost)
+
+
+def days_between(start: float, end: float) -> list[int]:
+    """Days with a partition overlapping [start, end], oldest first."""
+    first, last = partition_day(start), partition_day(end)
+    return [day for day in sorted(_existing) if first <= day <= last]
+
+
+def partitions_between(start: float, end: float) -> list[Table]:
+    return [partition_table(day) for day in days_between(start, end)]
+
+
+def partition_count() -> int:
+    return len(_existing)
+
+
+def has_blocks(day: int) -> bool:
+    return day in _block_days
+
+
+async def load_partitions(conn: AsyncSession | AsyncConnection) -> None:
+    result = await conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND (name LIKE :samples OR name LIKE :blocks)"
+    ), {"samples": PARTITION_PREFIX + "%", "blocks": BLOCK_PREFIX + "%"})
+    samples, blocks = set(), set()
+    for (name,) in result:
+        prefix, days = (BLOCK_PREFIX, blocks) if name.startswith(BLOCK_PREFIX) else (PARTITION_PREFIX, samples)
+        day = _parse_name(name, prefix)
+        if day is not None:
+            days.add(day)
+    # Swapped without awaiting, so concurrent readers never see a half-loaded set
+    _existing.clear()
+    _existing.update(samples)
+    _block_days.clear()
+    _block_days.update(blocks)
+
+
+def follow_partitions() -> None:
+    """Partitions are created and dropped by another process: re-read them before every read."""
+    global _follow
+    _follow = True
+
+
+async def refresh_partitions(session: AsyncSession | AsyncConnection) -> None:
+    """Bring the partition set up to date with the database if another process owns it."""
+    if _follow:
+        await load_partitions(session)
+
+
+async def ensure_partition(conn: AsyncConnection, day: int) -> Table:
+    table = partition_table(day)
+    if day not in _existing:
+        await conn.run_sync(table.create, checkfirst=True)
+        _existing.add(day)
+    return table
+
+
+async def ensure_block_partition(conn: AsyncConnection, day: int) -> Table:
+    table = block_table(day)
+    if day not in _block_days:
+        await conn.run_sync(table.create, checkfirst=True)
+        _block_days.add(day)
+    return table
+
+
+async def insert_samples(conn: AsyncConnection, rows: list[tuple]) -> None:
+    """Append (device_id, timestamp, ping_type, latency_ms, packet_lost) rows to their partitions."""
+    by_day: dict[int, list[tuple]] = defaultdict(list)
+    for row in rows:
+        by_day[partition_day(row[1])].append(encode_sample(*row))
+    for day, day_rows in by_day.items():
+        table = await ensure_partition(conn, day)
+        # Two samples of one device and type in the same microsecond can only be a duplicate
+        await conn.exec_driver_sql(
+            f"INSERT OR IGNORE INTO {table.name} ({', '.join(SAMPLE_COLUMNS)}) VALUES (?, ?, ?, ?)",
+            day_rows,
+        )
+
+
+async def fetch_day(
+    session: AsyncSession | AsyncConnection, device_id: int, day: int, start_us: int, end_us: int,
+    limit: int | None = None,
+) -> list[tuple]:
+    """Stored (ts_us, ping_type, latency_us) samples of a device in one day partition within
+    [start_us, end_us], from plain rows and compressed blocks alike, in time order."""
+    table = partition_table(day)
+    query = (
+        select(table.c.ts_us, table.c.ping_type, table.c.latency_us)
+        .where(table.c.device_id == device_id, table.c.ts_us >= start_us, table.c.ts_us <= end_us)
+        .order_by(table.c.ts_us, table.c.ping_type)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    rows = [tuple(row) for row in (await session.execute(query)).all()]
+    if day not in _block_days:
+        return rows
+
+    blocks = block_table(day)
+    result = await session.execute(
+        select(blocks.c.ping_type, blocks.c.block_ts, blocks.c.data)
+        .where(
+            blocks.c.device_id == device_id,
+            blocks.c.block_ts >= start_us // 1_000_000 // BLOCK_SECONDS * BLOCK_SECONDS,
+            blocks.c.block_ts <= end_us // 1_000_000,
+        )
+        .order_by(blocks.c.ping_type, blocks.c.block_ts)
+    )
+    decoded: list[tuple] = []
+    types = set()
+    for ping_type, block_ts, data in result:
+        samples = decode_block(block_ts, data)
+        if samples and (samples[0][0] < start_us or samples[-1][0] > end_us):
+            samples = [sample for sample in samples if start_us <= sample[0] <= end_us]
+        decoded.extend(zip(map(itemgetter(0), samples), repeat(ping_type), map(itemgetter(1), samples)))
+        types.add(ping_type)
+    if not rows and len(types) <= 1:
+        # Blocks of a single ping type come out of the primary key in time order
+        return decoded
+    rows += decoded
+    rows.sort()
+    return rows
+
+
+async def fetch_samples(
+    session: AsyncSession, device_id: int, start: float, end: float, limit: int | None = None
+) -> list[tuple]:
+    """(timestamp, ping_type, latency_ms, packet_lost) rows of a device in [start, end], in time order."""
+    start_us, end_us = round(start * 1_000_000), round(end * 1_000_000)
+    await refresh_partitions(session)
+    rows: list[tuple] = []
+    for day in days_between(start, end):
+        rows += await fetch_day(session, device_id, day, start_us, end_us, limit)
+        if limit is not None and len(rows) >= limit:
+            break
+    return [decode_sample(*row) for row in rows[:limit]]
+
+
+def _fold(aggs: dict, key: tuple, count: int, lost: int, total: int, low: int | None, high: int | None) -> None:
+    agg = aggs.get(key)
+    if agg is None:
+        aggs[key] = [count, lost, total, low, high]
+        return
+    agg[0] += count
+    agg[1] += lost
+    agg[2] += total
+    if low is not None and (agg[3] is None or low < agg[3]):
+        agg[3] = low
+    if high is not None and (agg[4] is None or high > agg[4]):
+        agg[4] = high
+
+
+async def fetch_envelopes(
+    session: AsyncSession, device_id: int, start: float, end: float, width_us: int
+) -> list[tuple]:
+    """Per-bucket (ping_type, bucket_ts, count, lost, latency_sum, latency_min, latency_max) of a
+    device's samples in [start, end], for buckets of width_us aligned to the epoch. Latencies
+    are in ms. Plain rows are aggregated by SQLite, compressed blocks while decoding them."""
+    start_us, end_us = round(start * 1_000_000), round(end * 1_000_000)
+    aggs: dict[tuple[int, int], list] = {}
+    await refresh_partitions(session)
+    for day in days_between(start, end):
+        table = partition_table(day)
+        bucket = (table.c.ts_us // width_us) * width_us
+        lost = table.c.latency_us < 0
+        result = await session.execute(
+            select(
+                table.c.ping_type,
+                bucket,
+                func.count(),
+                func.sum(case((lost, 1), else_=0)),
+                func.sum(case((lost, 0), else_=table.c.latency_us)),
+                func.min(case((lost, None), else_=table.c.latency_us)),
+                func.max(case((lost, None), else_=table.c.latency_us)),
+            )
+            .where(table.c.device_id == device_id, table.c.ts_us >= start_us, table.c.ts_us <= end_us)
+            .group_by(table.c.ping_type, bucket)
+        )
+        for ping_type, bucket_us, *agg in result:
+            _fold(aggs, (ping_type, bucket_us), *agg)
+
+        if day in _block_days:
+            blocks = block_table(day)
+            result = await session.execute(
+                select(blocks.c.ping_type, blocks.c.block_ts, blocks.c.data).where(
+                    blocks.c.device_id == device_id,
+                    blocks.c.block_ts >= start_us // 1_000_000 // BLOCK_SECONDS * BLOCK_SECONDS,
+                    blocks.c.block_ts <= end_us // 1_000_000,
+                )
+            )
+            for ping_type, block_ts, data in result:
+                for ts, latency in decode_block(block_ts, data):
+                    if start_us <= ts <= end_us:
+                        key = (ping_type, ts // width_us * width_us)
+                        if latency < 0:
+                            _fold(aggs, key, 1, 1, 0, None, None)
+                        else:
+                            _fold(aggs, key, 1, 0, latency, latency, latency)
+
+    envelopes = [
+        (
+            PING_TYPES[ping_type],
+            bucket_us / 1_000_000,
+            count,
+            lost,
+            total / 1000,
+            low / 1000 if low is not None else None,
+            high / 1000 if high is not None else None,
+        )
+        for (ping_type, bucket_us), (count, lost, total, low, high) in aggs.items()
+    ]
+    envelopes.sort(key=lambda row: (row[1], row[0]))
+    return envelopes
+
+
+async def store_blocks(conn: AsyncConnection, day: int, device_id: int, rows: list[tuple]) -> int:
+    """Pack (ping_type, ts_us, latency_us) samples of one device and day into blocks. Late
+    samples for a minute that already has a block are merged into it. Returns blocks written."""
+    groups: dict[tuple[int, int], list[tuple[int, int]]] = defaultdict(list)
+    for ping_type, ts, latency in rows:
+        groups[(ping_type, ts // 1_000_000 // BLOCK_SECONDS * BLOCK_SECONDS)].append((ts, latency))
+
+    table = await ensure_block_partition(conn, day)
+    starts = [block_ts for _, block_ts in groups]
+    existing = await conn.execute(
+        select(table.c.ping_type, table.c.block_ts, table.c.data).where(
+            table.c.device_id == device_id,
+            table.c.block_ts >= min(starts),
+            table.c.block_ts <= max(starts),
+        )
+    )
+    for ping_type, block_ts, data in existing:
+        samples = groups.get((ping_type, block_ts))
+        if samples is not None:
+            samples.extend(decode_block(block_ts, data))
+
+    params = []
+    for (ping_type, block_ts), samples in groups.items():
+        samples.sort()
+        params.append((device_id, ping_type, block_ts, len(samples), encode_block(block_ts, samples)))
+    await conn.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {table.name} (device_id, ping_type, block_ts, count, data) VALUES (?, ?, ?, ?, ?)",
+        params,
+    )
+    return len(params)
+
+
+def expired_blocks_delete(day: int, device_id: int, cutoff: float):
+    """DELETE for a device's blocks in one day that end at or before cutoff."""
+    table = block_table(day)
+    return delete(table).where(
+        table.c.device_id == device_id,
+        table.c.block_ts <= int(cutoff) - BLOCK_SECONDS,
+    )
+
+
+def expired_chunk_delete(table: Table, device_id: int, cutoff: float, limit: int):
+    """DELETE for at most `limit` samples of a device older than cutoff in one partition."""
+    cutoff_us = round(cutoff * 1_000_000)
+    # Timestamp of the first sample past the chunk, a range bound on the primary key
+    boundary = (
+        select(table.c.ts_us)
+        .where(table.c.device_id == device_id, table.c.ts_us < cutoff_us)
+        .order_by(table.c.ts_us)
+        .offset(limit)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return delete(table).where(
+        table.c.device_id == device_id,
+        table.c.ts_us < func.coalesce(boundary, cutoff_us),
+    )
+
+
+async def delete_device_samples(conn: AsyncConnection, device_id: int) -> int:
+    await refresh_partitions(conn)
+    deleted = 0
+    for day in sorted(_existing):
+        table = partition_table(day)
+        result = await conn.execute(delete(table).where(table.c.device_id == device_id))
+        deleted += result.rowcount
+    for day in sorted(_block_days):
+        table = block_table(day)
+        await conn.execute(delete(table).where(table.c.device_id == device_id))
+    return deleted
+
+
+async def drop_partitions_before(conn: AsyncConnection, cutoff: float) -> int:
+    """Drop every partition that ends at or before cutoff. Returns the number dropped."""
+    expired = [day for day in _existing | _block_days if (day + 1) * PARTITION_SECONDS <= cutoff]
+    for day in sorted(expired):
+        await conn.run_sync(partition_table(day).drop, checkfirst=True)
+        await conn.run_sync(block_table(day).drop, checkfirst=True)
+        _existing.discard(day)
+        _block_days.discard(day)
+        logger.info("Dropped sample partition %s", partition_name(day))
+    return len(expired)
+
+
+async def legacy_table_exists(conn: AsyncConnection) -> bool:
+    result = await conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {"name": LEGACY_TABLE})
+    return result.first() is not None
+
+
+async def migrate_legacy_samples(conn: AsyncConnection) -> bool:
+    """Move samples from the old single ping_results table into day partitions."""
+    if not await legacy_table_exists(conn):
+        return False
+    logger.info("Moving samples from %s into day partitions, this may take a while", LEGACY_TABLE)
+    days = (await conn.execute(text(
+        f"SELECT DISTINCT CAST(timestamp / {PARTITION_SECONDS} AS INTEGER) FROM {LEGACY_TABLE}"
+    ))).scalars().all()
+    for day in sorted(days):
+        table = await ensure_partition(conn, day)
+        await conn.execute(text(
+            f"INSERT OR IGNORE INTO {table.name} ({', '.join(SAMPLE_COLUMNS)}) "
+            f"SELECT {_ENCODE_SQL} FROM {LEGACY_TABLE} "
+            "WHERE timestamp >= :start AND timestamp < :end"
+        ), {"start": day * PARTITION_SECONDS, "end": (day + 1) * PARTITION_SECONDS})
+    await conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+    logger.info("Moved samples into %d day partitions", len(days))
+    return True
+
+
+async def compact_partitions(conn: AsyncConnection) -> bool:
+    """Rewrite day partitions still in the float/text row layout into the compact one."""
+    compacted = 0
+    for day in sorted(_existing):
+        name = partition_name(day)
+        columns = {row[1] for row in (await conn.execute(text(f"PRAGMA table_info({name})"))).all()}
+        if "timestamp" not in columns:
+            continue
+        await conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_old"))
+        await conn.execute(text(f"DROP INDEX IF EXISTS idx_{name}_device_time"))
+        await conn.run_sync(partition_table(day).create)
+        await conn.execute(text(
+            f"INSERT OR IGNORE INTO {name} ({', '.join(SAMPLE_COLUMNS)}) SELECT {_ENCODE_SQL} FROM {name}_old"
+        ))
+        await conn.execute(text(f"DROP TABLE {name}_old"))
+        compacted += 1
+    if compacted:
+        logger.info("Converted %d day partitions to the compact sample layout", compacted)
+    return compacted > 0
@@ -0,0 +1,197 @@
+import asyncio
+import heapq
+import logging
+from collections import defaultdict
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Golden-ratio stepping spreads any number of devices evenly across one interval
+_PHASE_STEP = 0.6180339887498949
+_LAG_EWMA_ALPHA = 0.05
+
+
+class _Entry:
+    __slots__ = (
+        "interval", "slot", "deadline", "generation",
+        "fired", "missed", "lag_last", "lag_avg", "lag_max",
+    )
+
+    def __init__(self, interval: float, slot: int, deadline: float, generation: int):
+        self.interval = interval
+        self.slot = slot
+        self.deadline = deadline
+        self.generation = generation
+        self.fired = 0
+        self.missed = 0
+        self.lag_last = 0.0
+        self.lag_avg = 0.0
+        self.lag_max = 0.0
+
+
+class ProbeScheduler:
+    """Fires a callback for every device at drift-free absolute deadlines from one timer heap.
+
+    Each device's next deadline is its previous deadline plus its interval, so time spent
+    probing never accumulates into the schedule. Only one loop timer is armed at a time,
+    no matter how many devices are scheduled.
+    """
+
+    def __init__(self, on_due: Callable[[int], None]):
+        self._on_due = on_due
+        self._heap: list[tuple[float, int, int]] = []
+        self._entries: dict[int, _Entry] = {}
+        self._generation = 0
+        # Per interval: the next unused phase slot and the slots freed by removed keys
+        self._next_slot: dict[float, int] = defaultdict(int)
+        self._free_slots: dict[float, list[int]] = defaultdict(list)
+        self._timer: asyncio.TimerHandle | None = None
+        self._timer_when: float | None = None
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self) -> list[int]:
+        return list(self._entries)
+
+    def add(self, key: int, interval: float) -> None:
+        """Schedule a key, phase-shifted against other keys sharing the same interval."""
+        if key in self._entries:
+            self.set_interval(key, interval)
+            return
+        slot = self._take_slot(interval)
+        self._generation += 1
+        entry = _Entry(interval, slot, self._phase_deadline(interval, slot), self._generation)
+        self._entries[key] = entry
+        self._push(entry, key)
+
+    def remove(self, key: int) -> None:
+        # Heap entries are dropped lazily when they come due
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            heapq.heappush(self._free_slots[entry.interval], entry.slot)
+        if not self._entries:
+            self._heap.clear()
+            self._cancel_timer()
+
+    def set_interval(self, key: int, interval: float) -> None:
+        """Change a key's interval, moving it to a phase slot among the keys with the new one."""
+        entry = self._entries.get(key)
+        if entry is None or entry.interval == interval:
+            return
+        heapq.heappush(self._free_slots[entry.interval], entry.slot)
+        entry.interval = interval
+        entry.slot = self._take_slot(interval)
+        self._generation += 1
+        entry.generation = self._generation
+        entry.deadline = self._phase_deadline(interval, entry.slot)
+        self._push(entry, key)
+
+    def postpone(self, key: int, seconds: float) -> None:
+        """Move a key's next deadline to `seconds` from now (e.g. error backoff)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        self._generation += 1
+        entry.generation = self._generation
+        entry.deadline = asyncio.get_running_loop().time() + seconds
+        self._push(entry, key)
+
+    def close(self) -> None:
+        self._cancel_timer()
+        self._entries.clear()
+        self._heap.clear()
+        self._next_slot.clear()
+        self._free_slots.clear()
+
+    def _take_slot(self, interval: float) -> int:
+        """Lowest phase slot of the interval not in use, so removed keys leave no gaps behind."""
+        free = self._free_slots[interval]
+        if free:
+            return heapq.heappop(free)
+        slot = self._next_slot[interval]
+        self._next_slot[interval] += 1
+        return slot
+
+    def _phase_deadline(self, interval: float, slot: int) -> float:
+        """Next loop time at the slot's phase: slot * golden ratio of the interval past a multiple of it."""
+        offset = (slot * _PHASE_STEP) % 1.0 * interval
+        now = asyncio.get_running_loop().time()
+        return now + (offset - now) % interval
+
+    def _push(self, entry: _Entry, key: int) -> None:
+        heapq.heappush(self._heap, (entry.deadline, entry.generation, key))
+        if self._timer_when is None or entry.deadline < self._timer_when:
+            self._arm()
+
+    def _cancel_timer(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+        self._timer = None
+        self._timer_when = None
+
+    def _arm(self) -> None:
+        self._cancel_timer()
+        if self._heap:
+            self._timer_when = self._heap[0][0]
+            self._timer = asyncio.get_running_loop().call_at(self._timer_when, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._timer_when = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        due: list[int] = []
+
+        while self._heap and self._heap[0][0] <= now:
+            deadline, generation, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != generation:
+                continue
+
+            lag = now - deadline
+            entry.fired += 1
+            entry.lag_last = lag
+            entry.lag_avg += (lag - entry.lag_avg) * _LAG_EWMA_ALPHA
+            entry.lag_max = max(entry.lag_max, lag)
+
+            next_deadline = deadline + entry.interval
+            if next_deadline <= now:
+                # Fell more than a whole interval behind: skip the missed ticks, keep the phase
+                skipped = int((now - deadline) // entry.interval)
+                entry.missed += skipped
+                next_deadline = deadline + (skipped + 1) * entry.interval
+            entry.deadline = next_deadline
+            heapq.heappush(self._heap, (next_deadline, generation, key))
+            due.append(key)
+
+        self._arm()
+
+        for key in due:
+            try:
+                self._on_due(key)
+            except Exception:
+                logger.exception("Scheduler callback failed for %s", key)
+
+    def stats(self) -> dict:
+        per_key = {
+            key: {
+                "interval_seconds": entry.interval,
+                "fired": entry.fired,
+                "missed": entry.missed,
+                "lag_last_ms": round(entry.lag_last * 1000, 3),
+                "lag_avg_ms": round(entry.lag_avg * 1000, 3),
+                "lag_max_ms": round(entry.lag_max * 1000, 3),
+            }
+            for key, entry in self._entries.items()
+        }
+        return {
+            "scheduled": len(self._entries),
+            "heap_size": len(self._heap),
+            "lag_max_ms": max((v["lag_max_ms"] for v in per_key.values()), default=0.0),
+            "missed": sum(v["missed"] for v in per_key.values()),
+            "devices": per_key,
+        }
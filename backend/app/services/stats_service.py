@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import math
+import time
+from array import array
+from typing import NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import async_session
+from ..models import LatencyHistogram, PingRollup
+from .histogram_service import bucket_key, decode_histogram, percentiles
+
+logger = logging.getLogger(__name__)
+
+# Loss windows shown on the dashboard and the device page, in seconds
+LOSS_WINDOWS = {"6h": 21600, "12h": 43200, "24h": 86400, "48h": 172800}
+# Slot width of the loss window rings; also the rollup resolution they are rebuilt from
+WINDOW_SLOT_SECONDS = 60
+# Latency percentiles cover the last PERCENTILE_SLOTS * PERCENTILE_SLOT_SECONDS (24h)
+PERCENTILE_SLOT_SECONDS = 1800
+PERCENTILE_SLOTS = 48
+# Rows fetched per round trip while rebuilding; one at a time crosses the aiosqlite thread per row
+REBUILD_CHUNK = 10000
+
+
+class WindowTotals(NamedTuple):
+    total: int
+    lost: int
+    latency_sum: float
+    min: float | None
+    max: float | None
+
+    def loss_pct(self) -> float | None:
+        if self.total == 0:
+            return None
+        return round(self.lost / self.total * 100, 2)
+
+    def avg(self) -> float | None:
+        ok = self.total - self.lost
+        return self.latency_sum / ok if ok > 0 else None
+
+
+EMPTY_TOTALS = WindowTotals(0, 0, 0.0, None, None)
+
+
+class SlidingWindows:
+    """Sample counters over several trailing windows at once.
+
+    One ring of fixed-width time slots covers the longest window; each window keeps running
+    totals that slots are added to when they fill and subtracted from when they fall off its
+    edge, so recording a sample and reading loss or average is O(1). Min and max can't be
+    subtracted and are scanned from the slots on read.
+    """
+
+    def __init__(self, slot_seconds: int, windows: dict[str, int]):
+        self.slot_seconds = slot_seconds
+        self._spans = {name: max(1, seconds // slot_seconds) for name, seconds in windows.items()}
+        self._size = max(self._spans.values())
+        self._count = array("L", bytes(array("L").itemsize * self._size))
+        self._lost = array("L", bytes(array("L").itemsize * self._size))
+        self._sum = array("d", bytes(8 * self._size))
+        self._min = array("d", [math.inf]) * self._size
+        self._max = array("d", [-math.inf]) * self._size
+        self._totals = {name: [0, 0, 0.0] for name in self._spans}
+        self._head: int | None = None
+
+    def add(self, ts: float, latency_ms: float | None) -> None:
+        """Record one sample; None latency means it was lost."""
+        if latency_ms is None:
+            self.add_bucket(ts, 1, 1, 0.0, None, None)
+        else:
+            self.add_bucket(ts, 1, 0, latency_ms, latency_ms, latency_ms)
+
+    def add_bucket(self, ts: float, count: int, lost: int, latency_sum: float,
+                   latency_min: float | None, latency_max: float | None) -> None:
+        """Record an aggregate of samples that all fall into the slot of `ts`."""
+        slot = int(ts // self.slot_seconds)
+        if self._head is None or slot > self._head:
+            self._advance(slot)
+        age = self._head - slot
+        if age >= self._size:
+            return
+        i = slot % self._size
+        self._count[i] += count
+        self._lost[i] += lost
+        self._sum[i] += latency_sum
+        if latency_min is not None and latency_min < self._min[i]:
+            self._min[i] = latency_min
+        if latency_max is not None and latency_max > self._max[i]:
+            self._max[i] = latency_max
+        for name, span in self._spans.items():
+            if age < span:
+                totals = self._totals[name]
+                totals[0] += count
+                totals[1] += lost
+                totals[2] += latency_sum
+
+    def _advance(self, slot: int) -> None:
+        head = self._head
+        self._head = slot
+        if head is None or slot - head >= self._size:
+            for totals in self._totals.values():
+                totals[:] = [0, 0, 0.0]
+            self._clear(range(self._size))
+            return
+        # Slots (head - span, slot - span] leave each window
+        for name, span in self._spans.items():
+            totals = self._totals[name]
+            for old in range(head - span + 1, slot - span + 1):
+                i = old % self._size
+                totals[0] -= self._count[i]
+                totals[1] -= self._lost[i]
+                totals[2] -= self._sum[i]
+            if totals[0] <= 0:
+                totals[:] = [0, 0, 0.0]
+        self._clear(new % self._size for new in range(head + 1, slot + 1))
+
+    def _clear(self, positions) -> None:
+        for i in positions:
+            self._count[i] = 0
+            self._lost[i] = 0
+            self._sum[i] = 0.0
+            self._min[i] = math.inf
+            self._max[i] = -math.inf
+
+    def totals(self, name: str, now: float) -> WindowTotals:
+        slot = int(now // self.slot_seconds)
+        if self._head is None:
+            return EMPTY_TOTALS
+        if slot > self._head:
+            self._advance(slot)
+        total, lost, latency_sum = self._totals[name]
+        if total == 0:
+            return EMPTY_TOTALS
+        # The window's slots are one or two contiguous runs of the ring
+        end = self._head % self._size + 1
+        start = end - self._spans[name]
+        runs = [(start, end)] if start >= 0 else [(0, end), (self._size + start, self._size)]
+        low = min(min(self._min[a:b]) for a, b in runs)
+        high = max(max(self._max[a:b]) for a, b in runs)
+        return WindowTotals(
+            total,
+            lost,
+            latency_sum,
+            low if low != math.inf else None,
+            high if high != -math.inf else None,
+        )
+
+
+class HistogramRing:
+    """Latency histogram and jitter over a trailing window: per time slot a sparse bucket
+    map in the same log buckets as the persisted minute histograms, and the sum and count of
+    latency differences between consecutive replies; expired slots are dropped whole."""
+
+    def __init__(self, slot_seconds: int, slots: int):
+        self.slot_seconds = slot_seconds
+        self._slots: list[dict[int, int]] = [{} for _ in range(slots)]
+        self._jitter_sum = array("d", bytes(8 * slots))
+        self._jitter_count = array("L", bytes(array("L").itemsize * slots))
+        self._head: int | None = None
+
+    def _index(self, ts: float) -> int | None:
+        slot = int(ts // self.slot_seconds)
+        size = len(self._slots)
+        if self._head is None or slot > self._head:
+            if self._head is None or slot - self._head >= size:
+                self._clear(range(size))
+            else:
+                self._clear(new % size for new in range(self._head + 1, slot + 1))
+            self._head = slot
+        if self._head - slot >= size:
+            return None
+        return slot % size
+
+    def _clear(self, positions) -> None:
+        for i in positions:
+            self._slots[i] = {}
+            self._jitter_sum[i] = 0.0
+            self._jitter_count[i] = 0
+
+    def add(self, ts: float, latency_ms: float, jitter_ms: float | None) -> None:
+        """Record one reply; jitter_ms is its difference to the previous reply, if any."""
+        i = self._index(ts)
+        if i is not None:
+            buckets = self._slots[i]
+            key = bucket_key(latency_ms)
+            buckets[key] = buckets.get(key, 0) + 1
+            if jitter_ms is not None:
+                self._jitter_sum[i] += jitter_ms
+                self._jitter_count[i] += 1
+
+    def add_data(self, ts: float, data: bytes, jitter_sum: float, jitter_count: int) -> None:
+        """Merge a persisted minute histogram."""
+        i = self._index(ts)
+        if i is not None:
+            decode_histogram(data, self._slots[i])
+            self._jitter_sum[i] += jitter_sum
+            self._jitter_count[i] += jitter_count
+
+    def summary(self, quantiles: tuple[float, ...], now: float) -> tuple[list[float | None], float | None]:
+        """Latency quantiles and mean jitter over the window."""
+        merged: dict[int, int] = {}
+        jitter_sum = 0.0
+        jitter_count = 0
+        head = int(now // self.slot_seconds)
+        size = len(self._slots)
+        if self._head is not None:
+            for slot in range(max(self._head - size + 1, head - size + 1), self._head + 1):
+                i = slot % size
+                for key, n in self._slots[i].items():
+                    merged[key] = merged.get(key, 0) + n
+                jitter_sum += self._jitter_sum[i]
+                jitter_count += self._jitter_count[i]
+        return percentiles(merged, quantiles), jitter_sum / jitter_count if jitter_count else None
+
+
+class StreamStats:
+    """Live statistics of one device and ping type."""
+
+    __slots__ = ("windows", "recent", "histogram", "last_latency")
+
+    def __init__(self):
+        self.windows = SlidingWindows(WINDOW_SLOT_SECONDS, LOSS_WINDOWS)
+        # One-second slots for the status machine's degraded-recovery window
+        self.recent = SlidingWindows(1, {"degraded": settings.degraded_window_seconds})
+        self.histogram = HistogramRing(PERCENTILE_SLOT_SECONDS, PERCENTILE_SLOTS)
+        self.last_latency: float | None = None
+
+    def record(self, ts: float, latency_ms: float | None) -> None:
+        self.windows.add(ts, latency_ms)
+        self.recent.add(ts, latency_ms)
+        if latency_ms is None:
+            return
+        # Jitter as the minute histograms store it: mean difference between consecutive replies
+        jitter = abs(latency_ms - self.last_latency) if self.last_latency is not None else None
+        self.histogram.add(ts, latency_ms, jitter)
+        self.last_latency = latency_ms
+
+
+class StatsEngine:
+    """In-memory statistics for every device and ping type, updated as probes complete.
+
+    The stats endpoints and the status machine read from here instead of aggregating
+    rollups in SQL. Rebuilt in the background on startup, so probing doesn't wait for it:
+    samples from the second the rebuild starts on are recorded live, everything before it
+    is read from the 1m and 1s rollups and the persisted minute histograms. With probes
+    running in another process, samples still in flight there are given `settle` seconds
+    to reach the database first.
+    """
+
+    def __init__(self):
+        self._streams: dict[tuple[int, str], StreamStats] = {}
+        self._cutoff = 0
+        self._rebuild_task: asyncio.Task | None = None
+
+    def _stream(self, device_id: int, ping_type: str) -> StreamStats:
+        stream = self._streams.get((device_id, ping_type))
+        if stream is None:
+            stream = self._streams[(device_id, ping_type)] = StreamStats()
+        return stream
+
+    def _device_streams(self, device_id: int) -> list[StreamStats]:
+        return [s for (d, _), s in self._streams.items() if d == device_id]
+
+    def record(self, device_id: int, results: list[dict]) -> None:
+        for result in results:
+            if result["timestamp"] < self._cutoff:
+                # Already in the database the rebuild reads
+                continue
+            latency = None if result["packet_lost"] else result["latency_ms"]
+            self._stream(device_id, result["ping_type"]).record(result["timestamp"], latency)
+
+    def discard(self, device_id: int) -> None:
+        for key in [k for k in self._streams if k[0] == device_id]:
+            del self._streams[key]
+
+    def window_totals(self, device_id: int) -> dict[str, WindowTotals]:
+        """Totals for every loss window, summed over the device's ping types."""
+        now = time.time()
+        streams = self._device_streams(device_id)
+        return {name: _merge([s.windows.totals(name, now) for s in streams]) for name in LOSS_WINDOWS}
+
+    def recent_loss_pct(self, device_id: int) -> float:
+        """Loss over the last degraded_window_seconds, 0 without samples."""
+        now = time.time()
+        totals = _merge([s.recent.totals("degraded", now) for s in self._device_streams(device_id)])
+        return totals.loss_pct() or 0.0
+
+    def latency_summary(self, device_id: int) -> dict:
+        """p50/p90/p99/p99.9 latency and mean jitter over the last 24h, of the
+        device's ICMP samples when it has any (ARP replies come from a different path)."""
+        streams = {t: s for (d, t), s in self._streams.items() if d == device_id}
+        stream = streams.get("icmp") or streams.get("arp")
+        if stream is None:
+            return {"p50": None, "p90": None, "p99": None, "p999": None, "jitter": None}
+        (p50, p90, p99, p999), jitter = stream.histogram.summary((0.5, 0.9, 0.99, 0.999), time.time())
+        return {"p50": p50, "p90": p90, "p99": p99, "p999": p999, "jitter": jitter}
+
+    def start_rebuild(self, settle: float = 0.0) -> None:
+        if self._rebuild_task:
+            self._rebuild_task.cancel()
+        self._streams.clear()
+        self._cutoff = int(time.time())
+        self._rebuild_task = asyncio.create_task(self._rebuild(self._cutoff, settle))
+
+    def stop(self) -> None:
+        if self._rebuild_task:
+            self._rebuild_task.cancel()
+
+    async def _rebuild(self, cutoff: int, settle: float) -> None:
+        await asyncio.sleep(settle)
+        started = time.monotonic()
+        try:
+            async with async_session() as session:
+                buckets = await self._load(session, cutoff)
+            logger.info("Stats engine rebuilt from %d buckets, %d streams in %.1fs",
+                        buckets, len(self._streams), time.monotonic() - started)
+        except Exception:
+            logger.exception("Stats engine rebuild failed")
+
+    async def _load(self, session: AsyncSession, cutoff: int) -> int:
+        """Add every rollup and histogram from before cutoff; the whole minutes of the loss
+        windows come from the 1m rollups, the rest of the cutoff's minute from the 1s ones."""
+        minute = cutoff // WINDOW_SLOT_SECONDS * WINDOW_SLOT_SECONDS
+        recent_since = cutoff - settings.degraded_window_seconds
+        buckets = 0
+        # Any order will do, the rings place every bucket by its timestamp
+        result = await session.stream(
+            select(
+                PingRollup.device_id, PingRollup.ping_type, PingRollup.bucket_ts, PingRollup.count,
+                PingRollup.lost, PingRollup.latency_sum, PingRollup.latency_min, PingRollup.latency_max,
+            )
+            .where(
+                PingRollup.resolution == WINDOW_SLOT_SECONDS,
+                PingRollup.bucket_ts >= cutoff - max(LOSS_WINDOWS.values()),
+                PingRollup.bucket_ts < minute,
+            )
+        )
+        async for rows in result.partitions(REBUILD_CHUNK):
+            for device_id, ping_type, ts, count, lost, latency_sum, low, high in rows:
+                self._stream(device_id, ping_type).windows.add_bucket(ts, count, lost, latency_sum or 0.0, low, high)
+            buckets += len(rows)
+
+        result = await session.stream(
+            select(
+                PingRollup.device_id, PingRollup.ping_type, PingRollup.bucket_ts, PingRollup.count,
+                PingRollup.lost, PingRollup.latency_sum, PingRollup.latency_min, PingRollup.latency_max,
+            )
+            .where(
+                PingRollup.resolution == 1,
+                PingRollup.bucket_ts >= min(recent_since, minute),
+                PingRollup.bucket_ts < cutoff,
+            )
+        )
+        async for rows in result.partitions(REBUILD_CHUNK):
+            for device_id, ping_type, ts, count, lost, latency_sum, low, high in rows:
+                stream = self._stream(device_id, ping_type)
+                if ts >= recent_since:
+                    stream.recent.add_bucket(ts, count, lost, latency_sum or 0.0, low, high)
+                if ts >= minute:
+                    stream.windows.add_bucket(ts, count, lost, latency_sum or 0.0, low, high)
+            buckets += len(rows)
+
+        # The histograms are per minute, so the part of the cutoff's minute before it is left out
+        result = await session.stream(
+            select(LatencyHistogram.device_id, LatencyHistogram.ping_type, LatencyHistogram.bucket_ts,
+                   LatencyHistogram.jitter_sum, LatencyHistogram.jitter_count, LatencyHistogram.data)
+            .where(
+                LatencyHistogram.bucket_ts >= cutoff - PERCENTILE_SLOTS * PERCENTILE_SLOT_SECONDS,
+                LatencyHistogram.bucket_ts < minute,
+            )
+        )
+        async for rows in result.partitions(REBUILD_CHUNK):
+            for device_id, ping_type, ts, jitter_sum, jitter_count, data in rows:
+                self._stream(device_id, ping_type).histogram.add_data(ts, data, jitter_sum, jitter_count)
+            buckets += len(rows)
+        return buckets
+
+
+def _merge(parts: list[WindowTotals]) -> WindowTotals:
+    parts = [p for p in parts if p.total]
+    if not parts:
+        return EMPTY_TOTALS
+    lows = [p.min for p in parts if p.min is not None]
+    highs = [p.max for p in parts if p.max is not None]
+    return WindowTotals(
+        sum(p.total for p in parts),
+        sum(p.lost for p in parts),
+        sum(p.latency_sum for p in parts),
+        min(lows) if lows else None,
+        max(highs) if highs else None,
+    )
+
+
+stats_engine = StatsEngine()
+
+
+def window_stats(device_ids: list[int]) -> dict[int, dict[str, WindowTotals]]:
+    """Totals for every loss window of every device."""
+    return {device_id: stats_engine.window_totals(device_id) for device_id in device_ids}
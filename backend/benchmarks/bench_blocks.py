@@ -0,0 +1,147 @@
+"""Measure the compressed block storage engine against plain sample rows.
+
+Fills a database with one device pinged every `interval` seconds for `hours` hours, then
+reports bytes per sample as compact rows and after compaction into blocks, and the time
+to build a graph over the whole range three ways: the original raw GROUP BY over a
+one-row-per-sample table, decoding every block and bucketing in Python, and the rollups
+the graph endpoint actually reads.
+
+Usage (from backend/):
+    python benchmarks/bench_blocks.py [hours] [interval]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="badping-bench-"), "bench.db")
+os.environ["BADPING_DB_PATH"] = DB_PATH
+
+from sqlalchemy import select  # noqa: E402
+
+from app.database import async_session, engine, init_db  # noqa: E402
+from app.models import Device, PingRollup  # noqa: E402
+from app.services.compaction_service import CompactionService  # noqa: E402
+from app.services.device_registry import device_registry  # noqa: E402
+from app.services.rollup_service import apply_rollups  # noqa: E402
+from app.services.sample_store import days_between, fetch_day, insert_samples  # noqa: E402
+
+BUCKET = 10
+
+
+def make_samples(device_id: int, start: float, hours: float, interval: float) -> list[tuple]:
+    rows = []
+    for i in range(int(hours * 3600 / interval)):
+        ts = start + i * interval + random.gauss(0, 0.00015)
+        lost = random.random() < 0.01
+        latency = None if lost else round(max(0.05, random.lognormvariate(-0.7, 0.25)), 3)
+        rows.append((device_id, ts, "icmp", latency, lost))
+    return rows
+
+
+def storage_bytes(prefix: str) -> int:
+    conn = sqlite3.connect(DB_PATH)
+    size = conn.execute("SELECT TOTAL(pgsize) FROM dbstat WHERE name LIKE ?", (prefix + "%",)).fetchone()[0]
+    conn.close()
+    return int(size)
+
+
+def legacy_group_by(rows: list[tuple], start: float, end: float) -> float:
+    """Time the pre-rollup graph query over a one-row-per-sample ping_results table."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(
+        "CREATE TABLE ping_results_legacy (id INTEGER PRIMARY KEY, device_id INTEGER NOT NULL, "
+        "timestamp FLOAT NOT NULL, ping_type VARCHAR NOT NULL, latency_ms FLOAT, packet_lost BOOLEAN NOT NULL)"
+    )
+    conn.execute("CREATE INDEX idx_legacy_device_time ON ping_results_legacy (device_id, timestamp)")
+    conn.executemany(
+        "INSERT INTO ping_results_legacy (device_id, timestamp, ping_type, latency_ms, packet_lost) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    began = time.perf_counter()
+    conn.execute(
+        f"SELECT CAST(timestamp / {BUCKET} AS INTEGER) * {BUCKET}, AVG(latency_ms), "
+        "MAX(CAST(packet_lost AS INTEGER)), ping_type FROM ping_results_legacy "
+        "WHERE device_id = ? AND timestamp >= ? AND timestamp <= ? "
+        f"GROUP BY CAST(timestamp / {BUCKET} AS INTEGER), ping_type",
+        (rows[0][0], start, end),
+    ).fetchall()
+    elapsed = time.perf_counter() - began
+    conn.close()
+    return elapsed
+
+
+async def run(hours: float, interval: float) -> None:
+    await init_db()
+    async with async_session() as session:
+        device = Device(name="bench", ip_address="127.0.0.1", interval_seconds=interval)
+        session.add(device)
+        await session.commit()
+        device_id = device.id
+    await device_registry.load()
+
+    end = time.time() // 60 * 60 - 60
+    start = end - hours * 3600
+    rows = make_samples(device_id, start, hours, interval)
+    n = len(rows)
+    for i in range(0, n, 100_000):
+        async with engine.begin() as conn:
+            await insert_samples(conn, rows[i:i + 100_000])
+            await apply_rollups(conn, rows[i:i + 100_000])
+
+    row_bytes = storage_bytes("samples_")
+    began = time.perf_counter()
+    await CompactionService()._run_compaction()
+    compact_seconds = time.perf_counter() - began
+    block_bytes = storage_bytes("blocks_") + storage_bytes("samples_")
+    print(f"samples            {n:>12,}")
+    print(f"rows               {row_bytes / n:>12.2f} B/sample")
+    print(f"blocks             {block_bytes / n:>12.2f} B/sample ({row_bytes / block_bytes:.1f}x smaller)")
+    print(f"compaction         {n / compact_seconds:>12,.0f} samples/s")
+
+    began = time.perf_counter()
+    samples = []
+    async with async_session() as session:
+        for day in days_between(start, end):
+            samples += await fetch_day(session, device_id, day, round(start * 1_000_000), round(end * 1_000_000))
+    buckets: dict[int, list] = {}
+    width = BUCKET * 1_000_000
+    for ts, _, latency in samples:
+        b = buckets.get(ts // width)
+        if b is None:
+            b = buckets[ts // width] = [0, 0, False]
+        if latency < 0:
+            b[2] = True
+        else:
+            b[0] += latency
+            b[1] += 1
+    decode_seconds = time.perf_counter() - began
+
+    began = time.perf_counter()
+    async with async_session() as session:
+        (await session.execute(
+            select(PingRollup).where(
+                PingRollup.device_id == device_id,
+                PingRollup.resolution == BUCKET,
+                PingRollup.bucket_ts >= start,
+                PingRollup.bucket_ts <= end,
+            )
+        )).scalars().all()
+    rollup_seconds = time.perf_counter() - began
+
+    group_by_seconds = legacy_group_by(rows, start, end)
+    print(f"graph, raw GROUP BY{group_by_seconds:>12.3f} s")
+    print(f"graph, block decode{decode_seconds:>12.3f} s ({len(samples) / decode_seconds:,.0f} samples/s)")
+    print(f"graph, rollups     {rollup_seconds:>12.3f} s")
+
+
+if __name__ == "__main__":
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    asyncio.run(run(hours, interval))
@@ -0,0 +1,86 @@
+"""Compare ping sample insert throughput: one INSERT per sample (what the ORM unit of work
+emitted) vs. the batched executemany used by the flush loop.
+
+Usage (from backend/):
+    python benchmarks/bench_flush.py [sizes...]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["BADPING_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="badping-bench-"), "bench.db")
+
+from sqlalchemy import delete  # noqa: E402
+
+from app.database import async_session, engine, init_db  # noqa: E402
+from app.models import Device  # noqa: E402
+from app.services.sample_store import (  # noqa: E402
+    SAMPLE_COLUMNS,
+    ensure_partition,
+    insert_samples,
+    partition_day,
+    partitions_between,
+)
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def make_batch(n: int, device_id: int) -> list[tuple]:
+    # Start of a day so the whole batch lands in one partition
+    start = partition_day(time.time()) * 86400.0
+    batch = []
+    for i in range(n):
+        lost = random.random() < 0.01
+        latency = None if lost else round(random.uniform(0.2, 20), 3)
+        batch.append((device_id, start + i * 0.01, "icmp", latency, lost))
+    return batch
+
+
+async def flush_rows(batch: list[tuple]) -> None:
+    async with async_session() as session:
+        conn = await session.connection()
+        table = await ensure_partition(conn, partition_day(batch[0][1]))
+        for row in batch:
+            await session.execute(table.insert().values(dict(zip(SAMPLE_COLUMNS, row))))
+        await session.commit()
+
+
+async def flush_batched(batch: list[tuple]) -> None:
+    async with async_session() as session:
+        await insert_samples(await session.connection(), batch)
+        await session.commit()
+
+
+async def clear_samples() -> None:
+    async with engine.begin() as conn:
+        for table in partitions_between(0, time.time() + 86400 * 365):
+            await conn.execute(delete(table))
+
+
+async def run(sizes: list[int]) -> None:
+    await init_db()
+    async with async_session() as session:
+        device = Device(name="bench", ip_address="127.0.0.1")
+        session.add(device)
+        await session.commit()
+        device_id = device.id
+
+    print(f"{'rows':>10} {'per-row rows/s':>15} {'batched rows/s':>15} {'speedup':>8}")
+    for n in sizes:
+        batch = make_batch(n, device_id)
+        rates = []
+        for flush in (flush_rows, flush_batched):
+            await clear_samples()
+            start = time.perf_counter()
+            await flush(batch)
+            rates.append(n / (time.perf_counter() - start))
+        print(f"{n:>10} {rates[0]:>15,.0f} {rates[1]:>15,.0f} {rates[1] / rates[0]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or DEFAULT_SIZES
+    asyncio.run(run(sizes))
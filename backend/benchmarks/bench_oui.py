@@ -0,0 +1,110 @@
+"""Compare MAC vendor lookups through scapy's manuf database (the old mac_vendor_lookup)
+with the OUI index: lookup throughput, and the time and memory the first lookup of a
+fresh process costs, with the index file already saved and when it has to be built.
+
+Usage (from backend/):
+    python benchmarks/bench_oui.py [lookups]
+"""
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["BADPING_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="badping-bench-"), "bench.db")
+
+from app.services.oui_index import index_path, oui_index  # noqa: E402
+
+DEFAULT_LOOKUPS = 200_000
+# scapy's ManufDA has no __contains__, so every lookup scans all ~50k entries
+SCAPY_LOOKUPS = 2_000
+
+COLD_START = {
+    "scapy manufdb": (
+        "from scapy.layers.l2 import conf\n"
+        "conf.manufdb._resolve_MAC('00:1b:c5:00:00:01')\n"
+    ),
+    "oui index (saved)": (
+        "from app.services.oui_index import oui_index\n"
+        "oui_index.lookup('00:1b:c5:00:00:01')\n"
+    ),
+}
+
+
+def scapy_lookup(mac: str) -> str | None:
+    from scapy.layers.l2 import conf
+    result = conf.manufdb._resolve_MAC(mac)
+    if not result or result.upper() == mac.upper():
+        return None
+    vendor = result.split(":")[0] if ":" in result else result
+    return vendor if vendor else None
+
+
+def make_macs(n: int) -> list[str]:
+    # Mostly registered prefixes, as discovery sees them, plus some random ones
+    oui_index.load()
+    known = [prefix for prefix in oui_index._tables[24]]
+    macs = []
+    for _ in range(n):
+        if random.random() < 0.8:
+            value = random.choice(known) << 24 | random.getrandbits(24)
+        else:
+            value = random.getrandbits(48)
+        macs.append(value.to_bytes(6, "big").hex(":"))
+    return macs
+
+
+def cold_start(name: str, code: str) -> None:
+    script = (
+        "import resource, sys, time\n"
+        f"sys.path.insert(0, {os.path.join(os.path.dirname(__file__), '..')!r})\n"
+        # Loaded by the app long before the first lookup
+        "import app.config\n"
+        "before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "start = time.perf_counter()\n"
+        f"{code}"
+        "elapsed = time.perf_counter() - start\n"
+        "after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "print(elapsed, (after - before) / 1024)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=os.environ, check=True)
+    elapsed, rss = map(float, out.stdout.split())
+    print(f"  {name:<24} first lookup {elapsed * 1000:8.1f} ms   peak RSS +{rss:6.1f} MB")
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_LOOKUPS
+
+    print("Cold start (fresh process):")
+    if index_path().exists():
+        index_path().unlink()
+    cold_start("oui index (build)", COLD_START["oui index (saved)"])
+    for name, code in COLD_START.items():
+        cold_start(name, code)
+    print(f"  index file {index_path().stat().st_size / 1024:.0f} KiB")
+
+    macs = make_macs(n)
+    scapy_lookup(macs[0])
+    print(f"\nThroughput ({n:,} lookups):")
+    results = {}
+    for name, lookup, count in (
+        ("scapy manufdb", scapy_lookup, min(n, SCAPY_LOOKUPS)),
+        ("oui index", oui_index.lookup, n),
+    ):
+        start = time.perf_counter()
+        results[name] = [lookup(mac) for mac in macs[:count]]
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<24} {count / elapsed:12,.0f} lookups/s")
+
+    # scapy only knows 24-bit prefixes, so it names the registry for MA-M/MA-S blocks
+    compared = len(results["scapy manufdb"])
+    differ = sum(a != b for a, b in zip(results["scapy manufdb"], results["oui index"]))
+    print(f"  answers differing from scapy: {differ} of {compared}")
+    print(f"  this process peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
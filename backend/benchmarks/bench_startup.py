@@ -0,0 +1,160 @@
+"""Measure API cold start: what importing the app costs, and how long a fresh uvicorn
+process takes to answer its first HTTP request and to send its first ping.
+
+Seeds a database with devices pinging localhost and 48h of rollups and latency
+histograms (what the stats engine rebuilds from on startup), then starts uvicorn on it.
+
+Usage (from backend/):
+    python benchmarks/bench_startup.py [devices]
+"""
+import asyncio
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND)
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="badping-bench-"), "bench.db")
+os.environ["BADPING_DB_PATH"] = DB_PATH
+
+DEFAULT_DEVICES = 50
+HOURS = 48
+# Modules that should only load once ARP, discovery or nmap is used
+LAZY_MODULES = ("scapy", "netifaces", "netifaces2")
+
+
+def import_costs() -> None:
+    """Cumulative import time of `app.main` per top-level package, from -X importtime."""
+    code = (
+        "import sys, app.main\n"
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND, capture_output=True, text=True, check=True,
+    )
+    packages: dict[str, int] = {}
+    total = 0
+    for line in out.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if not match:
+            continue
+        self_us, name = int(match.group(1)), match.group(4)
+        top = name if name.startswith("app.") else name.split(".")[0]
+        packages[top] = packages.get(top, 0) + self_us
+        total += self_us
+    print(f"Import of app.main: {total / 1000:.0f} ms")
+    for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:12]:
+        print(f"  {name:<32} {us / 1000:7.1f} ms")
+    print(f"  lazy modules loaded by the import: {out.stdout.strip() or 'none'}")
+
+
+def seed(devices: int) -> None:
+    from app.database import engine, init_db
+
+    async def create_schema():
+        await init_db()
+        await engine.dispose()
+
+    asyncio.run(create_schema())
+    now = int(time.time())
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany(
+        "INSERT INTO devices (name, ip_address, fingerprint_enabled, ping_type, interval_seconds, packet_size, "
+        "retention_days, monitoring_enabled, status, created_at, updated_at) "
+        "VALUES (?, '127.0.0.1', 0, 'icmp', 1.0, 64, 14, 1, 'unknown', ?, ?)",
+        [(f"bench-{i}", now, now) for i in range(devices)],
+    )
+    start = now - HOURS * 3600
+    for device_id in range(1, devices + 1):
+        conn.executemany(
+            "INSERT INTO ping_rollups (device_id, ping_type, resolution, bucket_ts, count, lost, latency_sum, "
+            "latency_min, latency_max, latency_sumsq) VALUES (?, 'icmp', 60, ?, 60, ?, 60.0, 0.5, 2.0, 80.0)",
+            [(device_id, ts, random.random() < 0.05) for ts in range(start - start % 60, now, 60)],
+        )
+        conn.executemany(
+            "INSERT INTO latency_histograms (device_id, ping_type, bucket_ts, jitter_sum, jitter_count, data) "
+            "VALUES (?, 'icmp', ?, 12.0, 59, ?)",
+            [(device_id, ts, bytes([0x9c, 0x02, 30, 1, 20, 1, 10])) for ts in range(now - 86400 - now % 60, now, 60)],
+        )
+    conn.commit()
+    conn.close()
+
+
+def first_sample_ts() -> float | None:
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'samples_%'")]
+        stamps = [conn.execute(f"SELECT min(ts_us) FROM {t}").fetchone()[0] for t in tables]
+        stamps = [ts for ts in stamps if ts is not None]
+        return min(stamps) / 1e6 if stamps else None
+    finally:
+        conn.close()
+
+
+def cold_start() -> None:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    started = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=os.environ,
+    )
+    try:
+        first_http = None
+        while first_http is None:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn exited")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as response:
+                    if response.status == 200:
+                        first_http = time.time() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/status", timeout=10):
+            status_ready = time.time() - started
+
+        first_ping = None
+        deadline = time.time() + 30
+        while first_ping is None and time.time() < deadline:
+            time.sleep(0.2)
+            ts = first_sample_ts()
+            if ts is not None:
+                first_ping = ts - started
+        rss = None
+        try:
+            with open(f"/proc/{proc.pid}/status") as status:
+                rss = next(int(line.split()[1]) for line in status if line.startswith("VmRSS"))
+        except OSError:
+            pass
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print(f"  first HTTP 200       {first_http * 1000:8.0f} ms")
+    print(f"  /api/status answered {status_ready * 1000:8.0f} ms")
+    print(f"  first ping sent      {first_ping * 1000:8.0f} ms" if first_ping else "  first ping sent      (none within 30 s)")
+    if rss:
+        print(f"  worker RSS           {rss / 1024:8.0f} MB")
+
+
+def main() -> None:
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DEVICES
+    import_costs()
+    print(f"\nSeeding {devices} devices with {HOURS}h of rollups...")
+    seed(devices)
+    print("Cold start:")
+    cold_start()
+
+
+if __name__ == "__main__":
+    main()
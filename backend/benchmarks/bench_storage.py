@@ -0,0 +1,82 @@
+"""Measure on-disk bytes per ping sample before and after the compact sample layout.
+
+Builds a database with the legacy ping_results table (integer PK, REAL timestamp, TEXT
+ping_type, REAL latency, boolean, plus the device_id+timestamp index), measures it, then
+runs the startup migration and measures the compact WITHOUT ROWID day partitions.
+
+Usage (from backend/):
+    python benchmarks/bench_storage.py [samples]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="badping-bench-"), "bench.db")
+os.environ["BADPING_DB_PATH"] = DB_PATH
+
+from app.database import engine, init_db  # noqa: E402
+
+DEVICES = 10
+
+
+def build_legacy(n: int) -> None:
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(
+        "CREATE TABLE ping_results (id INTEGER PRIMARY KEY, device_id INTEGER NOT NULL, "
+        "timestamp FLOAT NOT NULL, ping_type VARCHAR NOT NULL, latency_ms FLOAT, packet_lost BOOLEAN NOT NULL)"
+    )
+    conn.execute("CREATE INDEX idx_ping_results_device_time ON ping_results (device_id, timestamp)")
+    # One sample per device per second, interleaved like the flush loop writes them
+    start = time.time() - n / DEVICES
+    rows = []
+    for i in range(n):
+        lost = random.random() < 0.01
+        latency = None if lost else round(random.uniform(0.2, 20), 3)
+        rows.append((i % DEVICES + 1, start + i // DEVICES + random.random() * 0.001, "icmp", latency, lost))
+    conn.executemany(
+        "INSERT INTO ping_results (device_id, timestamp, ping_type, latency_ms, packet_lost) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def measure(label: str, n: int) -> float:
+    conn = sqlite3.connect(DB_PATH)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    sizes = conn.execute(
+        "SELECT name, SUM(pgsize) FROM dbstat WHERE name = 'ping_results' OR name LIKE 'samples_%' "
+        "OR name LIKE 'idx_ping_results%' GROUP BY name"
+    ).fetchall()
+    conn.close()
+    tables = sum(size for name, size in sizes if not name.startswith("idx_"))
+    indexes = sum(size for name, size in sizes if name.startswith("idx_"))
+    per_sample = (tables + indexes) / n
+    print(
+        f"{label:>8}: table {tables / n:6.1f} B/sample, index {indexes / n:6.1f} B/sample, "
+        f"total {per_sample:6.1f} B/sample ({(tables + indexes) / page_size:,.0f} pages)"
+    )
+    return per_sample
+
+
+async def migrate() -> None:
+    await init_db()
+    await engine.dispose()
+
+
+def main(n: int) -> None:
+    build_legacy(n)
+    before = measure("legacy", n)
+    asyncio.run(migrate())
+    after = measure("compact", n)
+    print(f"{before / after:.2f}x smaller")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Before app.config is imported: keep the tests' database out of /data
+os.environ.setdefault("BADPING_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="badping-tests-"), "badping.db"))
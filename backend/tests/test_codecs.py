@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from app.services.block_codec import BLOCK_SECONDS, decode_block, encode_block
+from app.services.histogram_service import decode_histogram, encode_histogram
+
+BLOCK_TS = 1_760_000_040
+
+
+def make_samples(count: int, loss: float = 0.0, seed: int = 0) -> list[tuple[int, int]]:
+    rng = random.Random(seed)
+    step = BLOCK_SECONDS * 1_000_000 // max(count, 1)
+    samples = []
+    for i in range(count):
+        ts = BLOCK_TS * 1_000_000 + i * step + rng.randrange(step)
+        latency = -1 if rng.random() < loss else rng.randrange(50, 2_000_000)
+        samples.append((ts, latency))
+    return samples
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 8, 9, 6000])
+def test_block_round_trip(count):
+    samples = make_samples(count)
+    assert decode_block(BLOCK_TS, encode_block(BLOCK_TS, samples)) == samples
+
+
+@pytest.mark.parametrize("count", [1, 8, 9, 600])
+def test_block_all_lost(count):
+    samples = [(ts, -1) for ts, _ in make_samples(count)]
+    assert decode_block(BLOCK_TS, encode_block(BLOCK_TS, samples)) == samples
+
+
+@pytest.mark.parametrize("count", [2, 8, 9, 17, 6000])
+def test_block_mixed_loss(count):
+    samples = make_samples(count, loss=0.3, seed=count)
+    # Losses at both ends, where there is no previous latency or bitmap byte to lean on
+    samples[0] = (samples[0][0], -1)
+    samples[-1] = (samples[-1][0], -1)
+    assert decode_block(BLOCK_TS, encode_block(BLOCK_TS, samples)) == samples
+
+
+def test_block_irregular_timestamps():
+    base = BLOCK_TS * 1_000_000
+    samples = [(base, 0), (base + 1, 1), (base + 59_999_999, 3_000_000), (base + 59_999_999, 0)]
+    assert decode_block(BLOCK_TS, encode_block(BLOCK_TS, samples)) == samples
+
+
+@pytest.mark.parametrize("buckets", [
+    {},
+    {0: 1},
+    {-1: 3},
+    {-349: 2, -5: 1, 0: 7, 1: 1, 400: 200_000},
+    {key: key * key + 1 for key in range(-200, 600, 3)},
+])
+def test_histogram_round_trip(buckets):
+    assert decode_histogram(encode_histogram(buckets)) == buckets
+
+
+def test_histogram_decode_into():
+    merged = decode_histogram(encode_histogram({-2: 1, 10: 4}), {10: 1, 11: 2})
+    assert merged == {-2: 1, 10: 5, 11: 2}
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from app.database import engine, init_db
+from app.models import Device, LatencyHistogram, Meta
+from app.services import sample_store
+from app.services.histogram_service import backfill_histograms
+
+START = 1_759_999_980.0  # On a minute boundary
+
+
+@pytest.fixture
+def device():
+    async def setup() -> int:
+        await init_db()
+        async with engine.begin() as conn:
+            result = await conn.execute(Device.__table__.insert().values(name="backfill", ip_address="192.0.2.1"))
+            return result.inserted_primary_key[0]
+
+    device_id = asyncio.run(setup())
+    yield device_id
+
+    async def teardown() -> None:
+        async with engine.begin() as conn:
+            await sample_store.delete_device_samples(conn, device_id)
+            await conn.execute(delete(LatencyHistogram).where(LatencyHistogram.device_id == device_id))
+            await conn.execute(delete(Device).where(Device.id == device_id))
+        await engine.dispose()
+
+    asyncio.run(teardown())
+
+
+async def backfill(device_id: int, samples: list[tuple]) -> int:
+    async with engine.begin() as conn:
+        await sample_store.insert_samples(conn, [(device_id, *sample) for sample in samples])
+        await conn.execute(delete(Meta))
+    await backfill_histograms(engine)
+    async with engine.connect() as conn:
+        return (await conn.execute(
+            select(func.count()).where(LatencyHistogram.device_id == device_id)
+        )).scalar()
+
+
+def test_backfill_is_recorded_without_histograms(device, monkeypatch):
+    assert asyncio.run(backfill(device, [(START + i, "icmp", None, True) for i in range(120)])) == 0
+
+    async def refetch(*args):
+        raise AssertionError("backfill ran again")
+
+    monkeypatch.setattr("app.services.histogram_service.fetch_day", refetch)
+    asyncio.run(backfill_histograms(engine))
+
+
+def test_backfill_keeps_existing_minutes(device):
+    samples = [(START + i, "icmp", 1.0 + i % 7, False) for i in range(600)]
+    assert asyncio.run(backfill(device, samples)) == 10
+
+    async def rerun() -> int:
+        # An interrupted backfill leaves some minutes behind
+        async with engine.begin() as conn:
+            await conn.execute(delete(LatencyHistogram).where(
+                LatencyHistogram.device_id == device, LatencyHistogram.bucket_ts >= START + 300,
+            ))
+        return await backfill(device, [])
+
+    assert asyncio.run(rerun()) == 10
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, insert, text
+
+from app.config import settings
+from app.database import async_session, engine, init_db
+from app.services import sample_store
+from app.services.export_service import iter_samples
+from app.services.sample_store import (
+    delete_device_samples,
+    encode_sample,
+    fetch_envelopes,
+    fetch_samples,
+    partition_day,
+    partition_table,
+)
+
+DEVICE_ID = 1
+START = 1_760_000_000.0
+
+
+@pytest.fixture
+def api_worker(monkeypatch):
+    """Partition state of an API worker next to a probe process that owns the partitions."""
+    asyncio.run(init_db())
+    monkeypatch.setattr(sample_store, "_existing", set())
+    monkeypatch.setattr(sample_store, "_block_days", set())
+    monkeypatch.setattr(sample_store, "_follow", True)
+    # The probe process writes through its own connection
+    prober = create_engine(f"sqlite:///{settings.db_path}")
+    yield prober
+    with prober.begin() as conn:
+        names = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'samples_%'"))
+        for (name,) in names.all():
+            conn.execute(text(f"DROP TABLE {name}"))
+    prober.dispose()
+    asyncio.run(engine.dispose())
+
+
+def write_samples(prober, start: float, count: int) -> None:
+    table = partition_table(partition_day(start))
+    table.create(prober, checkfirst=True)
+    rows = [encode_sample(DEVICE_ID, start + i, "icmp", 1.5, False) for i in range(count)]
+    with prober.begin() as conn:
+        conn.execute(insert(table), [dict(zip(sample_store.SAMPLE_COLUMNS, row)) for row in rows])
+
+
+async def read(start: float, end: float) -> tuple[list, list, list]:
+    async with async_session() as session:
+        samples = await fetch_samples(session, DEVICE_ID, start, end)
+        envelopes = await fetch_envelopes(session, DEVICE_ID, start, end, 60_000_000)
+    exported = [row async for page in iter_samples(DEVICE_ID, start, end) for row in page]
+    return samples, envelopes, exported
+
+
+def test_reads_partitions_created_by_the_probe_process(api_worker):
+    write_samples(api_worker, START, 10)
+    samples, envelopes, exported = asyncio.run(read(START, START + 100))
+    assert len(samples) == 10
+    assert sum(envelope[2] for envelope in envelopes) == 10
+    assert exported == samples
+
+    # A day the probe process starts after the worker is already running
+    next_day = (partition_day(START) + 1) * sample_store.PARTITION_SECONDS
+    write_samples(api_worker, next_day, 5)
+    samples, _, exported = asyncio.run(read(START, next_day + 100))
+    assert len(samples) == len(exported) == 15
+
+
+def test_deletes_samples_in_probe_process_partitions(api_worker):
+    write_samples(api_worker, START, 10)
+
+    async def delete() -> int:
+        async with async_session() as session:
+            deleted = await delete_device_samples(await session.connection(), DEVICE_ID)
+            await session.commit()
+        return deleted
+
+    assert asyncio.run(delete()) == 10
+    assert asyncio.run(read(START, START + 100)) == ([], [], [])
+
+
+def test_forgets_partitions_dropped_by_the_probe_process(api_worker):
+    write_samples(api_worker, START, 10)
+    assert len(asyncio.run(read(START, START + 100))[0]) == 10
+    partition_table(partition_day(START)).drop(api_worker)
+    assert asyncio.run(read(START, START + 100)) == ([], [], [])
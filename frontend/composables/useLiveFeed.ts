@@ -0,0 +1,39 @@
+type LiveHandler = (data: any) => void
+
+// One EventSource per tab, shared by every component that listens
+let source: EventSource | null = null
+const handlers = new Map<string, Set<LiveHandler>>()
+
+function dispatch(event: MessageEvent) {
+  const data = JSON.parse(event.data)
+  handlers.get(event.type)?.forEach(handler => handler(data))
+}
+
+export function useLiveFeed() {
+  const config = useRuntimeConfig()
+  const base = config.public.apiBase as string
+
+  function on(event: string, handler: LiveHandler): () => void {
+    if (!handlers.has(event)) {
+      handlers.set(event, new Set())
+      source?.addEventListener(event, dispatch)
+    }
+    handlers.get(event)!.add(handler)
+    if (!source) {
+      // EventSource reconnects by itself after network errors
+      source = new EventSource(`${base}/live`)
+      handlers.forEach((_, name) => source!.addEventListener(name, dispatch))
+    }
+
+    return () => {
+      handlers.get(event)?.delete(handler)
+      if ([...handlers.values()].every(set => set.size === 0)) {
+        source?.close()
+        source = null
+        handlers.clear()
+      }
+    }
+  }
+
+  return { on }
+}
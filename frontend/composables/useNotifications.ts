@@ -17,7 +17,9 @@ export function useNotifications() {
   const notifications = useState<Notification[]>('notifications', () => [])
   const unreadCount = useState('unreadCount', () => 0)
   const api = useApi()
+  const live = useLiveFeed()
   let interval: ReturnType<typeof setInterval> | null = null
+  let liveOff: (() => void) | null = null
 
   async function fetchNotifications() {
     try {
@@ -54,7 +56,12 @@ export function useNotifications() {
 
   function startPolling() {
     fetchNotifications()
-    interval = setInterval(fetchNotifications, 10000)
+    liveOff = live.on('notification', (notif: Notification) => {
+      notifications.value.unshift(notif)
+      unreadCount.value++
+    })
+    // The live stream carries new notifications; this only resyncs reads from other tabs
+    interval = setInterval(fetchNotifications, 60000)
   }
 
   function stopPolling() {
@@ -62,6 +69,10 @@ export function useNotifications() {
       clearInterval(interval)
       interval = null
     }
+    if (liveOff) {
+      liveOff()
+      liveOff = null
+    }
   }
 
   return { notifications, unreadCount, fetchNotifications, markRead, markAllRead, startPolling, stopPolling }